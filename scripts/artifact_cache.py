@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : artifact_cache.py
+#
+# Notes:
+#
+# A local cache of pinned artifacts downloaded by the test scripts, such as the
+# patched xunit.console.dll. An artifact is stored under a path derived from
+# its url, next to a <name>.sha256 file holding the sha256 of its contents:
+#
+#   <cache>/clrjit.blob.core.windows.net/xunit-console/xunit.console.dll-v2.4.1.zip
+#   <cache>/clrjit.blob.core.windows.net/xunit-console/xunit.console.dll-v2.4.1.zip.sha256
+#
+# An offline machine can be seeded by copying the artifact to that path; its
+# hash is recorded the first time it is used. A cached artifact is only used
+# while its contents match the recorded (and, if given, the expected) sha256,
+# otherwise it is downloaded again.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+
+if sys.version_info.major < 3:
+    import urllib
+    import urlparse
+else:
+    import urllib.parse as urlparse
+    import urllib.request
+
+from managed_assemblies import hash_file
+
+################################################################################
+# Globals
+################################################################################
+
+# Overrides the default cache location.
+artifact_cache_env_var = "CORECLR_ARTIFACT_CACHE"
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def get_default_artifact_cache_location():
+    """ Return $CORECLR_ARTIFACT_CACHE, or a directory under the user's home
+    """
+
+    location = os.environ.get(artifact_cache_env_var)
+    if location:
+        return location
+
+    return os.path.join(os.path.expanduser("~"), ".cache", "coreclr", "artifacts")
+
+def read_recorded_hash(path):
+    """ Return the sha256 recorded in path, or None
+    """
+
+    try:
+        with open(path) as file_handle:
+            return file_handle.read().strip().lower()
+    except (IOError, OSError):
+        return None
+
+################################################################################
+# Classes
+################################################################################
+
+class ArtifactCache(object):
+    """ Downloaded artifacts, keyed by url and verified by sha256
+    """
+
+    def __init__(self, cache_location):
+        self.cache_location = cache_location
+
+    def path_for(self, url):
+        """ Return where the artifact downloaded from url is kept
+
+        Args:
+            url (str): where the artifact is downloaded from
+        """
+
+        parsed_url = urlparse.urlparse(url)
+        parts = [part for part in parsed_url.path.split("/") if part not in ("", ".", "..")]
+
+        return os.path.join(self.cache_location, parsed_url.netloc, *parts)
+
+    def fetch(self, url, sha256=None):
+        """ Return a local copy of an artifact, downloading it if needed
+
+        Args:
+            url (str)       : where the artifact is downloaded from
+            sha256 (str)    : expected sha256 of the artifact, if it is known
+
+        Returns:
+            path (str): path of the verified artifact in the cache
+
+        Notes:
+            Raises an Exception if a fresh download does not match sha256.
+        """
+
+        path = self.path_for(url)
+        hash_path = path + ".sha256"
+        expected = sha256.lower() if sha256 is not None else None
+
+        if os.path.isfile(path):
+            actual = hash_file(path)
+            recorded = read_recorded_hash(hash_path)
+
+            if recorded is None and (expected is None or actual == expected):
+                # Seeded by hand; trust it from now on.
+                self.__record_hash__(hash_path, actual)
+                recorded = actual
+
+            if actual == recorded and (expected is None or actual == expected):
+                return path
+
+            print("Cached %s failed sha256 verification, downloading it again." % path)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        print("Downloading %s" % url)
+
+        urlretrieve = urllib.urlretrieve if sys.version_info.major < 3 else urllib.request.urlretrieve
+
+        # Download next to the final location, so the move into place is atomic
+        # and a killed download never looks like a cached artifact.
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(handle)
+
+        try:
+            urlretrieve(url, temp_path)
+            actual = hash_file(temp_path)
+
+            if expected is not None and actual != expected:
+                raise Exception("Downloaded %s has sha256 %s, expected %s" % (url, actual, expected))
+
+            if os.path.isfile(path):
+                os.remove(path)
+            shutil.move(temp_path, path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+        self.__record_hash__(hash_path, actual)
+        return path
+
+    def __record_hash__(self, hash_path, sha256):
+        with open(hash_path, "w") as file_handle:
+            file_handle.write(sha256 + "\n")
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : cpu_partitioning.py
+#
+# Notes:
+#
+# Keeps concurrently running tests off each other's cpus. When many tests run
+# at once on a large machine, the GC and threading tests (which size their
+# work and their GC heaps by the number of cpus) fight over the same cores,
+# which makes timings noisy and causes timeouts.
+#
+# The cpus this process may use are split into as many disjoint groups as
+# tests run at once. With numa_local, no group spans two NUMA nodes. Each test
+# is pinned (sched_setaffinity, inherited by everything the wrapper starts) to
+# the cpus of the groups it holds:
+#
+#   - a test holds one group
+#   - a heavy test (see find_heavy_tests) holds enough groups for
+#     heavy_cpu_count cpus, and no other test runs on them meanwhile
+#
+# Groups are handed out first come first served, so a heavy test waiting for
+# its groups is not starved by the tests behind it. The GC of each test is
+# told about its cpus through COMPlus_GCHeapAffinitizeMask and
+# COMPlus_GCHeapCount, unless they are already set.
+#
+# This needs to keep working with python2, as runtest.py still supports it,
+# although pinning itself needs python3 (os.sched_setaffinity) on Linux.
+#
+################################################################################
+################################################################################
+
+import math
+import multiprocessing
+import os
+import threading
+
+from collections import deque
+
+from test_history import median, normalize_test_name
+
+################################################################################
+# Globals
+################################################################################
+
+# Test directories (relative to the test location) whose tests are heavy.
+heavy_test_directories = ["GC", "baseservices/threading"]
+
+# A test that usually takes at least this many seconds is heavy.
+heavy_test_min_seconds = 60
+
+# A test that usually uses at least this many cpu seconds per second of wall
+# time (i.e. keeps this many cores busy) is heavy.
+heavy_test_min_cpu_ratio = 2.0
+
+# Number of cpus a heavy test gets, by default.
+default_heavy_cpu_count = 4
+
+# The most cpus COMPlus_GCHeapAffinitizeMask can name.
+gc_heap_affinitize_mask_cpu_count = 64
+
+numa_node_location = "/sys/devices/system/node"
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def is_cpu_partitioning_supported():
+    """ Return whether tests can be pinned to cpus on this platform
+    """
+
+    return hasattr(os, "sched_setaffinity") and hasattr(os, "sched_getaffinity")
+
+def get_available_cpus():
+    """ Return the sorted cpus this process may run on
+    """
+
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(multiprocessing.cpu_count()))
+
+def parse_cpu_list(text):
+    """ Parse a Linux cpu list, e.g. "0-3,8-11"
+
+    Returns:
+        cpus ([int]): sorted
+    """
+
+    cpus = set()
+    for item in text.strip().split(","):
+        if len(item) == 0:
+            continue
+
+        if "-" in item:
+            first, last = item.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(item))
+
+    return sorted(cpus)
+
+def get_numa_nodes(cpus):
+    """ Split cpus by NUMA node
+
+    Args:
+        cpus ([int]): cpus to split
+
+    Returns:
+        nodes ([[int]]): the cpus of each node that has any of them; a single
+                       : node with all of the cpus if the topology is unknown
+    """
+
+    nodes = []
+    remaining = set(cpus)
+
+    if os.path.isdir(numa_node_location):
+        names = [name for name in os.listdir(numa_node_location) if name.startswith("node") and name[len("node"):].isdigit()]
+
+        for name in sorted(names, key=lambda name: int(name[len("node"):])):
+            try:
+                with open(os.path.join(numa_node_location, name, "cpulist")) as file_handle:
+                    node_cpus = [cpu for cpu in parse_cpu_list(file_handle.read()) if cpu in remaining]
+            except (IOError, OSError, ValueError):
+                continue
+
+            if len(node_cpus) > 0:
+                nodes.append(node_cpus)
+                remaining.difference_update(node_cpus)
+
+    if len(remaining) > 0:
+        nodes.append(sorted(remaining))
+
+    return nodes
+
+def split_evenly(items, count):
+    """ Split a list into count contiguous parts whose sizes differ by at most one
+    """
+
+    size, extra = divmod(len(items), count)
+
+    parts = []
+    start = 0
+    for index in range(count):
+        end = start + size + (1 if index < extra else 0)
+        parts.append(items[start:end])
+        start = end
+
+    return parts
+
+def find_heavy_tests(tests, test_location, history):
+    """ Find the tests that should get cpus of their own
+
+    Args:
+        tests ([str])           : paths of the test wrappers
+        test_location (str)     : root of the built tests
+        history (TestHistory)   : history of the test configuration
+
+    Returns:
+        heavy_tests ({str}): paths of the heavy tests
+
+    Notes:
+        A test is heavy if it is under one of heavy_test_directories, or if
+        its history shows that it usually runs for heavy_test_min_seconds or
+        keeps heavy_test_min_cpu_ratio cores busy.
+    """
+
+    durations = history.durations()
+    usage = history.resource_usage()
+
+    heavy_tests = set()
+    for test in tests:
+        name = normalize_test_name(os.path.relpath(test, test_location))
+
+        if any(name.lower().startswith(directory.lower() + "/") for directory in heavy_test_directories):
+            heavy_tests.add(test)
+            continue
+
+        test_durations = durations.get(name)
+        if not test_durations:
+            continue
+
+        duration = median(test_durations)
+        if duration >= heavy_test_min_seconds:
+            heavy_tests.add(test)
+        elif name in usage and duration >= 1.0 and usage[name][0] / duration >= heavy_test_min_cpu_ratio:
+            heavy_tests.add(test)
+
+    return heavy_tests
+
+################################################################################
+# Classes
+################################################################################
+
+class CpuAllocator(object):
+    """ Hand out disjoint groups of cpus to the tests that run at once
+    """
+
+    def __init__(self, cpus, parallel_count, numa_local=False, heavy_tests=None, heavy_cpu_count=default_heavy_cpu_count):
+        """ Constructor
+
+        Args:
+            cpus ([int])            : cpus to split, see get_available_cpus
+            parallel_count (int)    : number of tests that run at once
+            numa_local (bool)       : do not let a group span NUMA nodes
+            heavy_tests ({str})     : paths of the heavy tests
+            heavy_cpu_count (int)   : cpus a heavy test gets
+        """
+
+        nodes = get_numa_nodes(cpus) if numa_local else [list(cpus)]
+        group_count = max(1, min(parallel_count, len(cpus)))
+
+        # Each node gets a share of the groups in proportion to its cpus.
+        self.groups = []
+        self.group_nodes = []
+        for node_index, node_cpus in enumerate(nodes):
+            node_group_count = max(1, min(len(node_cpus), int(round(group_count * float(len(node_cpus)) / len(cpus)))))
+
+            for group in split_evenly(node_cpus, node_group_count):
+                self.groups.append(group)
+                self.group_nodes.append(node_index)
+
+        group_size = float(len(cpus)) / len(self.groups)
+        largest_node_group_count = max(self.group_nodes.count(node_index) for node_index in range(len(nodes)))
+
+        self.heavy_tests = heavy_tests if heavy_tests is not None else set()
+        self.heavy_group_count = max(1, min(int(math.ceil(heavy_cpu_count / group_size)), largest_node_group_count))
+
+        self.free = set(range(len(self.groups)))
+        self.waiting = deque()
+        self.condition = threading.Condition()
+
+    def __find_free_groups__(self, count):
+        """ Return count free groups on one node (the lowest numbered first), or None
+        """
+
+        for node_index in sorted(set(self.group_nodes)):
+            groups = sorted(group for group in self.free if self.group_nodes[group] == node_index)
+            if len(groups) >= count:
+                return groups[:count]
+
+        return None
+
+    def acquire(self, test_path):
+        """ Wait for, and take, the groups of cpus of a test
+
+        Returns:
+            groups ([int]): to give back to release
+        """
+
+        count = self.heavy_group_count if test_path in self.heavy_tests else 1
+        ticket = object()
+
+        with self.condition:
+            self.waiting.append(ticket)
+            try:
+                while True:
+                    if self.waiting[0] is ticket:
+                        groups = self.__find_free_groups__(count)
+                        if groups is not None:
+                            self.free.difference_update(groups)
+                            return groups
+
+                    self.condition.wait()
+            finally:
+                self.waiting.remove(ticket)
+                self.condition.notify_all()
+
+    def release(self, groups):
+        with self.condition:
+            self.free.update(groups)
+            self.condition.notify_all()
+
+    def cpus(self, groups):
+        """ Return the sorted cpus of groups
+        """
+
+        return sorted(cpu for group in groups for cpu in self.groups[group])
+
+    def environment(self, env, cpus):
+        """ Return a copy of env that tells the GC of a test about its cpus
+
+        Notes:
+            Variables the environment already sets are left alone, as are
+            machines with cpus COMPlus_GCHeapAffinitizeMask cannot name.
+        """
+
+        environment = dict(env)
+
+        if max(cpus) < gc_heap_affinitize_mask_cpu_count:
+            mask = 0
+            for cpu in cpus:
+                mask |= 1 << cpu
+
+            # CLR config DWORDs are read as hex.
+            environment.setdefault("COMPlus_GCHeapAffinitizeMask", "%x" % mask)
+            environment.setdefault("COMPlus_GCHeapCount", "%x" % len(cpus))
+
+        return environment
+
+    def describe(self):
+        """ Return a one line summary of the groups
+        """
+
+        sizes = sorted(set(len(group) for group in self.groups))
+
+        return "%d groups of %s cpus on %d NUMA node(s); heavy tests get %d groups" % (len(self.groups),
+                                                                                       "/".join(str(size) for size in sizes),
+                                                                                       len(set(self.group_nodes)),
+                                                                                       self.heavy_group_count)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : file_hash_cache.py
+#
+# Notes:
+#
+# Content hashes of files, remembered across runs. A file is only read and
+# hashed again when its size or modification time changed since the hash was
+# recorded, so checking whether a large set of files is unchanged mostly costs
+# one stat per file.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import json
+import os
+import threading
+
+from managed_assemblies import hash_file
+
+################################################################################
+# Globals
+################################################################################
+
+file_hash_cache_version = 1
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def get_file_stamp(stat_result):
+    """ Return the (size, mtime in ns) pair used to detect a changed file
+    """
+
+    mtime_ns = getattr(stat_result, "st_mtime_ns", None)
+    if mtime_ns is None:
+        mtime_ns = int(stat_result.st_mtime * 1e9)
+
+    return [stat_result.st_size, mtime_ns]
+
+################################################################################
+# Classes
+################################################################################
+
+class FileHashCache(object):
+    """ sha256 of files, keyed by path and validated by size and mtime
+
+    Notes:
+        The cache is loaded from and saved to a json file. Hashes are
+        computed on demand; call save() to keep them for the next run. It is
+        safe to call hash() from several threads.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+        try:
+            with open(cache_file) as file_handle:
+                contents = json.load(file_handle)
+
+            if contents.get("version") == file_hash_cache_version:
+                self.entries = contents["entries"]
+        except (IOError, OSError, ValueError):
+            pass
+
+    def hash(self, path):
+        """ Return the sha256 hex digest of a file
+
+        Args:
+            path (str): file to hash
+        """
+
+        path = os.path.abspath(path)
+        stamp = get_file_stamp(os.stat(path))
+
+        with self.lock:
+            entry = self.entries.get(path)
+
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        sha = hash_file(path)
+
+        with self.lock:
+            self.entries[path] = [stamp, sha]
+            self.dirty = True
+
+        return sha
+
+    def save(self):
+        """ Write the cache back to disk, if anything changed
+        """
+
+        with self.lock:
+            if not self.dirty:
+                return
+
+            cache_dir = os.path.dirname(self.cache_file)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            temp_file = self.cache_file + ".tmp"
+            with open(temp_file, "w") as file_handle:
+                json.dump({ "version": file_hash_cache_version, "entries": self.entries }, file_handle)
+
+            if os.path.isfile(self.cache_file):
+                os.remove(self.cache_file)
+
+            os.rename(temp_file, self.cache_file)
+            self.dirty = False
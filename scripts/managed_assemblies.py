@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : managed_assemblies.py
+#
+# Notes:
+#
+# Shared discovery of managed assemblies for the coreclr scripts. Used by
+# superpmi.py to decide which assemblies to run pmi over and by runtest.py to
+# decide which assemblies in Core_Root to crossgen.
+#
+# Discovery is done without spawning any process. Directories are walked with
+# os.scandir, and each candidate file is classified by reading its PE header
+# and CLI header through a read-only mmap. Files with identical contents (for
+# example the same framework assembly copied into several test directories)
+# are only returned once.
+#
+################################################################################
+################################################################################
+
+import hashlib
+import mmap
+import os
+import struct
+
+from collections import defaultdict
+
+################################################################################
+# Globals
+################################################################################
+
+default_assembly_extensions = [".dll", ".exe"]
+
+# Offsets and constants from the PE/COFF and ECMA-335 specifications.
+dos_signature = b"MZ"
+dos_pe_offset_location = 0x3C
+pe_signature = b"PE\0\0"
+coff_header_size = 20
+section_header_size = 40
+
+pe32_magic = 0x10B
+pe32_plus_magic = 0x20B
+
+cli_header_directory_index = 14
+metadata_signature = 0x424A5342 # "BSJB"
+
+hash_chunk_size = 1024 * 1024
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def _list_dir(location):
+    """ List a directory as sorted (name, path, is_dir, is_file) tuples
+
+    Notes:
+        is_dir is False for symbolic links to directories. python2 has no
+        os.scandir (runtest.py still supports it), so fall back to listdir
+        and stat there.
+    """
+
+    if hasattr(os, "scandir"):
+        return sorted((entry.name, entry.path, entry.is_dir(follow_symlinks=False), entry.is_file()) for entry in os.scandir(location))
+
+    entries = []
+    for name in sorted(os.listdir(location)):
+        path = os.path.join(location, name)
+        is_dir = os.path.isdir(path) and not os.path.islink(path)
+        entries.append((name, path, is_dir, not is_dir and os.path.isfile(path)))
+
+    return entries
+
+def walk_files(location, extensions=None):
+    """ Recursively yield all files under location
+
+    Args:
+        location (str)      : directory to walk
+        extensions ([str])  : if not None, only yield files ending with one of
+                            : these (case insensitive) extensions
+
+    Notes:
+        Symbolic links to directories are not followed, to avoid cycles. The
+        entries of each directory are yielded in sorted order so the result is
+        deterministic across runs.
+    """
+
+    if extensions is not None:
+        extensions = tuple(item.lower() for item in extensions)
+
+    pending_dirs = [location]
+    while len(pending_dirs) > 0:
+        current_dir = pending_dirs.pop()
+
+        try:
+            entries = _list_dir(current_dir)
+        except OSError:
+            continue
+
+        sub_dirs = []
+        for name, path, is_dir, is_file in entries:
+            if is_dir:
+                sub_dirs.append(path)
+            elif is_file:
+                if extensions is None or name.lower().endswith(extensions):
+                    yield path
+
+        # Pop in sorted order.
+        pending_dirs += reversed(sub_dirs)
+
+def _rva_to_file_offset(image, section_table_offset, section_count, rva):
+    """ Translate an rva into a file offset using the section table
+
+    Returns:
+        file_offset (int): offset, or None if the rva is not in any section
+    """
+
+    for index in range(section_count):
+        section_offset = section_table_offset + (index * section_header_size)
+        virtual_size, virtual_address, raw_size, raw_pointer = struct.unpack_from("<IIII", image, section_offset + 8)
+
+        if virtual_address <= rva < virtual_address + max(virtual_size, raw_size):
+            return rva - virtual_address + raw_pointer
+
+    return None
+
+def _image_has_cli_metadata(image):
+    """ Parse the PE and CLI headers of a mapped image
+
+    Args:
+        image (mmap): read-only view over the whole file
+
+    Returns:
+        is_managed (bool): True if the image has a CLI header pointing to
+                         : valid metadata
+    """
+
+    image_size = len(image)
+
+    if image[0:2] != dos_signature or image_size < dos_pe_offset_location + 4:
+        return False
+
+    pe_offset = struct.unpack_from("<I", image, dos_pe_offset_location)[0]
+    coff_offset = pe_offset + 4
+
+    if coff_offset + coff_header_size > image_size or image[pe_offset:coff_offset] != pe_signature:
+        return False
+
+    section_count = struct.unpack_from("<H", image, coff_offset + 2)[0]
+    optional_header_size = struct.unpack_from("<H", image, coff_offset + 16)[0]
+
+    optional_header_offset = coff_offset + coff_header_size
+    section_table_offset = optional_header_offset + optional_header_size
+
+    if optional_header_size < 2 or section_table_offset > image_size:
+        return False
+
+    magic = struct.unpack_from("<H", image, optional_header_offset)[0]
+
+    if magic == pe32_magic:
+        rva_count_offset = 92
+    elif magic == pe32_plus_magic:
+        rva_count_offset = 108
+    else:
+        return False
+
+    if rva_count_offset + 4 > optional_header_size:
+        return False
+
+    rva_count = struct.unpack_from("<I", image, optional_header_offset + rva_count_offset)[0]
+    if rva_count <= cli_header_directory_index:
+        return False
+
+    cli_directory_offset = optional_header_offset + rva_count_offset + 4 + (cli_header_directory_index * 8)
+    if cli_directory_offset + 8 > section_table_offset:
+        return False
+
+    cli_header_rva, cli_header_size = struct.unpack_from("<II", image, cli_directory_offset)
+    if cli_header_rva == 0 or cli_header_size == 0:
+        return False
+
+    if section_table_offset + (section_count * section_header_size) > image_size:
+        return False
+
+    cli_header_offset = _rva_to_file_offset(image, section_table_offset, section_count, cli_header_rva)
+    if cli_header_offset is None or cli_header_offset + 16 > image_size:
+        return False
+
+    # The CLI header is: cb, MajorRuntimeVersion, MinorRuntimeVersion, MetaData (rva, size), ...
+    metadata_rva, metadata_size = struct.unpack_from("<II", image, cli_header_offset + 8)
+    if metadata_rva == 0 or metadata_size == 0:
+        return False
+
+    metadata_offset = _rva_to_file_offset(image, section_table_offset, section_count, metadata_rva)
+    if metadata_offset is None or metadata_offset + 4 > image_size:
+        return False
+
+    return struct.unpack_from("<I", image, metadata_offset)[0] == metadata_signature
+
+def is_managed_assembly(path):
+    """ Determine whether a file is a managed assembly
+
+    Args:
+        path (str): file to check
+
+    Returns:
+        is_managed (bool): True if the file is a PE image with a CLI header
+
+    Notes:
+        Only the headers are read. Anything that cannot be opened or mapped, or
+        that is truncated or malformed, is treated as not managed.
+    """
+
+    try:
+        with open(path, "rb") as file_handle:
+            if os.fstat(file_handle.fileno()).st_size < dos_pe_offset_location + 4:
+                return False
+
+            image = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return _image_has_cli_metadata(image)
+            finally:
+                image.close()
+    except (IOError, OSError, ValueError, struct.error):
+        return False
+
+def hash_file(path):
+    """ Return the sha256 hex digest of a file's contents
+
+    Args:
+        path (str): file to hash
+    """
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as file_handle:
+        chunk = file_handle.read(hash_chunk_size)
+        while chunk:
+            sha.update(chunk)
+            chunk = file_handle.read(hash_chunk_size)
+
+    return sha.hexdigest()
+
+def dedup_by_content(paths):
+    """ Remove files whose contents duplicate an earlier file in the list
+
+    Args:
+        paths ([str]): files to dedup, in priority order
+
+    Returns:
+        unique_paths ([str]): first occurrence of each distinct file content
+
+    Notes:
+        Files are first grouped by size. Only files that share a size with
+        another file are hashed, so unique files cost a single stat.
+    """
+
+    sizes = {}
+    size_counts = defaultdict(lambda: 0)
+    for path in paths:
+        sizes[path] = os.path.getsize(path)
+        size_counts[sizes[path]] += 1
+
+    seen_hashes = set()
+    unique_paths = []
+
+    for path in paths:
+        if size_counts[sizes[path]] > 1:
+            key = (sizes[path], hash_file(path))
+
+            if key in seen_hashes:
+                continue
+
+            seen_hashes.add(key)
+
+        unique_paths.append(path)
+
+    return unique_paths
+
+def find_managed_assemblies(locations, extensions=default_assembly_extensions, dedup=True):
+    """ Find all managed assemblies in a set of files and directories
+
+    Args:
+        locations ([str])   : files or directories (searched recursively)
+        extensions ([str])  : file extensions to consider
+        dedup (bool)        : drop files whose contents duplicate another
+
+    Returns:
+        assemblies ([str]): paths of the managed assemblies found
+    """
+
+    candidates = []
+    visited = set()
+
+    for location in locations:
+        if os.path.isdir(location):
+            files = walk_files(location, extensions)
+        else:
+            files = [location]
+
+        for item in files:
+            real_path = os.path.realpath(item)
+            if real_path in visited:
+                continue
+
+            visited.add(real_path)
+
+            if is_managed_assembly(item):
+                candidates.append(item)
+
+    if dedup:
+        candidates = dedup_by_content(candidates)
+
+    return candidates
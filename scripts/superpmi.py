@@ -19,6 +19,7 @@
 
 import argparse
 import asyncio
+import concurrent.futures
 import datetime
 import json
 import math
@@ -42,6 +43,9 @@ from collections import defaultdict
 from sys import platform as _platform
 
 from coreclr_arguments import *
+from managed_assemblies import find_managed_assemblies, hash_file
+from test_executor import kill_process_tree
+from test_wrappers import find_test_wrappers, shard_items
 
 ################################################################################
 # Argument Parser
@@ -88,6 +92,12 @@ collect_parser.add_argument("-test_env", dest="test_env", default=None, help="Te
 collect_parser.add_argument("-output_mch_path", dest="output_mch_path", default=None, help="Location to drop the final mch file. By default it will drop to bin/mch/$(buildType).$(arch).$(config)/$(buildType).$(arch).$(config).mch")
 
 collect_parser.add_argument("--pmi", dest="pmi", default=False, action="store_true", help="Use pmi on a set of directories or assemblies")
+collect_parser.add_argument("--tests", dest="tests", default=False, action="store_true", help="Collect over the built coreclr tests under test_location, running the test wrappers in parallel.")
+collect_parser.add_argument("-tests_subdirectories", dest="tests_subdirectories", nargs="+", default=[], help="Only collect over the tests under these subdirectories of test_location.")
+collect_parser.add_argument("-shard_index", dest="shard_index", type=int, default=0, help="Zero based index of the shard of the tests to collect over.")
+collect_parser.add_argument("-shard_count", dest="shard_count", type=int, default=1, help="Number of shards the tests are split into. Each shard should be collected separately, then merged using --merge_mch_files.")
+collect_parser.add_argument("-test_timeout", dest="test_timeout", type=int, default=20*60, help="Timeout in seconds for each test run during a --tests collection.")
+collect_parser.add_argument("-merge_batch_size", dest="merge_batch_size", type=int, default=500, help="Number of .mc files a worker accumulates before merging them into its .mch file.")
 collect_parser.add_argument("-mch_files", dest="mch_files", nargs='+', default=None, help="Pass a sequence of mch files which will be merged.")
 collect_parser.add_argument("--merge_mch_files", dest="merge_mch_files", default=False, action="store_true", help="Merge multiple mch files. Please use the mch_files flag to pass a list of mch files to merge.")
 
@@ -103,6 +113,10 @@ collect_parser.add_argument("--has_verified_clean_mch", dest="has_verified_clean
 
 collect_parser.add_argument("--skip_collect_mc_files", dest="skip_collect_mc_files", default=False, action="store_true")
 collect_parser.add_argument("--skip_cleanup", dest="skip_cleanup", default=False, action="store_true")
+collect_parser.add_argument("-repro_max_age_days", dest="repro_max_age_days", type=float, default=14, help="Delete repro .mc run directories under bin/repro older than this.")
+collect_parser.add_argument("--perf_counters", dest="perf_counters", default=False, action="store_true", help="Record instructions, cycles, branch misses and cache misses of the SuperPMI run with Linux perf stat.")
+collect_parser.add_argument("-perf_results_file", dest="perf_results_file", default=None, help="JSON file to write the hardware counters to. Defaults to bin/superpmi_perf/<host_os>.<arch>.<build_type>/<mode>.<run_id>.json")
+collect_parser.add_argument("-repro_max_size_mb", dest="repro_max_size_mb", type=float, default=2048, help="Delete the oldest repro .mc run directories under bin/repro until they use less than this.")
 
 # subparser for replay
 replay_parser = subparsers.add_parser("replay")
@@ -126,6 +140,10 @@ replay_parser.add_argument("-coreclr_repo_location", dest="coreclr_repo_location
 replay_parser.add_argument("-test_env", dest="test_env", default=None)
 
 replay_parser.add_argument("--skip_cleanup", dest="skip_cleanup", default=False, action="store_true")
+replay_parser.add_argument("-repro_max_age_days", dest="repro_max_age_days", type=float, default=14, help="Delete repro .mc run directories under bin/repro older than this.")
+replay_parser.add_argument("--perf_counters", dest="perf_counters", default=False, action="store_true", help="Record instructions, cycles, branch misses and cache misses of the SuperPMI run with Linux perf stat.")
+replay_parser.add_argument("-perf_results_file", dest="perf_results_file", default=None, help="JSON file to write the hardware counters to. Defaults to bin/superpmi_perf/<host_os>.<arch>.<build_type>/<mode>.<run_id>.json")
+replay_parser.add_argument("-repro_max_size_mb", dest="repro_max_size_mb", type=float, default=2048, help="Delete the oldest repro .mc run directories under bin/repro until they use less than this.")
 replay_parser.add_argument("--force_download", dest="force_download", default=False, action="store_true")
 
 # subparser for asmDiffs
@@ -152,6 +170,10 @@ asm_diff_parser.add_argument("-coreclr_repo_location", dest="coreclr_repo_locati
 asm_diff_parser.add_argument("-test_env", dest="test_env", default=None)
 
 asm_diff_parser.add_argument("--skip_cleanup", dest="skip_cleanup", default=False, action="store_true")
+asm_diff_parser.add_argument("-repro_max_age_days", dest="repro_max_age_days", type=float, default=14, help="Delete repro .mc run directories under bin/repro older than this.")
+asm_diff_parser.add_argument("--perf_counters", dest="perf_counters", default=False, action="store_true", help="Record instructions, cycles, branch misses and cache misses of the SuperPMI run with Linux perf stat.")
+asm_diff_parser.add_argument("-perf_results_file", dest="perf_results_file", default=None, help="JSON file to write the hardware counters to. Defaults to bin/superpmi_perf/<host_os>.<arch>.<build_type>/<mode>.<run_id>.json")
+asm_diff_parser.add_argument("-repro_max_size_mb", dest="repro_max_size_mb", type=float, default=2048, help="Delete the oldest repro .mc run directories under bin/repro until they use less than this.")
 asm_diff_parser.add_argument("--force_download", dest="force_download", default=False, action="store_true")
 
 asm_diff_parser.add_argument("--diff_with_code", dest="diff_with_code", default=False, action="store_true")
@@ -159,6 +181,7 @@ asm_diff_parser.add_argument("--diff_with_code_only", dest="diff_with_code_only"
 
 asm_diff_parser.add_argument("--diff_jit_dump", dest="diff_jit_dump", default=False, action="store_true")
 asm_diff_parser.add_argument("--diff_jit_dump_only", dest="diff_jit_dump_only", default=False, action="store_true", help="Only diff jitdumps, not asm.")
+asm_diff_parser.add_argument("--superpmi_server", dest="superpmi_server", default=False, action="store_true", help="Generate the per method dasm with long running superpmi processes (superpmi -streaming) instead of two processes per method. Requires a .mct next to the .mch.")
 
 # subparser for upload
 upload_parser = subparsers.add_parser("upload")
@@ -213,6 +236,191 @@ class ChangeDir:
     def __exit__(self, exc_type, exc_val, exc_tb):
         os.chdir(self.cwd)
 
+class PerfStatCollector:
+    """ Collect hardware counters for a command using Linux perf stat
+
+    Notes:
+        perf is optional. If it is not installed, the host is not Linux, or
+        the kernel does not allow counting (see perf_event_paranoid), the
+        command is run as is and no counters are recorded.
+    """
+
+    events = ["instructions", "cycles", "branch-misses", "cache-misses"]
+
+    def __init__(self, coreclr_args):
+        self.enabled = False
+        self.output_file = None
+        self.counters = None
+
+        if not coreclr_args.perf_counters:
+            return
+
+        if coreclr_args.host_os != "Linux":
+            print("Hardware counters are only supported on Linux. Continuing without them.")
+            return
+
+        self.perf_path = shutil.which("perf")
+        if self.perf_path is None:
+            print("perf was not found on the PATH. Continuing without hardware counters.")
+            return
+
+        # Make sure the counters can actually be read before relying on them.
+        proc = subprocess.Popen([self.perf_path, "stat", "-x", ",", "-e", "instructions", "true"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, stderr = proc.communicate()
+
+        if proc.returncode != 0 or b"<not supported>" in stderr or b"<not counted>" in stderr:
+            print("perf stat is unable to read hardware counters on this machine. Continuing without them.")
+            return
+
+        self.enabled = True
+
+    def wrap(self, command, output_file):
+        """ Return command wrapped with perf stat writing to output_file
+
+        Args:
+            command ([str])     : command to run
+            output_file (str)   : where perf stat writes the counters
+        """
+
+        if not self.enabled:
+            return command
+
+        self.output_file = output_file
+        return [self.perf_path, "stat", "-x", ",", "-o", output_file, "-e", ",".join(self.events), "--"] + command
+
+    def read(self):
+        """ Parse the counters written by the last wrapped command
+
+        Returns:
+            counters (dict): event name -> count, None if the event could not
+                           : be counted. None if perf was not used.
+        """
+
+        if not self.enabled or self.output_file is None or not os.path.isfile(self.output_file):
+            return None
+
+        counters = {}
+        with open(self.output_file) as file_handle:
+            for line in file_handle.readlines():
+                line = line.strip()
+                if len(line) == 0 or line.startswith("#"):
+                    continue
+
+                fields = line.split(",")
+                if len(fields) < 3:
+                    continue
+
+                # Events may carry a modifier, e.g. "instructions:u"
+                event = fields[2].split(":")[0]
+                try:
+                    counters[event] = int(fields[0])
+                except ValueError:
+                    counters[event] = None
+
+        self.counters = counters
+        return counters
+
+class SuperPMIServer:
+    """ A long running superpmi process that replays method contexts on request
+
+    Notes:
+        superpmi is started once with "-streaming stdin". Each method context
+        index written to its stdin is replayed with the already loaded JIT,
+        and everything the JIT printed for it is followed by a
+        "[streaming] <index> <status>" line. This avoids paying for process
+        creation, JIT load and .mch open once per method, which dominates
+        when generating dasm for many methods.
+
+        superpmi finds the method contexts through the TOC, so the .mch file
+        must have a .mct next to it.
+    """
+
+    status_prefix = "[streaming] "
+
+    def __init__(self, superpmi_path, jit_path, mch_file, flags, env, cwd):
+        command = [superpmi_path] + flags + ["-streaming", "stdin", jit_path, mch_file]
+
+        self.command = command
+        self.proc = subprocess.Popen(command,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL,
+                                     env=env,
+                                     cwd=cwd,
+                                     universal_newlines=True,
+                                     bufsize=1)
+
+    @staticmethod
+    def has_toc(mch_file):
+        """ Return whether superpmi will find a TOC for mch_file
+
+        Args:
+            mch_file (str): .mch file to replay
+        """
+
+        return os.path.isfile(mch_file + ".mct") or os.path.isfile(os.path.splitext(mch_file)[0] + ".mct")
+
+    def replay(self, index):
+        """ Replay a single method context
+
+        Args:
+            index (int|str): method context index
+
+        Returns:
+            (status, output): status is one of success, error, missing, diff,
+                            : excluded or notfound. output is everything
+                            : written for the method before the status line.
+
+        Notes:
+            Indices are sent one at a time. Writing a batch ahead could
+            deadlock once superpmi blocks on a full stdout pipe.
+        """
+
+        index = str(index).strip()
+
+        try:
+            self.proc.stdin.write("{}\n".format(index))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise RuntimeError("superpmi server exited: {}".format(" ".join(self.command)))
+
+        expected = "{}{} ".format(SuperPMIServer.status_prefix, index)
+        output = []
+
+        for line in self.proc.stdout:
+            if line.startswith(expected):
+                return line[len(expected):].strip(), "".join(output)
+
+            output.append(line)
+
+        raise RuntimeError("superpmi server exited while replaying {}: {}".format(index, " ".join(self.command)))
+
+    def close(self):
+        """ Ask superpmi to exit and wait for it
+        """
+
+        try:
+            self.proc.stdin.write("quit\n")
+            self.proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+        # Drain whatever superpmi writes on the way out (e.g. its summary).
+        self.proc.stdout.read()
+        self.proc.stdout.close()
+
+        try:
+            self.proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 class AsyncSubprocessHelper:
     def __init__(self, items, subproc_count=multiprocessing.cpu_count(), verbose=False):
         item_queue = asyncio.Queue()
@@ -352,6 +560,9 @@ class SuperPMICollect:
             self.pmi_assemblies = self.coreclr_args.pmi_assemblies
             self.corerun = os.path.join(self.core_root, "corerun" if self.coreclr_args.host_os != "Windows_NT" else "corerun.exe")
 
+        if self.coreclr_args.tests:
+            self.test_location = self.coreclr_args.test_location
+
     ############################################################################
     # Instance Methods
     ############################################################################
@@ -428,7 +639,9 @@ class SuperPMICollect:
                 if not self.coreclr_args.has_run_collection_command:
                     self.__collect_mc_files__()
                 
-                if not self.coreclr_args.has_merged_mch:
+                # A --tests collection merges the per-worker output into the
+                # base mch while the tests run.
+                if not self.coreclr_args.has_merged_mch and not self.coreclr_args.tests:
                     if not self.coreclr_args.merge_mch_files:
                         self.__merge_mc_files__()
                     else:
@@ -494,26 +707,6 @@ class SuperPMICollect:
                 return_code = proc.returncode
 
             if self.coreclr_args.pmi is True:
-                def get_all_assemblies(location, root=True):
-                    """ Return all potential managed assemblies in a directory
-                    """
-
-                    assert os.path.isdir(location) or os.path.isfile(location)
-
-                    valid_extensions = [".dll", ".exe"]
-
-                    assemblies = []
-
-                    if os.path.isdir(location):
-                        for item in os.listdir(location):
-                            assemblies += get_all_assemblies(os.path.join(location, item), False)
-                    else:
-                        for item in valid_extensions:
-                            if location.endswith(item):
-                                assemblies.append(location)
-                    
-                    return assemblies
-
                 async def run_pmi(print_prefix, assembly, self):
                     """ Run pmi over all dlls
                     """
@@ -528,12 +721,10 @@ class SuperPMICollect:
 
                     await proc.communicate()
 
-                assemblies = []
-                for item in self.pmi_assemblies:
-                    if os.path.isdir(item):
-                        assemblies += get_all_assemblies(item)
-                    else:
-                        assemblies.append(item)
+                # Only schedule managed assemblies, and only one copy of each,
+                # as every item costs a corerun process.
+                assemblies = find_managed_assemblies(self.pmi_assemblies)
+                print("Found {} unique managed assemblies to run pmi over.".format(len(assemblies)))
 
                 # Set environment variables.
                 old_env = os.environ.copy()
@@ -544,6 +735,16 @@ class SuperPMICollect:
 
                 os.environ.update(old_env)
 
+            if self.coreclr_args.tests is True:
+                self.__collect_mc_files_over_tests__(env_copy)
+
+        if self.coreclr_args.tests:
+            if not os.path.isfile(self.base_mch_file) or os.stat(self.base_mch_file).st_size == 0:
+                raise RuntimeError("No .mc files generated.")
+
+            self.mc_contents = []
+            return
+
         contents = os.listdir(self.temp_location)
         mc_contents = [os.path.join(self.temp_location, item) for item in contents if ".mc" in item]
 
@@ -552,6 +753,153 @@ class SuperPMICollect:
 
         self.mc_contents = mc_contents
 
+    def __collect_mc_files_over_tests__(self, env):
+        """ Run the coreclr test wrappers under the collector shim
+
+        Args:
+            env (dict): environment with the collector shim set up
+
+        Notes:
+            The tests are run on a pool of cpu_count workers. Each worker owns
+            a SuperPMIShimLogPath directory, so concurrently running tests
+            never write into the same directory. When a worker has collected
+            merge_batch_size .mc files it merges them into a batch .mch and
+            appends that to its own .mch, so .mc files never pile up. Once all
+            of the tests have run the worker .mch files are appended to the
+            base .mch.
+        """
+
+        search_locations = [self.test_location]
+        if len(self.coreclr_args.tests_subdirectories) > 0:
+            search_locations = [os.path.join(self.test_location, item) for item in self.coreclr_args.tests_subdirectories]
+
+        tests = []
+        for location in search_locations:
+            tests += find_test_wrappers(location, self.coreclr_args.host_os, exclude_locations=[self.core_root])
+
+        tests = shard_items(sorted(set(tests)), self.coreclr_args.shard_index, self.coreclr_args.shard_count)
+
+        print("Found {} tests to collect over (shard {} of {}).".format(len(tests), self.coreclr_args.shard_index + 1, self.coreclr_args.shard_count))
+        print("")
+
+        if len(tests) == 0:
+            return
+
+        worker_count = min(multiprocessing.cpu_count(), len(tests))
+        workers_location = os.path.join(self.temp_location, "workers")
+
+        workers = []
+        for index in range(worker_count):
+            worker = {
+                "shim_log_path": os.path.join(workers_location, str(index), "mc"),
+                "batch_mch_file": os.path.join(workers_location, str(index), "batch.mch"),
+                "mch_file": os.path.join(workers_location, str(index), "worker.mch")
+            }
+
+            os.makedirs(worker["shim_log_path"])
+            workers.append(worker)
+
+        # The helper never runs more than worker_count callbacks at once, so
+        # there is always a free worker when a callback starts.
+        free_workers = list(range(worker_count))
+
+        test_command = ["cmd", "/c"] if self.coreclr_args.host_os == "Windows_NT" else ["bash"]
+
+        test_env = env.copy()
+        test_env["CORE_ROOT"] = self.core_root
+
+        if self.coreclr_args.test_env is not None:
+            test_env["__TestEnv"] = self.coreclr_args.test_env
+
+        async def run_process(command, **kwargs):
+            proc = await asyncio.create_subprocess_exec(*command,
+                                                        stdout=asyncio.subprocess.DEVNULL,
+                                                        stderr=asyncio.subprocess.DEVNULL,
+                                                        **kwargs)
+            await proc.wait()
+            return proc.returncode
+
+        async def merge_worker_mc_files(print_prefix, worker):
+            """ Merge the worker's .mc files and append them to its .mch
+            """
+
+            mc_files = [item for item in os.listdir(worker["shim_log_path"]) if item.endswith(".mc")]
+            if len(mc_files) == 0:
+                return
+
+            pattern = os.path.join(worker["shim_log_path"], "*.mc")
+            command = [self.mcs_path, "-merge", worker["batch_mch_file"], pattern, "-recursive"]
+            print("{}Invoking: {}".format(print_prefix, " ".join(command)))
+            await run_process(command)
+
+            if not os.path.isfile(worker["batch_mch_file"]):
+                raise RuntimeError("Failed to merge .mc files in: {}".format(worker["shim_log_path"]))
+
+            command = [self.mcs_path, "-concat", worker["mch_file"], worker["batch_mch_file"]]
+            await run_process(command)
+
+            os.remove(worker["batch_mch_file"])
+            for item in mc_files:
+                os.remove(os.path.join(worker["shim_log_path"], item))
+
+        async def run_test(print_prefix, test, self):
+            """ Run a single test wrapper under the collector
+            """
+
+            worker_index = free_workers.pop()
+            worker = workers[worker_index]
+
+            try:
+                worker_env = test_env.copy()
+                worker_env["SuperPMIShimLogPath"] = worker["shim_log_path"]
+
+                command = test_command + [test]
+                print("{}{}".format(print_prefix, " ".join(command)))
+
+                # The wrapper leads a process group of its own, so a timeout
+                # kills the corerun it started too; an orphaned corerun would
+                # keep writing .mc files into the next test's shim log path.
+                proc = await asyncio.create_subprocess_exec(*command,
+                                                            stdout=asyncio.subprocess.DEVNULL,
+                                                            stderr=asyncio.subprocess.DEVNULL,
+                                                            cwd=os.path.dirname(test),
+                                                            env=worker_env,
+                                                            start_new_session=True)
+
+                try:
+                    await asyncio.wait_for(proc.wait(), self.coreclr_args.test_timeout)
+                except asyncio.TimeoutError:
+                    print("{}Timed out after {} seconds: {}".format(print_prefix, self.coreclr_args.test_timeout, test))
+                    kill_process_tree(proc)
+                    await proc.wait()
+
+                mc_count = len([item for item in os.listdir(worker["shim_log_path"]) if item.endswith(".mc")])
+                if mc_count >= self.coreclr_args.merge_batch_size:
+                    await merge_worker_mc_files(print_prefix, worker)
+
+            finally:
+                free_workers.append(worker_index)
+
+        async def flush_worker(print_prefix, worker, self):
+            await merge_worker_mc_files(print_prefix, worker)
+
+        helper = AsyncSubprocessHelper(tests, subproc_count=worker_count, verbose=True)
+        helper.run_to_completion(run_test, self)
+
+        # Merge whatever the workers collected since their last batch.
+        helper = AsyncSubprocessHelper(workers, subproc_count=worker_count)
+        helper.run_to_completion(flush_worker, self)
+
+        for worker in workers:
+            if os.path.isfile(worker["mch_file"]):
+                command = [self.mcs_path, "-concat", self.base_mch_file, worker["mch_file"]]
+                print("Invoking: " + " ".join(command))
+                proc = subprocess.Popen(command)
+                proc.communicate()
+
+        if not self.coreclr_args.skip_cleanup:
+            shutil.rmtree(workers_location)
+
     def __merge_mc_files__(self):
         """ Merge the mc files that were generated
 
@@ -780,12 +1128,19 @@ class SuperPMIReplay:
 
             command = [self.superpmi_path] + flags + [self.jit_path, self.mch_file]
 
+            perf_collector = PerfStatCollector(self.coreclr_args)
+            command = perf_collector.wrap(command, os.path.join(temp_location, "perf_stat.csv"))
+
+            start_time = datetime.datetime.now()
+
             print("Invoking: " + " ".join(command))
             proc = subprocess.Popen(command)
             proc.communicate()
 
             return_code = proc.returncode
 
+            save_perf_results(self.coreclr_args, "replay", perf_collector.read(), start_time, return_code, self.mch_file, [self.jit_path])
+
             if return_code == 0:
                 print("Clean SuperPMI Replay")
                 return_code = True
@@ -810,24 +1165,11 @@ class SuperPMIReplay:
                 with open(self.fail_mcl_file) as file_handle:
                     self.fail_mcl_contents = file_handle.read()
 
-                # If there are any .mc files, drop them into bin/repro/<host_os>.<arch>.<build_type>/*.mc
+                # If there are any .mc files, move them into bin/repro/<host_os>.<arch>.<build_type>/<run_id>/*.mc
                 mc_files = [os.path.join(temp_location, item) for item in os.listdir(temp_location) if item.endswith(".mc")]
 
                 if len(mc_files) > 0:
-                    repro_location = os.path.join(self.coreclr_args.coreclr_repo_location, "bin", "repro", "{}.{}.{}".format(self.coreclr_args.host_os, self.coreclr_args.arch, self.coreclr_args.build_type))
-
-                    # Delete existing repro location
-                    if os.path.isdir(repro_location):
-                        shutil.rmtree(repro_location)
-
-                    assert(not os.path.isdir(repro_location))
-
-                    os.makedirs(repro_location)
-                    
-                    repro_files = []
-                    for item in mc_files:
-                        repro_files.append(os.path.join(repro_location, os.path.basename(item)))
-                        shutil.copy2(item, repro_location)
+                    repro_location, repro_files = save_repro_mc_files(self.coreclr_args, mc_files)
 
                     print("")
                     print("Repro .mc files:")
@@ -840,7 +1182,7 @@ class SuperPMIReplay:
 
                     print("To run an specific failure:")
                     print("")
-                    print("<SuperPMI_path>/SuperPMI <core_root|product_dir>/clrjit.dll|libclrjit.so|libclrjit.dylib <<coreclr_path>/bin/repro/<host_os>.<arch>.<build_type>/1xxxx.mc")
+                    print("<SuperPMI_path>/SuperPMI <core_root|product_dir>/clrjit.dll|libclrjit.so|libclrjit.dylib {}".format(os.path.join(repro_location, "1xxxx.mc")))
                     print("")
 
                 else:
@@ -972,12 +1314,19 @@ class SuperPMIReplayAsmDiffs:
                     with ChangeDir(self.coreclr_args.core_root) as dir:
                         command = [self.superpmi_path] + flags + [self.base_jit_path, self.diff_jit_path, self.mch_file]
 
+                        perf_collector = PerfStatCollector(self.coreclr_args)
+                        command = perf_collector.wrap(command, os.path.join(temp_location, "perf_stat.csv"))
+
+                        start_time = datetime.datetime.now()
+
                         print("Invoking: " + " ".join(command))
                         proc = subprocess.Popen(command)
                         proc.communicate()
 
                     return_code = proc.returncode
 
+                    save_perf_results(self.coreclr_args, "asmdiffs", perf_collector.read(), start_time, return_code, self.mch_file, [self.base_jit_path, self.diff_jit_path])
+
                     if return_code == 0:
                         print("Clean SuperPMI Replay")
 
@@ -1011,24 +1360,11 @@ class SuperPMIReplayAsmDiffs:
                     mcl_lines = [item.strip() for item in mcl_lines]
                     self.fail_mcl_contents = os.linesep.join(mcl_lines)
 
-                # If there are any .mc files, drop them into bin/repro/<host_os>.<arch>.<build_type>/*.mc
+                # If there are any .mc files, move them into bin/repro/<host_os>.<arch>.<build_type>/<run_id>/*.mc
                 mc_files = [os.path.join(temp_location, item) for item in os.listdir(temp_location) if item.endswith(".mc")]
 
                 if len(mc_files) > 0:
-                    repro_location = os.path.join(self.coreclr_args.coreclr_repo_location, "bin", "repro", "{}.{}.{}".format(self.coreclr_args.host_os, self.coreclr_args.arch, self.coreclr_args.build_type))
-
-                    # Delete existing repro location
-                    if os.path.isdir(repro_location):
-                        shutil.rmtree(repro_location)
-
-                    assert(not os.path.isdir(repro_location))
-
-                    os.makedirs(repro_location)
-                    
-                    repro_files = []
-                    for item in mc_files:
-                        repro_files.append(os.path.join(repro_location, os.path.basename(item)))
-                        shutil.copy2(item, repro_location)
+                    repro_location, repro_files = save_repro_mc_files(self.coreclr_args, mc_files)
 
                     print("")
                     print("Repro .mc files:")
@@ -1041,7 +1377,7 @@ class SuperPMIReplayAsmDiffs:
 
                     print("To run an specific failure:")
                     print("")
-                    print("<SuperPMI_path>/SuperPMI <core_root|product_dir>/clrjit.dll|libclrjit.so|libclrjit.dylib <<coreclr_path>/bin/repro/<host_os>.<arch>.<build_type>/1xxxx.mc")
+                    print("<SuperPMI_path>/SuperPMI <core_root|product_dir>/clrjit.dll|libclrjit.so|libclrjit.dylib {}".format(os.path.join(repro_location, "1xxxx.mc")))
                     print("")
 
                 print(self.fail_mcl_contents)
@@ -1140,6 +1476,26 @@ class SuperPMIReplayAsmDiffs:
                 text_differences = asyncio.Queue()
                 jit_dump_differences = asyncio.Queue()
 
+                def create_asm_env():
+                    """ Return a copy of the environment that makes the jit write its dasm.
+                    """
+
+                    asm_env = os.environ.copy()
+                    asm_env["COMPlus_JitDisasm"] = "*"
+                    asm_env["COMPlus_JitUnwindDump"] = "*"
+                    asm_env["COMPlus_JitEHDump"] = "*"
+                    asm_env["COMPlus_JitDiffableDasm"] = "1"
+                    asm_env["COMPlus_NgenDisasm"] = "*"
+                    asm_env["COMPlus_NgenDump"] = "*"
+                    asm_env["COMPlus_NgenUnwindDump"] = "*"
+                    asm_env["COMPlus_NgenEHDump"] = "*"
+                    asm_env["COMPlus_JitEnableNoWayAssert"] = "1"
+                    asm_env["COMPlus_JitNoForceFallback"] = "1"
+                    asm_env["COMPlus_JitRequired"] = "1"
+                    asm_env["COMPlus_TieredCompilation"] = "0"
+
+                    return asm_env
+
                 async def create_asm(print_prefix, item, self, text_differences, base_asm_location, diff_asm_location):
                     """ Run superpmi over an mc to create dasm for the method.
                     """
@@ -1168,19 +1524,7 @@ class SuperPMIReplayAsmDiffs:
 
                     flags += force_altjit_options
                     
-                    asm_env = os.environ.copy()
-                    asm_env["COMPlus_JitDisasm"] = "*"
-                    asm_env["COMPlus_JitUnwindDump"] = "*"
-                    asm_env["COMPlus_JitEHDump"] = "*"
-                    asm_env["COMPlus_JitDiffableDasm"] = "1"
-                    asm_env["COMPlus_NgenDisasm"] = "*"
-                    asm_env["COMPlus_NgenDump"] = "*"
-                    asm_env["COMPlus_NgenUnwindDump"] = "*"
-                    asm_env["COMPlus_NgenEHDump"] = "*"
-                    asm_env["COMPlus_JitEnableNoWayAssert"] = "1"
-                    asm_env["COMPlus_JitNoForceFallback"] = "1"
-                    asm_env["COMPlus_JitRequired"] = "1"
-                    asm_env["COMPlus_TieredCompilation"] = "0"
+                    asm_env = create_asm_env()
 
                     # Change the working directory to the core root we will call SuperPMI from.
                     # This is done to allow libcorcedistools to be loaded correctly on unix
@@ -1307,14 +1651,68 @@ class SuperPMIReplayAsmDiffs:
                         if base_txt != diff_txt:
                             jit_dump_differences.put_nowait(item)
 
+                def create_asm_with_servers(items, asm_env):
+                    """ Create the dasm for items with one base and one diff superpmi server.
+
+                    Returns:
+                        differences ([str]): items whose base and diff dasm differ
+                    """
+
+                    force_altjit_options = [
+                        "-jitoption",
+                        "force",
+                        "AltJit=",
+                        "-jitoption",
+                        "force",
+                        "AltJitNgen="
+                    ]
+
+                    flags = ["-v", "q"] + force_altjit_options
+                    differences = []
+
+                    with SuperPMIServer(self.superpmi_path, self.base_jit_path, self.mch_file, flags, asm_env, self.coreclr_args.core_root) as base_server, \
+                         SuperPMIServer(self.superpmi_path, self.diff_jit_path, self.mch_file, flags, asm_env, self.coreclr_args.core_root) as diff_server:
+                        for item in items:
+                            _, base_txt = base_server.replay(item)
+                            _, diff_txt = diff_server.replay(item)
+
+                            with open(os.path.join(base_asm_location, "{}.dasm".format(item)), 'w') as file_handle:
+                                file_handle.write(base_txt)
+
+                            with open(os.path.join(diff_asm_location, "{}.dasm".format(item)), 'w') as file_handle:
+                                file_handle.write(diff_txt)
+
+                            if base_txt != diff_txt:
+                                differences.append(item)
+
+                    return differences
+
                 if not self.coreclr_args.diff_with_code_only:
                     diff_items = []
 
                     for item in self.diff_mcl_contents:
                         diff_items.append(item)
 
+                    if self.coreclr_args.superpmi_server and not SuperPMIServer.has_toc(self.mch_file):
+                        print("Warning: {} has no .mct, not using a superpmi server.".format(self.mch_file))
+
                     subproc_helper = AsyncSubprocessHelper(diff_items, verbose=True)
-                    subproc_helper.run_to_completion(create_asm, self, text_differences, base_asm_location, diff_asm_location)
+
+                    if self.coreclr_args.superpmi_server and SuperPMIServer.has_toc(self.mch_file):
+                        asm_env = create_asm_env()
+
+                        # One pair of servers per cpu, each taking every server_count-th method.
+                        server_count = max(1, min(multiprocessing.cpu_count(), len(diff_items)))
+                        chunks = [diff_items[index::server_count] for index in range(server_count)]
+
+                        print("Generating dasm for {} methods with {} superpmi server pair(s).".format(len(diff_items), server_count))
+
+                        with concurrent.futures.ThreadPoolExecutor(max_workers=server_count) as executor:
+                            for differences in executor.map(lambda chunk: create_asm_with_servers(chunk, asm_env), chunks):
+                                for item in differences:
+                                    text_differences.put_nowait(item)
+                    else:
+                        subproc_helper.run_to_completion(create_asm, self, text_differences, base_asm_location, diff_asm_location)
 
                     if self.coreclr_args.diff_jit_dump:
                         subproc_helper.run_to_completion(create_jit_dump, self, jit_dump_differences, base_dump_location, diff_dump_location)
@@ -1452,6 +1850,215 @@ class SuperPMIReplayAsmDiffs:
 # Helper Methods
 ################################################################################
 
+def save_perf_results(coreclr_args, mode, counters, start_time, return_code, mch_file, jit_paths):
+    """ Write the hardware counters of a SuperPMI run to a JSON results file
+
+    Args:
+        coreclr_args (CoreclrArguments) : parsed args
+        mode (str)                      : replay or asmdiffs
+        counters (dict)                 : from PerfStatCollector.read()
+        start_time (datetime)           : when the run started
+        return_code (int)               : SuperPMI exit code
+        mch_file (str)                  : mch file replayed
+        jit_paths ([str])               : jits used for the run
+
+    Notes:
+        The results include the sha256 of each jit, so results from different
+        JIT builds over the same mch can be told apart and compared. By default
+        the file is written to bin/superpmi_perf/<host_os>.<arch>.<build_type>/
+    """
+
+    if counters is None:
+        return
+
+    results = {
+        "mode": mode,
+        "start_time": start_time.isoformat(),
+        "duration_seconds": (datetime.datetime.now() - start_time).total_seconds(),
+        "return_code": return_code,
+        "host_os": coreclr_args.host_os,
+        "arch": coreclr_args.arch,
+        "build_type": coreclr_args.build_type,
+        "mch_file": os.path.abspath(mch_file),
+        "jits": [{"path": os.path.abspath(item), "sha256": hash_file(item)} for item in jit_paths],
+        "counters": counters
+    }
+
+    results_file = coreclr_args.perf_results_file
+    if results_file is None:
+        results_location = os.path.join(coreclr_args.bin_location, "superpmi_perf", "{}.{}.{}".format(coreclr_args.host_os, coreclr_args.arch, coreclr_args.build_type))
+        results_file = os.path.join(results_location, "{}.{}-{}.json".format(mode, start_time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+
+    results_location = os.path.dirname(os.path.abspath(results_file))
+    if not os.path.isdir(results_location):
+        os.makedirs(results_location)
+
+    with open(results_file, "w") as file_handle:
+        json.dump(results, file_handle, indent=4)
+
+    print("")
+    print("Hardware counters:")
+    for event in PerfStatCollector.events:
+        print("    {:<16}: {}".format(event, counters.get(event)))
+    print("Written to: {}".format(results_file))
+    print("")
+
+def determine_repro_root(coreclr_args):
+    """ Determine the root of the repro locations for this os/arch/build_type
+
+    Args:
+        coreclr_args (CoreclrArguments) : parsed args
+
+    Returns:
+        repro_root (str): bin/repro/<host_os>.<arch>.<build_type>
+    """
+
+    return os.path.join(coreclr_args.coreclr_repo_location, "bin", "repro", "{}.{}.{}".format(coreclr_args.host_os, coreclr_args.arch, coreclr_args.build_type))
+
+def save_repro_mc_files(coreclr_args, mc_files):
+    """ Move the .mc repro files of a replay into a new run directory
+
+    Args:
+        coreclr_args (CoreclrArguments) : parsed args
+        mc_files ([str])                : .mc files written by superpmi -r
+
+    Returns:
+        (repro_location, repro_files) (str, [str]): the run directory and the
+                                                   : repro files in it
+
+    Notes:
+        Every run gets its own directory, bin/repro/<host_os>.<arch>.<build_type>/<run_id>,
+        so concurrent replays do not clobber each other's repros.
+
+        The contents of each .mc file are stored once, by sha256, under
+        <repro_root>/.mc_store. A repro that is already in the store from an
+        earlier run is hard linked into the run directory. Otherwise the .mc
+        file is renamed into the run directory (it is only copied when the
+        temp directory is on another volume) and then linked into the store.
+        Either way the run directory links the file before the store can, so
+        a concurrent prune (which only deletes stored files no run links to)
+        cannot delete it from under this run.
+    """
+
+    repro_root = determine_repro_root(coreclr_args)
+    store_location = os.path.join(repro_root, ".mc_store")
+
+    run_id = "{}-{}".format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S"), os.getpid())
+    repro_location = os.path.join(repro_root, run_id)
+
+    os.makedirs(store_location, exist_ok=True)
+    os.makedirs(repro_location)
+
+    repro_files = []
+    for item in mc_files:
+        stored_file = os.path.join(store_location, "{}.mc".format(hash_file(item)))
+        repro_file = os.path.join(repro_location, os.path.basename(item))
+        repro_files.append(repro_file)
+
+        try:
+            os.link(stored_file, repro_file)
+            os.remove(item)
+            continue
+        except FileNotFoundError:
+            # Not stored yet, or pruned since; store it again.
+            pass
+        except OSError:
+            # No hard links here, so nothing can be shared.
+            shutil.move(item, repro_file)
+            continue
+
+        try:
+            os.replace(item, repro_file)
+        except OSError:
+            # Cross-device rename.
+            shutil.move(item, repro_file)
+
+        try:
+            os.link(repro_file, stored_file)
+        except OSError:
+            # Another replay stored the same contents meanwhile; this run
+            # keeps its own copy.
+            pass
+
+    prune_repro_locations(coreclr_args, keep=[repro_location])
+
+    return repro_location, repro_files
+
+def prune_repro_locations(coreclr_args, keep=[]):
+    """ Delete old repro run directories to stay within the age and size budget
+
+    Args:
+        coreclr_args (CoreclrArguments) : parsed args
+        keep ([str])                    : run directories that must not be deleted
+
+    Notes:
+        Runs older than repro_max_age_days are deleted first. Then the oldest
+        runs are deleted until the repros use less than repro_max_size_mb. The
+        size is measured per inode, so a repro shared between runs is counted
+        once. Stored .mc files no longer linked from any run are deleted.
+    """
+
+    repro_root = determine_repro_root(coreclr_args)
+    store_location = os.path.join(repro_root, ".mc_store")
+
+    if not os.path.isdir(repro_root):
+        return
+
+    keep = [os.path.abspath(item) for item in keep]
+
+    runs = []
+    for entry in os.scandir(repro_root):
+        if entry.is_dir(follow_symlinks=False) and entry.path != store_location:
+            runs.append((entry.stat().st_mtime, entry.path))
+
+    # Oldest first
+    runs.sort()
+
+    def remove_run(run_location):
+        print("Deleting old repro location: {}".format(run_location))
+        shutil.rmtree(run_location, ignore_errors=True)
+
+    def remove_unlinked_stored_files():
+        if not os.path.isdir(store_location):
+            return
+
+        for entry in os.scandir(store_location):
+            if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_nlink <= 1:
+                os.remove(entry.path)
+
+    def repro_size():
+        seen = set()
+        size = 0
+        for dir_path, _, file_names in os.walk(repro_root):
+            for file_name in file_names:
+                stat = os.lstat(os.path.join(dir_path, file_name))
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    size += stat.st_size
+        return size
+
+    oldest_allowed = time.time() - (coreclr_args.repro_max_age_days * 24 * 60 * 60)
+
+    remaining_runs = []
+    for mtime, run_location in runs:
+        if mtime < oldest_allowed and os.path.abspath(run_location) not in keep:
+            remove_run(run_location)
+        else:
+            remaining_runs.append(run_location)
+
+    remove_unlinked_stored_files()
+
+    max_size = coreclr_args.repro_max_size_mb * 1024 * 1024
+    for run_location in remaining_runs:
+        if repro_size() <= max_size:
+            break
+
+        if os.path.abspath(run_location) in keep:
+            continue
+
+        remove_run(run_location)
+        remove_unlinked_stored_files()
+
 def determine_coredis_tools(coreclr_args):
     """ Determine the coredistools location
 
@@ -1799,6 +2406,41 @@ def setup_args(args):
                             lambda unused: True,
                             "Unable to set pmi")
         
+        coreclr_args.verify(args,
+                            "tests",
+                            lambda unused: True,
+                            "Unable to set tests")
+
+        coreclr_args.verify(args,
+                            "tests_subdirectories",
+                            lambda items: all(os.path.isdir(os.path.join(coreclr_args.test_location, item)) for item in items),
+                            "Unable to set tests_subdirectories. Each item must be a directory under test_location.")
+
+        coreclr_args.verify(args,
+                            "shard_count",
+                            lambda shard_count: shard_count > 0,
+                            "shard_count must be greater than zero.")
+
+        coreclr_args.verify(args,
+                            "shard_index",
+                            lambda shard_index: 0 <= shard_index < coreclr_args.shard_count,
+                            "shard_index must be between 0 and shard_count - 1.")
+
+        coreclr_args.verify(args,
+                            "test_timeout",
+                            lambda test_timeout: test_timeout > 0,
+                            "test_timeout must be greater than zero.")
+
+        coreclr_args.verify(args,
+                            "merge_batch_size",
+                            lambda merge_batch_size: merge_batch_size > 0,
+                            "merge_batch_size must be greater than zero.")
+
+        coreclr_args.verify(args,
+                            "test_env",
+                            lambda test_env: test_env is None or os.path.isfile(test_env),
+                            "Unable to find test_env.")
+
         coreclr_args.verify(args,
                             "pmi_assemblies",
                             lambda items: args.pmi is False or len(items) > 0,
@@ -1870,14 +2512,37 @@ def setup_args(args):
                             lambda unused: True,
                             "Unable to set use_zapdisable")
 
+        coreclr_args.verify(args,
+                            "repro_max_age_days",
+                            lambda repro_max_age_days: repro_max_age_days >= 0,
+                            "repro_max_age_days must not be negative.")
+
+        coreclr_args.verify(args,
+                            "repro_max_size_mb",
+                            lambda repro_max_size_mb: repro_max_size_mb >= 0,
+                            "repro_max_size_mb must not be negative.")
+
+        coreclr_args.verify(args,
+                            "perf_counters",
+                            lambda unused: True,
+                            "Unable to set perf_counters.")
+
+        coreclr_args.verify(args,
+                            "perf_results_file",
+                            lambda unused: True,
+                            "Unable to set perf_results_file.")
+
         jit_location = os.path.join(coreclr_args.core_root, determine_jit_name(coreclr_args))
         assert(os.path.isfile(jit_location))
 
         if args.collection_command is None and args.merge_mch_files is not True:
             assert args.collection_args is None
 
-            assert args.pmi is True
-            assert len(args.pmi_assemblies) > 0
+            assert args.pmi is True or args.tests is True
+            assert args.tests is True or len(args.pmi_assemblies) > 0
+
+        if coreclr_args.tests:
+            assert os.path.isdir(coreclr_args.test_location)
 
         if coreclr_args.merge_mch_files:
             assert len(coreclr_args.mch_files) > 0
@@ -1889,6 +2554,26 @@ def setup_args(args):
                             lambda collection_name: collection_name in download_index(coreclr_args),
                             "Invalid collection. Please run superpmi.py list-collections to see valid options.")
 
+        coreclr_args.verify(args,
+                            "repro_max_age_days",
+                            lambda repro_max_age_days: repro_max_age_days >= 0,
+                            "repro_max_age_days must not be negative.")
+
+        coreclr_args.verify(args,
+                            "repro_max_size_mb",
+                            lambda repro_max_size_mb: repro_max_size_mb >= 0,
+                            "repro_max_size_mb must not be negative.")
+
+        coreclr_args.verify(args,
+                            "perf_counters",
+                            lambda unused: True,
+                            "Unable to set perf_counters.")
+
+        coreclr_args.verify(args,
+                            "perf_results_file",
+                            lambda unused: True,
+                            "Unable to set perf_results_file.")
+
         coreclr_args.verify(args,
                             "mch_file",
                             lambda mch_file: os.path.isfile(mch_file),
@@ -1972,6 +2657,26 @@ def setup_args(args):
                             lambda collection_name: collection_name in download_index(coreclr_args),
                             "Invalid collection. Please run superpmi.py list-collections to see valid options.")
 
+        coreclr_args.verify(args,
+                            "repro_max_age_days",
+                            lambda repro_max_age_days: repro_max_age_days >= 0,
+                            "repro_max_age_days must not be negative.")
+
+        coreclr_args.verify(args,
+                            "repro_max_size_mb",
+                            lambda repro_max_size_mb: repro_max_size_mb >= 0,
+                            "repro_max_size_mb must not be negative.")
+
+        coreclr_args.verify(args,
+                            "perf_counters",
+                            lambda unused: True,
+                            "Unable to set perf_counters.")
+
+        coreclr_args.verify(args,
+                            "perf_results_file",
+                            lambda unused: True,
+                            "Unable to set perf_results_file.")
+
         coreclr_args.verify(args,
                             "log_file",
                             lambda unused: True,
@@ -2026,6 +2731,11 @@ def setup_args(args):
                                 lambda unused: True,
                                 "Unable to set diff_jit_dump.")
 
+        coreclr_args.verify(args,
+                            "superpmi_server",
+                            lambda unused: True,
+                            "Unable to set superpmi_server.")
+
         standard_location = False
         if coreclr_args.bin_location.lower() in coreclr_args.base_jit_path.lower():
             standard_location = True
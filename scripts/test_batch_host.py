@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : test_batch_host.py
+#
+# Notes:
+#
+# Runs batches of tests in one corerun process each, to save the runtime
+# startup of every test. The batch host is runincontext's /batch mode: it runs
+# the tests one after the other, each in its own unloadable
+# AssemblyLoadContext, as runtest.py --run_in_context runs a single test.
+#
+# Which assembly a test runs, with which arguments and which expected exit
+# code, is decided by its wrapper script. Rather than parsing the wrappers,
+# each wrapper is run once with tests/scripts/runincontext_probe.sh as its
+# launcher, which records the launch instead of running the test. A test can
+# only be batched when:
+#
+#   - its wrapper launched it (it did not skip itself, e.g. because it is
+#     marked UnloadabilityIncompatible, and it is a BuildAndRun test)
+#   - another test runs with the same COMPlus_/DOTNET_ variables, which the
+#     runtime only reads at startup. The variables are those the wrapper had
+#     when it launched the test (runtest.py blanks them in its own
+#     environment and the wrapper sets them from __TestEnv), and only tests
+#     with the same variables share a batch host, which is started with them.
+#   - its arguments fit in the batch file (no tabs or newlines)
+#
+# All of the other tests are run on their own, by TestExecutor. So is a test
+# that takes its batch host down; the tests after it in the batch go into a
+# new batch.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import multiprocessing.pool
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+if sys.version_info.major < 3:
+    import Queue as queue
+else:
+    import queue
+
+from collections import OrderedDict, defaultdict
+
+from test_executor import TestExecutor, TestExecutionResult, kill_process_tree
+
+################################################################################
+# Globals
+################################################################################
+
+# A helper module for runtest.py, not a test module; keep pytest from
+# collecting it.
+__test__ = False
+
+default_batch_size = 25
+
+# How often a running batch host is checked for progress and timeouts, in seconds.
+batch_poll_interval = 0.1
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def is_runtime_variable(name):
+    return name.startswith("COMPlus_") or name.startswith("DOTNET_")
+
+def get_batch_host_environment(env, variables):
+    """ Return the environment of a batch host
+
+    Args:
+        env (dict)          : environment of the runner
+        variables ([str])   : "name=value" COMPlus_ and DOTNET_ variables the
+                            : wrappers of the batch launched their tests with
+
+    Returns:
+        env (dict): env, with its own COMPlus_ and DOTNET_ variables replaced
+                  : by variables
+    """
+
+    host_env = dict((key, value) for key, value in env.items() if not is_runtime_variable(key))
+
+    for variable in variables:
+        name, value = variable.split("=", 1)
+        host_env[name] = value
+
+    return host_env
+
+def probe_test_launch(test_path, probe_launcher, env, timeout):
+    """ Find out how a test wrapper launches its test
+
+    Args:
+        test_path (str)         : path of the test wrapper
+        probe_launcher (str)    : path of runincontext_probe.sh
+        env (dict)              : environment of the test
+        timeout (float)         : seconds to wait for the wrapper
+
+    Returns:
+        launch (TestLaunch): None if the wrapper did not launch the test
+    """
+
+    handle, probe_file = tempfile.mkstemp(suffix=".probe")
+    os.close(handle)
+
+    probe_env = dict(env)
+    probe_env["CLRCustomTestLauncher"] = probe_launcher
+    probe_env["RunInContextProbeFile"] = probe_file
+
+    try:
+        with open(os.devnull, "w") as devnull:
+            proc = subprocess.Popen(["/bin/bash", test_path],
+                                    stdout=devnull,
+                                    stderr=devnull,
+                                    cwd=os.path.dirname(test_path),
+                                    env=probe_env,
+                                    preexec_fn=os.setsid)
+
+            timer = threading.Timer(timeout, kill_process_tree, [proc])
+            timer.start()
+            try:
+                exit_code = proc.wait()
+            finally:
+                timer.cancel()
+
+        with open(probe_file) as file_handle:
+            lines = file_handle.read().splitlines()
+    finally:
+        os.remove(probe_file)
+
+    if exit_code != 0 or len(lines) < 4:
+        return None
+
+    try:
+        expected_exit_code = int(lines[0])
+        argument_count = int(lines[3])
+    except ValueError:
+        return None
+
+    if len(lines) < 4 + argument_count:
+        return None
+
+    return TestLaunch(expected_exit_code,
+                      lines[1],
+                      lines[2],
+                      lines[4:4 + argument_count],
+                      lines[4 + argument_count:])
+
+def read_batch_results(results_file):
+    """ Read the progress a batch host wrote
+
+    Returns:
+        (started, ended): the indices of the tests that started, and the
+                        : (exit code, seconds) of those that ended, by index
+    """
+
+    started = []
+    ended = {}
+
+    if not os.path.isfile(results_file):
+        return started, ended
+
+    with open(results_file) as file_handle:
+        for line in file_handle:
+            # A line without its newline is still being written.
+            if not line.endswith("\n"):
+                break
+
+            fields = line.rstrip("\n").split("\t")
+            if fields[0] == "START":
+                started.append(int(fields[1]))
+            elif fields[0] == "END":
+                ended[int(fields[1])] = (int(fields[2]), int(fields[3]) / 1000.0)
+
+    return started, ended
+
+################################################################################
+# Classes
+################################################################################
+
+class TestLaunch(object):
+    """ How a test wrapper launches its test, see probe_test_launch
+    """
+
+    __slots__ = ["expected_exit_code", "directory", "executable", "arguments", "variables"]
+
+    def __init__(self, expected_exit_code, directory, executable, arguments, variables):
+        self.expected_exit_code = expected_exit_code
+        self.directory = directory
+        self.executable = executable
+        self.arguments = arguments
+        self.variables = variables
+
+    def assembly(self):
+        return os.path.normpath(os.path.join(self.directory, self.executable))
+
+class BatchTestExecutor(TestExecutor):
+    """ Run the tests that allow it in batch hosts, and the others on their own
+
+    Notes:
+        Each worker thread runs either a batch host or a single test wrapper
+        at a time. A batch is the next batch_size batchable tests in the
+        order the tests are given.
+    """
+
+    def __init__(self, tests, test_location, report_location, host_os, parallel_count, timeout, core_root, probe_launcher, batch_size=default_batch_size, env=None, timeouts=None):
+        """ Constructor
+
+        Args:
+            core_root (str)         : Core_Root path, with runincontext.dll
+            probe_launcher (str)    : path of runincontext_probe.sh
+            batch_size (int)        : maximum number of tests per batch host
+
+            See TestExecutor for the others.
+        """
+
+        TestExecutor.__init__(self, tests, test_location, report_location, host_os, parallel_count, timeout, env=env, timeouts=timeouts)
+
+        self.core_root = core_root
+        self.probe_launcher = probe_launcher
+        self.batch_size = max(1, batch_size)
+        self.launches = None
+        self.environment_rejected_count = 0
+
+    def probe(self):
+        """ Find the tests that can be batched
+
+        Returns:
+            count (int): the number of tests that can be batched
+
+        Notes:
+            environment_rejected_count is set to the number of tests that
+            launched fine but that no other test shares a batch host with,
+            as no other test runs with the same COMPlus_/DOTNET_ variables.
+        """
+
+        if self.launches is not None:
+            return len(self.launches)
+
+        pool = multiprocessing.pool.ThreadPool(self.parallel_count)
+        try:
+            launches = pool.map(lambda test_path: probe_test_launch(test_path, self.probe_launcher, self.env, self.timeouts.get(test_path, self.timeout)), self.tests)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.launches = {}
+        environment_counts = defaultdict(int)
+
+        for test_path, launch in zip(self.tests, launches):
+            if launch is None:
+                continue
+
+            if any("\t" in argument for argument in launch.arguments) or "\t" in launch.assembly():
+                continue
+
+            self.launches[test_path] = launch
+            environment_counts[tuple(launch.variables)] += 1
+
+        # A batch of one saves nothing.
+        for test_path in list(self.launches):
+            if environment_counts[tuple(self.launches[test_path].variables)] == 1:
+                del self.launches[test_path]
+                self.environment_rejected_count += 1
+
+        return len(self.launches)
+
+    def __run_batch__(self, tests):
+        """ Run tests in a batch host
+
+        Returns:
+            (results, crashed, remaining): the TestExecutionResults of the
+                                         : tests that ran, the test that took
+                                         : the host down (or None) and the
+                                         : tests that did not start
+        """
+
+        batch_location = os.path.join(self.report_location, "Batches")
+        if not os.path.isdir(batch_location):
+            try:
+                os.makedirs(batch_location)
+            except OSError:
+                # Another worker may have created it.
+                assert os.path.isdir(batch_location)
+
+        handle, batch_file = tempfile.mkstemp(prefix="batch", suffix=".txt", dir=batch_location)
+        os.close(handle)
+
+        results_file = batch_file + ".results"
+        report_files = [self.__report_files__(test_path) for test_path in tests]
+
+        with open(batch_file, "w") as file_handle:
+            for index, test_path in enumerate(tests):
+                launch = self.launches[test_path]
+                _, output_file, error_file = report_files[index]
+
+                # The host appends to the output; start with empty files, as
+                # a test run on its own does.
+                open(output_file, "wb").close()
+                open(error_file, "wb").close()
+
+                file_handle.write("\t".join([str(index), output_file, launch.assembly()] + launch.arguments) + "\n")
+
+        command = [os.path.join(self.core_root, "corerun"),
+                   os.path.join(self.core_root, "runincontext.dll"),
+                   "/referencespath:%s/" % self.core_root,
+                   "/batch:%s" % batch_file]
+
+        timed_out = []
+
+        with open(batch_file + ".log", "wb") as log_handle:
+            proc = subprocess.Popen(command,
+                                    stdout=log_handle,
+                                    stderr=subprocess.STDOUT,
+                                    cwd=batch_location,
+                                    env=get_batch_host_environment(self.env, self.launches[tests[0]].variables),
+                                    preexec_fn=os.setsid)
+
+            # The host is timed out from its last START or END line (or from
+            # its start), whether or not a test is running: it can also hang
+            # before the first test or at shutdown, after the last one.
+            progress = None
+            current_start = time.time()
+
+            while proc.poll() is None:
+                started, ended = read_batch_results(results_file)
+
+                if (len(started), len(ended)) != progress:
+                    progress = (len(started), len(ended))
+                    current_start = time.time()
+                else:
+                    running = len(started) > 0 and started[-1] not in ended
+                    if running:
+                        timeout = self.timeouts.get(tests[started[-1]], self.timeout)
+                    elif len(started) < len(tests):
+                        timeout = self.timeouts.get(tests[len(started)], self.timeout)
+                    else:
+                        timeout = self.timeout
+
+                    if time.time() - current_start > timeout:
+                        if running:
+                            timed_out.append(started[-1])
+
+                        kill_process_tree(proc)
+                        proc.wait()
+                        break
+
+                time.sleep(batch_poll_interval)
+
+        started, ended = read_batch_results(results_file)
+
+        if len(started) == 0:
+            # The host did not get as far as the first test; run them on their own.
+            return [], None, tests
+
+        results = []
+        crashed = None
+
+        for index, test_path in enumerate(tests):
+            relative_path, output_file, error_file = report_files[index]
+
+            if index in ended:
+                exit_code, elapsed_time = ended[index]
+                expected_exit_code = self.launches[test_path].expected_exit_code
+
+                # Match what the wrapper and CoreclrTestWrapperLib write.
+                with open(output_file, "ab") as output_handle:
+                    output_handle.write(("Expected: %d\nActual: %d\n" % (expected_exit_code, exit_code)).encode("utf-8"))
+                    output_handle.write(("Test Harness Exitcode is : %d\n" % (0 if exit_code == expected_exit_code else 1)).encode("utf-8"))
+
+                results.append(TestExecutionResult(test_path, relative_path, 0 if exit_code == expected_exit_code else 1, False, elapsed_time, output_file, error_file))
+            elif index in timed_out:
+                message = ("\ncmdLine:%s Timed Out\n" % test_path).encode("utf-8")
+                with open(output_file, "ab") as output_handle:
+                    output_handle.write(message)
+                    output_handle.write(("Test Harness Exitcode is : %d\n" % -signal.SIGKILL).encode("utf-8"))
+                with open(error_file, "ab") as error_handle:
+                    error_handle.write(message)
+
+                results.append(TestExecutionResult(test_path, relative_path, -signal.SIGKILL, True, time.time() - current_start, output_file, error_file))
+            elif index in started:
+                crashed = test_path
+            else:
+                return results, crashed, tests[index:]
+
+        return results, crashed, []
+
+    def run(self):
+        """ Run all of the tests
+
+        Returns:
+            A generator of TestExecutionResult, yielded as the tests finish.
+        """
+
+        self.probe()
+
+        pending = queue.Queue()
+
+        # Only tests with the same variables share a batch host.
+        batches = OrderedDict()
+
+        for test_path in self.tests:
+            if test_path not in self.launches:
+                pending.put((False, test_path))
+                continue
+
+            batch = batches.setdefault(tuple(self.launches[test_path].variables), [])
+            batch.append(test_path)
+            if len(batch) == self.batch_size:
+                pending.put((True, list(batch)))
+                del batch[:]
+
+        for batch in batches.values():
+            if len(batch) > 0:
+                pending.put((True, batch))
+
+        completed = queue.Queue()
+
+        def worker():
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+
+                is_batch, payload = item
+
+                try:
+                    if not is_batch:
+                        completed.put(self.__run_test__(payload))
+                        continue
+
+                    results, crashed, remaining = self.__run_batch__(payload)
+
+                    for result in results:
+                        completed.put(result)
+
+                    if crashed is not None:
+                        pending.put((False, crashed))
+
+                    if len(remaining) == len(payload):
+                        for test_path in remaining:
+                            pending.put((False, test_path))
+                    elif len(remaining) > 0:
+                        pending.put((True, remaining))
+                except Exception as error:
+                    # Hand the error to the caller instead of silently losing
+                    # the worker (and waiting forever for its result).
+                    completed.put(error)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.parallel_count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for _ in range(len(self.tests)):
+            result = completed.get()
+            if isinstance(result, Exception):
+                raise result
+
+            yield result
+
+        for _ in threads:
+            pending.put(None)
+
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : test_executor.py
+#
+# Notes:
+#
+# Runs the generated coreclr test wrappers directly from python, without
+# runtest.proj, msbuild or the xunit console runner. Each wrapper is run the
+# same way CoreclrTestWrapperLib.RunTest runs it: stdout and stderr go to
+# <name>.output.txt and <name>.error.txt under the reports directory, a
+# non-zero exit code is a failure, and the test is killed once it runs past
+# its timeout.
+#
+# Results are returned as they complete, and can be written out as an xunit
+# style testRun.xml so the existing result parsing keeps working.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import errno
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import xml.etree.ElementTree
+
+if sys.version_info.major < 3:
+    import Queue as queue
+else:
+    import queue
+
+from managed_assemblies import walk_files
+from test_wrappers import mangle_test_name
+
+################################################################################
+# Globals
+################################################################################
+
+# A helper module for runtest.py, not a test module; keep pytest from
+# collecting it.
+__test__ = False
+
+# Matches [Fact(DisplayName=@"<relative path of the wrapper>")] in the
+# generated xunit wrapper sources.
+display_name_regex = re.compile(r'DisplayName=@"([^"]*)"')
+
+# Resource usage recorded for each test, see ResourceUsage.
+resource_usage_fields = ["user_time", "system_time", "max_rss_kb", "block_reads", "block_writes"]
+
+# Characters that cannot appear in an xml 1.0 document.
+invalid_xml_chars_regex = re.compile(u"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def read_included_test_names(test_location):
+    """ Read which tests the xunit wrappers would run
+
+    Args:
+        test_location (str): root of the built tests
+
+    Returns:
+        included ({str}): relative paths of the test wrappers that are not
+                        : excluded (issues.targets, GCStressIncompatible...),
+                        : or None if the wrapper sources are not there
+
+    Notes:
+        The exclusions are applied when the xunit wrappers are generated, so
+        the generated sources under <test_location>/TestWrappers are the only
+        place that knows which tests to skip.
+    """
+
+    wrapper_location = os.path.join(test_location, "TestWrappers")
+    if not os.path.isdir(wrapper_location):
+        return None
+
+    included = set()
+    for path in walk_files(wrapper_location, [".cs"]):
+        with open(path) as file_handle:
+            for display_name in display_name_regex.findall(file_handle.read()):
+                included.add(os.path.normcase(os.path.normpath(display_name)))
+
+    return included
+
+def kill_process_tree(proc):
+    """ Kill a test wrapper and everything it started
+
+    Args:
+        proc (Popen): process started by TestExecutor
+    """
+
+    try:
+        if sys.platform == "win32":
+            with open(os.devnull, "w") as devnull:
+                subprocess.call(["taskkill", "/T", "/F", "/PID", str(proc.pid)], stdout=devnull, stderr=devnull)
+        else:
+            # The wrapper was made a process group leader when it was started.
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def wait_for_process(proc):
+    """ Wait for a process to exit
+
+    Args:
+        proc (Popen): process to wait for
+
+    Returns:
+        (exit_code, usage): usage is the ResourceUsage of the process and of
+                          : the children it waited for, or None where
+                          : os.wait4 is not available (Windows)
+    """
+
+    if not hasattr(os, "wait4"):
+        return proc.wait(), None
+
+    while True:
+        try:
+            _, status, rusage = os.wait4(proc.pid, 0)
+            break
+        except OSError as error:
+            if error.errno != errno.EINTR:
+                raise
+
+    if os.WIFSIGNALED(status):
+        exit_code = -os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+
+    # The process has been reaped; tell Popen, so it does not wait for it again.
+    proc.returncode = exit_code
+
+    return exit_code, ResourceUsage.from_rusage(rusage)
+
+def read_text(path):
+    """ Read a file as text, for the test output reported in testRun.xml
+    """
+
+    try:
+        with open(path, "rb") as file_handle:
+            contents = file_handle.read()
+    except (IOError, OSError) as error:
+        return u"Unable to read file: %s\n%s" % (path, str(error))
+
+    return contents.decode("utf-8", "replace")
+
+################################################################################
+# Classes
+################################################################################
+
+class ResourceUsage(object):
+    """ Resources used by a test wrapper and everything it waited for
+
+    Notes:
+        user_time and system_time are cpu seconds, max_rss_kb is the peak
+        resident set of the largest process (in KiB) and block_reads and
+        block_writes count filesystem block operations. In testRun.xml they
+        are written as attributes of the test element.
+    """
+
+    __slots__ = list(resource_usage_fields)
+
+    def __init__(self, user_time, system_time, max_rss_kb, block_reads, block_writes):
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss_kb = max_rss_kb
+        self.block_reads = block_reads
+        self.block_writes = block_writes
+
+    @property
+    def cpu_time(self):
+        return self.user_time + self.system_time
+
+    @staticmethod
+    def from_rusage(rusage):
+        """ Build a ResourceUsage from the rusage returned by os.wait4
+        """
+
+        # ru_maxrss is in bytes on macOS and in KiB everywhere else.
+        max_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+
+        return ResourceUsage(rusage.ru_utime, rusage.ru_stime, max_rss_kb, rusage.ru_inblock, rusage.ru_oublock)
+
+    @staticmethod
+    def from_attributes(attributes):
+        """ Read a ResourceUsage back from the attributes of a test element
+
+        Returns:
+            usage (ResourceUsage): None if the attributes are not there
+        """
+
+        if any(field not in attributes for field in resource_usage_fields):
+            return None
+
+        return ResourceUsage(float(attributes["user_time"]),
+                             float(attributes["system_time"]),
+                             int(attributes["max_rss_kb"]),
+                             int(attributes["block_reads"]),
+                             int(attributes["block_writes"]))
+
+    def to_attributes(self):
+        return {
+            "user_time": "%.3f" % self.user_time,
+            "system_time": "%.3f" % self.system_time,
+            "max_rss_kb": str(self.max_rss_kb),
+            "block_reads": str(self.block_reads),
+            "block_writes": str(self.block_writes)
+        }
+
+class TestExecutionResult(object):
+    """ Outcome of running a single test wrapper
+    """
+
+    __slots__ = ["test_path", "relative_path", "name", "exit_code", "passed", "timed_out", "time", "output_file", "error_file", "usage", "cached", "config"]
+
+    def __init__(self, test_path, relative_path, exit_code, timed_out, time, output_file, error_file, usage=None, cached=False, config=None):
+        self.test_path = test_path
+        self.relative_path = relative_path
+        self.name = mangle_test_name(relative_path)
+        self.exit_code = exit_code
+        self.passed = exit_code == 0 and not timed_out
+        self.timed_out = timed_out
+        self.time = time
+        self.output_file = output_file
+        self.error_file = error_file
+        self.usage = usage
+        self.cached = cached
+        self.config = config
+
+class TestExecutor(object):
+    """ Run test wrappers on a pool of worker threads
+
+    Notes:
+        Each worker thread starts one wrapper at a time and waits for it, so
+        the number of workers is the number of tests running at once. The
+        tests are started in the order they are given.
+    """
+
+    def __init__(self, tests, test_location, report_location, host_os, parallel_count, timeout, env=None, timeouts=None, cpu_allocator=None):
+        """ Constructor
+
+        Args:
+            tests ([str])           : paths of the test wrappers to run
+            test_location (str)     : root of the built tests
+            report_location (str)   : where to write the output of the tests
+            host_os (str)           : os
+            parallel_count (int)    : number of tests to run at once
+            timeout (float)         : per test timeout, in seconds
+            env (dict)              : environment for the tests, defaults to
+                                    : the current environment
+            timeouts (dict)         : timeouts in seconds of some of the tests,
+                                    : by test path; the others use timeout
+            cpu_allocator (CpuAllocator): if given, each test is pinned to the
+                                    : cpus it hands out
+        """
+
+        self.tests = tests
+        self.test_location = test_location
+        self.report_location = report_location
+        self.host_os = host_os
+        self.parallel_count = max(1, min(parallel_count, len(tests)))
+        self.timeout = timeout
+        self.env = env if env is not None else os.environ.copy()
+        self.timeouts = timeouts if timeouts is not None else {}
+        self.cpu_allocator = cpu_allocator
+
+    def __report_files__(self, test_path, report_location=None):
+        """ Return where the output of a test goes
+
+        Args:
+            test_path (str)         : path of the test wrapper
+            report_location (str)   : defaults to the report location of the
+                                    : executor
+
+        Returns:
+            (relative_path, output_file, error_file)
+        """
+
+        if report_location is None:
+            report_location = self.report_location
+
+        relative_path = os.path.relpath(test_path, self.test_location)
+        report_base = os.path.join(report_location, os.path.splitext(relative_path)[0])
+
+        if not os.path.isdir(os.path.dirname(report_base)):
+            try:
+                os.makedirs(os.path.dirname(report_base))
+            except OSError:
+                # Another worker may have created it.
+                assert os.path.isdir(os.path.dirname(report_base))
+
+        return relative_path, report_base + ".output.txt", report_base + ".error.txt"
+
+    def __run_test__(self, test_path, env=None, timeout=None, report_location=None):
+        """ Run a single test wrapper
+
+        Args:
+            test_path (str)         : path of the test wrapper
+            env (dict)              : defaults to the environment of the executor
+            timeout (float)         : defaults to the timeout of the test
+            report_location (str)   : defaults to the report location of the
+                                    : executor
+
+        Returns:
+            result (TestExecutionResult)
+        """
+
+        relative_path, output_file, error_file = self.__report_files__(test_path, report_location)
+
+        if env is None:
+            env = self.env
+
+        if timeout is None:
+            timeout = self.timeouts.get(test_path, self.timeout)
+
+        if self.cpu_allocator is not None:
+            cpu_groups = self.cpu_allocator.acquire(test_path)
+            try:
+                cpus = self.cpu_allocator.cpus(cpu_groups)
+
+                def preexec():
+                    os.setsid()
+                    os.sched_setaffinity(0, cpus)
+
+                return self.__start_test__(test_path, relative_path, output_file, error_file, self.cpu_allocator.environment(env, cpus), timeout, preexec)
+            finally:
+                self.cpu_allocator.release(cpu_groups)
+
+        return self.__start_test__(test_path, relative_path, output_file, error_file, env, timeout, os.setsid)
+
+    def __start_test__(self, test_path, relative_path, output_file, error_file, env, timeout, preexec_fn):
+        """ Run a single test wrapper, see __run_test__
+
+        Args:
+            preexec_fn (callable): run in the child before the wrapper starts,
+                                 : on everything but Windows
+        """
+
+        if self.host_os == "Windows_NT":
+            command = [test_path]
+            popen_args = { "creationflags": subprocess.CREATE_NEW_PROCESS_GROUP }
+        else:
+            command = ["/bin/bash", test_path]
+            popen_args = { "preexec_fn": preexec_fn }
+
+        timed_out = []
+
+        def on_timeout(proc):
+            timed_out.append(True)
+            kill_process_tree(proc)
+
+        start_time = time.time()
+
+        with open(output_file, "wb") as output_handle, open(error_file, "wb") as error_handle:
+            proc = subprocess.Popen(command,
+                                    stdout=output_handle,
+                                    stderr=error_handle,
+                                    cwd=os.path.dirname(test_path),
+                                    env=env,
+                                    **popen_args)
+
+            timer = threading.Timer(timeout, on_timeout, [proc])
+            timer.start()
+            try:
+                exit_code, usage = wait_for_process(proc)
+            finally:
+                timer.cancel()
+
+        elapsed_time = time.time() - start_time
+
+        # Match what CoreclrTestWrapperLib writes.
+        with open(output_file, "ab") as output_handle:
+            if len(timed_out) > 0:
+                output_handle.write(("\ncmdLine:%s Timed Out\n" % test_path).encode("utf-8"))
+            output_handle.write(("Test Harness Exitcode is : %d\n" % exit_code).encode("utf-8"))
+
+        if len(timed_out) > 0:
+            with open(error_file, "ab") as error_handle:
+                error_handle.write(("\ncmdLine:%s Timed Out\n" % test_path).encode("utf-8"))
+
+        return TestExecutionResult(test_path, relative_path, exit_code, len(timed_out) > 0, elapsed_time, output_file, error_file, usage)
+
+    def run(self):
+        """ Run all of the tests
+
+        Returns:
+            A generator of TestExecutionResult, yielded as the tests finish.
+        """
+
+        pending = queue.Queue()
+        for test_path in self.tests:
+            pending.put(test_path)
+
+        completed = queue.Queue()
+
+        def worker():
+            while True:
+                try:
+                    test_path = pending.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    completed.put(self.__run_test__(test_path))
+                except Exception as error:
+                    # Hand the error to the caller instead of silently losing
+                    # the worker (and waiting forever for its result).
+                    completed.put(error)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.parallel_count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for _ in range(len(self.tests)):
+            result = completed.get()
+            if isinstance(result, Exception):
+                raise result
+
+            yield result
+
+        for thread in threads:
+            thread.join()
+
+class XunitResultsWriter(object):
+    """ Write test results as an xunit style testRun.xml
+
+    Notes:
+        Each result is written as soon as it is added, as its own collection,
+        in the layout runtest.py's parse_test_results reads: the reported
+        test name is the mangled relative path of the wrapper, and a failure
+        carries the same text the xunit wrappers report.
+    """
+
+    def __init__(self, path, core_root):
+        self.path = path
+        self.core_root = core_root
+        self.file_handle = None
+
+    def __enter__(self):
+        self.file_handle = open(self.path, "wb")
+        self.file_handle.write(b'<?xml version="1.0" encoding="utf-8"?>\n<assemblies>\n<assembly name="runtest.py">\n<errors />\n')
+        return self
+
+    def __exit__(self, *args):
+        self.file_handle.write(b"</assembly>\n</assemblies>\n")
+        self.file_handle.close()
+
+    def __failure_text__(self, result):
+        """ Build the failure message, as runtest.proj's generated facts do.
+        """
+
+        lines = [read_text(result.error_file),
+                 u"",
+                 u"Return code:      %d" % result.exit_code,
+                 u"Raw output file:      %s" % result.output_file,
+                 u"Raw output:",
+                 read_text(result.output_file),
+                 u"To run the test:",
+                 u"> set CORE_ROOT=%s" % self.core_root,
+                 u"> %s" % result.test_path]
+
+        return invalid_xml_chars_regex.sub(u"", u"\n".join(lines))
+
+    def add(self, result):
+        """ Write a TestExecutionResult
+
+        Args:
+            result (TestExecutionResult): result to write
+        """
+
+        time_str = "%.3f" % result.time
+
+        attributes = {}
+        if result.config is not None:
+            # The -matrix configuration the test ran under.
+            attributes["config"] = result.config
+
+        collection = xml.etree.ElementTree.Element("collection", dict(attributes, **{
+            "name": result.relative_path,
+            "total": "1",
+            "passed": "1" if result.passed else "0",
+            "failed": "0" if result.passed else "1",
+            "skipped": "0",
+            "time": time_str
+        }))
+
+        test = xml.etree.ElementTree.SubElement(collection, "test", dict(attributes, **{
+            "name": result.relative_path,
+            "type": result.name,
+            "method": "",
+            "time": time_str,
+            "result": "Pass" if result.passed else "Fail"
+        }))
+
+        if result.usage is not None:
+            test.attrib.update(result.usage.to_attributes())
+
+        if result.cached:
+            # Not run; it passed before with the same inputs.
+            test.attrib["cached"] = "true"
+
+        if not result.passed:
+            failure = xml.etree.ElementTree.SubElement(test, "failure")
+            failure.text = self.__failure_text__(result)
+
+        self.file_handle.write(xml.etree.ElementTree.tostring(collection))
+        self.file_handle.write(b"\n")
+        self.file_handle.flush()
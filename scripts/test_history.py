@@ -0,0 +1,638 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : test_history.py
+#
+# Notes:
+#
+# A local sqlite store of coreclr test results across runs, kept under
+# bin/Logs. Every run records the outcome and duration of each test; the
+# history is used to run the longest tests first and to predict how long a
+# run will take. Runs through the python runner also record the cpu time, peak
+# memory and block I/O of each test, and how failing tests did when they were
+# retried, to tell flaky tests from deterministic failures.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import math
+import os
+import sqlite3
+import time
+
+from collections import defaultdict
+
+################################################################################
+# Globals
+################################################################################
+
+# A helper module for runtest.py, not a test module; keep pytest from
+# collecting it.
+__test__ = False
+
+test_history_file_name = "test_history.sqlite"
+
+# Bump when the schema changes; __upgrade__ brings older stores up to date.
+test_history_schema_version = 3
+
+# How many of the most recent runs of a test are used to estimate its duration.
+default_history_window = 10
+
+# Commit after this many results, so a killed run still leaves its results.
+commit_interval = 50
+
+# Variables runtest.py sets to change how the wrappers run a test. Together
+# with the COMPlus_ variables they name the test configuration of a run.
+test_mode_variables = [
+    "CLRCustomTestLauncher",
+    "LargeVersionBubble",
+    "RunCrossGen",
+    "RunInUnloadableContext",
+    "RunningGCSimulatorTests",
+    "RunningIlasmRoundTrip",
+    "RunningJitDisasm",
+    "RunningLongGCTests"
+]
+
+# Adaptive timeouts are max(multiplier * p99, floor) of the recent passing
+# durations of a test, for tests with at least min_samples of them.
+adaptive_timeout_multiplier = 5
+adaptive_timeout_floor = 3 * 60
+adaptive_timeout_min_samples = 3
+adaptive_timeout_window = 20
+
+# A test's duration is a significant change when, compared to its recent
+# passing durations, its modified z-score (0.6745 * (x - median) / MAD) is
+# beyond the threshold, it changed by at least min_ratio and by at least
+# min_seconds, and there are at least min_samples previous durations.
+duration_change_window = 20
+duration_change_min_samples = 5
+duration_change_threshold = 3.5
+duration_change_min_ratio = 1.25
+duration_change_min_seconds = 1.0
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def normalize_test_name(relative_path):
+    """ Return the key a test is stored under
+
+    Args:
+        relative_path (str): path of the test wrapper relative to the test location
+
+    Notes:
+        The extension is dropped and "/" is always used as the separator, so
+        Windows (.cmd) and Unix (.sh) runs of the same test share a history.
+    """
+
+    return os.path.splitext(relative_path)[0].replace("\\", "/")
+
+def median(values):
+    """ Return the median of a non-empty list of numbers
+    """
+
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2 == 1:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def percentile(values, fraction):
+    """ Return the nearest rank percentile of a non-empty list of numbers
+
+    Args:
+        values ([float])    : numbers
+        fraction (float)    : e.g. 0.99 for the 99th percentile
+    """
+
+    values = sorted(values)
+    rank = int(math.ceil(fraction * len(values)))
+
+    return values[max(0, min(len(values), rank) - 1)]
+
+def median_absolute_deviation(values, center):
+    """ Return the median of the absolute deviations of values from center
+    """
+
+    return median([abs(value - center) for value in values])
+
+def find_duration_changes(durations, statistics):
+    """ Find the tests whose duration changed significantly from their history
+
+    Args:
+        durations ({str: float})                : test to its duration in this run
+        statistics ({str: (float, float, int)}) : test to the (median, MAD, count)
+                                                : of its previous durations, see
+                                                : TestHistory.duration_statistics
+
+    Returns:
+        (slower, faster): lists of {"test", "time", "median", "mad", "samples",
+                        : "ratio", "score"} dictionaries, the largest change
+                        : first
+    """
+
+    slower = []
+    faster = []
+
+    for test, duration in durations.items():
+        if test not in statistics:
+            continue
+
+        center, mad, count = statistics[test]
+
+        # A test that took no time is no baseline for a ratio.
+        if count < duration_change_min_samples or center <= 0:
+            continue
+
+        # Tests that always take the same time have a MAD of (almost) zero;
+        # do not let that turn a tiny change into an infinite score.
+        score = 0.6745 * (duration - center) / max(mad, 0.01 * center, 0.001)
+
+        change = {
+            "test": test,
+            "time": duration,
+            "median": center,
+            "mad": mad,
+            "samples": count,
+            "ratio": duration / center,
+            "score": score
+        }
+
+        if abs(duration - center) < duration_change_min_seconds or abs(score) < duration_change_threshold:
+            continue
+
+        if duration >= center * duration_change_min_ratio:
+            slower.append(change)
+        elif duration * duration_change_min_ratio <= center:
+            faster.append(change)
+
+    slower.sort(key=lambda change: change["ratio"], reverse=True)
+    faster.sort(key=lambda change: change["ratio"])
+
+    return slower, faster
+
+def get_test_config(complus_vars, environ=None):
+    """ Name the test configuration (stress mode) of a run
+
+    Args:
+        complus_vars (dict) : COMPlus_ variables of the run, as returned by
+                            : runtest.py's get_environment
+        environ (dict)      : environment, defaults to os.environ
+
+    Returns:
+        config (str): "" for a default run, otherwise the non-empty variables
+                    : as sorted "name=value" pairs joined by ";"
+    """
+
+    if environ is None:
+        environ = os.environ
+
+    # get_environment also stores every variable under its lower case name.
+    parts = set("%s=%s" % (key.lower(), value.lower()) for key, value in complus_vars.items() if value)
+
+    for key in test_mode_variables:
+        if environ.get(key):
+            parts.add("%s=%s" % (key, environ[key]))
+
+    return ";".join(sorted(parts))
+
+def format_duration(seconds):
+    """ Format a duration as e.g. "1h 02m", "12m 30s" or "45s"
+    """
+
+    seconds = int(round(seconds))
+
+    if seconds >= 60**2:
+        return "%dh %02dm" % (seconds // 60**2, (seconds % 60**2) // 60)
+    elif seconds >= 60:
+        return "%dm %02ds" % (seconds // 60, seconds % 60)
+
+    return "%ds" % seconds
+
+################################################################################
+# Classes
+################################################################################
+
+class TestHistory(object):
+    """ Results of previous test runs, in bin/Logs/test_history.sqlite
+
+    Notes:
+        Runs are keyed by (host_os, arch, build_type, config). config names
+        the test configuration (e.g. a stress mode); durations from different
+        configurations are not comparable and are never mixed.
+    """
+
+    def __init__(self, logs_dir, host_os, arch, build_type, config=""):
+        if not os.path.isdir(logs_dir):
+            os.makedirs(logs_dir)
+
+        self.path = os.path.join(logs_dir, test_history_file_name)
+        self.host_os = host_os
+        self.arch = arch
+        self.build_type = build_type
+        self.config = config
+
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.run_id = None
+        self.uncommitted = 0
+
+        self.__upgrade__()
+
+    def __upgrade__(self):
+        """ Create the tables, or update them from an older schema
+
+        Notes:
+            Shards on one machine can open the same file at once. The version
+            is read again under a write lock, so only one of them upgrades
+            (adding a column twice would fail).
+        """
+
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] == test_history_schema_version:
+            return
+
+        # Manage the transaction here: python2's sqlite3 would commit before
+        # each CREATE/ALTER statement.
+        isolation_level = self.connection.isolation_level
+        self.connection.isolation_level = None
+
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+                if version < 1:
+                    self.connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                                   id INTEGER PRIMARY KEY,
+                                                   started REAL,
+                                                   host_os TEXT,
+                                                   arch TEXT,
+                                                   build_type TEXT,
+                                                   config TEXT)""")
+
+                    self.connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                                   run_id INTEGER,
+                                                   test TEXT,
+                                                   outcome TEXT,
+                                                   duration REAL)""")
+
+                    self.connection.execute("CREATE INDEX IF NOT EXISTS results_by_test ON results (test, run_id)")
+
+                if version < 2:
+                    # Resource usage; NULL when it was not measured (msbuild runs, Windows).
+                    for column, column_type in [("user_time", "REAL"),
+                                                ("system_time", "REAL"),
+                                                ("max_rss_kb", "INTEGER"),
+                                                ("block_reads", "INTEGER"),
+                                                ("block_writes", "INTEGER")]:
+                        self.connection.execute("ALTER TABLE results ADD COLUMN %s %s" % (column, column_type))
+
+                if version < 3:
+                    self.connection.execute("""CREATE TABLE IF NOT EXISTS retries (
+                                                   run_id INTEGER,
+                                                   test TEXT,
+                                                   attempts INTEGER,
+                                                   passes INTEGER)""")
+
+                    self.connection.execute("CREATE INDEX IF NOT EXISTS retries_by_test ON retries (test, run_id)")
+
+                self.connection.execute("PRAGMA user_version = %d" % test_history_schema_version)
+                self.connection.execute("COMMIT")
+            except:
+                self.connection.execute("ROLLBACK")
+                raise
+        finally:
+            self.connection.isolation_level = isolation_level
+
+    def with_config(self, config):
+        """ Return the history of another configuration, sharing this connection
+
+        Notes:
+            Histories that record into the same file at the same time must
+            share a connection, or they lock each other out. Only close the
+            history the others were made from.
+        """
+
+        history = TestHistory.__new__(TestHistory)
+
+        history.path = self.path
+        history.host_os = self.host_os
+        history.arch = self.arch
+        history.build_type = self.build_type
+        history.config = config
+
+        history.connection = self.connection
+        history.run_id = None
+        history.uncommitted = 0
+
+        return history
+
+    def __matching_runs__(self):
+        """ SQL condition and parameters selecting the runs of this configuration
+        """
+
+        return ("run_id IN (SELECT id FROM runs WHERE host_os = ? AND arch = ? AND build_type = ? AND config = ?)",
+                (self.host_os, self.arch, self.build_type, self.config))
+
+    def start_run(self):
+        """ Start recording a new run
+        """
+
+        cursor = self.connection.execute("INSERT INTO runs (started, host_os, arch, build_type, config) VALUES (?, ?, ?, ?, ?)",
+                                         (time.time(), self.host_os, self.arch, self.build_type, self.config))
+        self.run_id = cursor.lastrowid
+        self.connection.commit()
+
+    def record(self, relative_path, outcome, duration, usage=None):
+        """ Record the result of a test in the current run
+
+        Args:
+            relative_path (str) : path of the test wrapper relative to the test location
+            outcome (str)       : "pass", "fail", "timeout" or "skip"
+            duration (float)    : wall time, in seconds
+            usage (ResourceUsage): resources used by the test, if measured
+        """
+
+        assert self.run_id is not None
+
+        if usage is not None:
+            usage_values = (usage.user_time, usage.system_time, usage.max_rss_kb, usage.block_reads, usage.block_writes)
+        else:
+            usage_values = (None, None, None, None, None)
+
+        self.connection.execute("""INSERT INTO results (run_id, test, outcome, duration, user_time, system_time, max_rss_kb, block_reads, block_writes)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                (self.run_id, normalize_test_name(relative_path), outcome, duration) + usage_values)
+
+        self.uncommitted += 1
+        if self.uncommitted >= commit_interval:
+            self.flush()
+
+    def record_retry(self, relative_path, attempts, passes):
+        """ Record how a failed test did when it was retried in the current run
+
+        Args:
+            relative_path (str) : path of the test wrapper relative to the test location
+            attempts (int)      : number of times it was rerun
+            passes (int)        : number of those that passed
+        """
+
+        assert self.run_id is not None
+
+        self.connection.execute("INSERT INTO retries (run_id, test, attempts, passes) VALUES (?, ?, ?, ?)",
+                                (self.run_id, normalize_test_name(relative_path), attempts, passes))
+
+    def flush(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def durations(self, window=default_history_window):
+        """ Return the recent durations of every test with a history
+
+        Args:
+            window (int): number of most recent results to keep per test
+
+        Returns:
+            durations (defaultdict(str, [float])): most recent first
+
+        Notes:
+            Skipped tests do not tell how long a test takes, so they are left
+            out. Timeouts are kept: their duration is a lower bound, and a
+            test that keeps timing out should still be started early.
+        """
+
+        condition, parameters = self.__matching_runs__()
+
+        durations = defaultdict(list)
+        query = "SELECT test, duration FROM results WHERE outcome IN ('pass', 'fail', 'timeout') AND %s ORDER BY run_id DESC" % condition
+
+        for test, duration in self.connection.execute(query, parameters):
+            if len(durations[test]) < window:
+                durations[test].append(duration)
+
+        return durations
+
+    def last_failures(self):
+        """ Return the tests whose most recent result is a failure
+
+        Returns:
+            failures ({str}): normalized names (see normalize_test_name) of the
+                            : tests that failed or timed out the last time
+                            : they were run
+        """
+
+        condition, parameters = self.__matching_runs__()
+
+        latest = {}
+        query = "SELECT test, outcome FROM results WHERE outcome != 'skip' AND %s ORDER BY run_id DESC" % condition
+
+        for test, outcome in self.connection.execute(query, parameters):
+            if test not in latest:
+                latest[test] = outcome
+
+        return set(test for test, outcome in latest.items() if outcome in ("fail", "timeout"))
+
+    def flakiness(self):
+        """ Return how often each retried test turned out to be flaky
+
+        Returns:
+            flakiness ({str: (int, int)}): test to (runs in which a retry
+                                         : passed, runs in which it was retried)
+        """
+
+        condition, parameters = self.__matching_runs__()
+
+        flakiness = {}
+        query = "SELECT test, SUM(CASE WHEN passes > 0 THEN 1 ELSE 0 END), COUNT(*) FROM retries WHERE %s GROUP BY test" % condition
+
+        for test, flaky_runs, retried_runs in self.connection.execute(query, parameters):
+            flakiness[test] = (flaky_runs, retried_runs)
+
+        return flakiness
+
+    def resource_usage(self, window=default_history_window):
+        """ Return the typical cpu time and peak memory of every test measured
+
+        Args:
+            window (int): number of most recent measurements to use per test
+
+        Returns:
+            usage ({str: (float, int)}): test to (median cpu seconds, largest
+                                       : max_rss_kb) over the window
+
+        Notes:
+            The peak memory is the largest seen rather than the median, as it
+            is used to keep tests that could run out of memory apart.
+        """
+
+        condition, parameters = self.__matching_runs__()
+
+        samples = defaultdict(list)
+        query = "SELECT test, user_time + system_time, max_rss_kb FROM results WHERE max_rss_kb IS NOT NULL AND %s ORDER BY run_id DESC" % condition
+
+        for test, cpu_time, max_rss_kb in self.connection.execute(query, parameters):
+            if len(samples[test]) < window:
+                samples[test].append((cpu_time, max_rss_kb))
+
+        usage = {}
+        for test, test_samples in samples.items():
+            usage[test] = (median([sample[0] for sample in test_samples]), max(sample[1] for sample in test_samples))
+
+        return usage
+
+    def duration_statistics(self, window=duration_change_window, exclude_latest_run=False):
+        """ Return the median and MAD of the recent passing durations of every test
+
+        Args:
+            window (int)                : number of most recent passes to use per test
+            exclude_latest_run (bool)   : leave out the most recent run, e.g.
+                                        : because it is the run being compared
+
+        Returns:
+            statistics ({str: (float, float, int)}): test to (median, MAD,
+                                                   : number of durations)
+        """
+
+        condition, parameters = self.__matching_runs__()
+
+        if exclude_latest_run:
+            condition += " AND run_id < (SELECT MAX(id) FROM runs WHERE host_os = ? AND arch = ? AND build_type = ? AND config = ?)"
+            parameters = parameters + parameters
+
+        durations = defaultdict(list)
+        query = "SELECT test, duration FROM results WHERE outcome = 'pass' AND %s ORDER BY run_id DESC" % condition
+
+        for test, duration in self.connection.execute(query, parameters):
+            if len(durations[test]) < window:
+                durations[test].append(duration)
+
+        statistics = {}
+        for test, test_durations in durations.items():
+            center = median(test_durations)
+            statistics[test] = (center, median_absolute_deviation(test_durations, center), len(test_durations))
+
+        return statistics
+
+    def adaptive_timeouts(self, relative_paths, default_timeout):
+        """ Compute per test timeouts from the durations of recent passes
+
+        Args:
+            relative_paths ([str])  : tests, relative to the test location
+            default_timeout (float) : the timeout of the run, in seconds; no
+                                    : test is given more than this
+
+        Returns:
+            timeouts ({str: float}): timeout in seconds of each test with
+                                   : enough passes in its history; the other
+                                   : tests keep default_timeout
+        """
+
+        condition, parameters = self.__matching_runs__()
+
+        durations = defaultdict(list)
+        query = "SELECT test, duration FROM results WHERE outcome = 'pass' AND %s ORDER BY run_id DESC" % condition
+
+        for test, duration in self.connection.execute(query, parameters):
+            if len(durations[test]) < adaptive_timeout_window:
+                durations[test].append(duration)
+
+        timeouts = {}
+        for relative_path in relative_paths:
+            history = durations.get(normalize_test_name(relative_path))
+            if history is None or len(history) < adaptive_timeout_min_samples:
+                continue
+
+            timeout = max(adaptive_timeout_multiplier * percentile(history, 0.99), adaptive_timeout_floor)
+            timeouts[relative_path] = min(timeout, default_timeout)
+
+        return timeouts
+
+    def expected_durations(self, relative_paths, window=default_history_window):
+        """ Estimate how long each test will take
+
+        Args:
+            relative_paths ([str]): tests, relative to the test location
+
+        Returns:
+            (estimates, known_count): estimates maps each test to its
+                                    : expected duration in seconds. Tests
+                                    : without a history are given the median
+                                    : of the known tests. known_count is the
+                                    : number of tests with a history.
+        """
+
+        durations = self.durations(window)
+
+        known = {}
+        for relative_path in relative_paths:
+            history = durations.get(normalize_test_name(relative_path))
+            if history:
+                known[relative_path] = median(history)
+
+        default_estimate = median(list(known.values())) if len(known) > 0 else 1.0
+
+        estimates = {}
+        for relative_path in relative_paths:
+            estimates[relative_path] = known.get(relative_path, default_estimate)
+
+        return estimates, len(known)
+
+class EtaEstimator(object):
+    """ Live estimate of the time left in a run
+
+    Notes:
+        The work left is the expected duration of every test that has not
+        finished, spread over the workers. It is scaled by how the tests that
+        did finish compare to their estimates, so a machine that is slower
+        than the history does not keep reporting an optimistic ETA.
+    """
+
+    def __init__(self, estimates, parallel_count):
+        self.estimates = dict(estimates)
+        self.parallel_count = max(1, parallel_count)
+        self.remaining = sum(self.estimates.values())
+        self.predicted_done = 0.0
+        self.actual_done = 0.0
+
+    def predicted_total(self):
+        """ Predicted wall time of the whole run, in seconds
+
+        Notes:
+            The run cannot take less than its longest test.
+        """
+
+        if len(self.estimates) == 0:
+            return 0.0
+
+        return max(sum(self.estimates.values()) / self.parallel_count, max(self.estimates.values()))
+
+    def completed(self, test, duration):
+        """ Account for a finished test; returns the estimated seconds left
+        """
+
+        estimate = self.estimates.pop(test, 0.0)
+
+        self.remaining -= estimate
+        self.predicted_done += estimate
+        self.actual_done += duration
+
+        return self.remaining_time()
+
+    def remaining_time(self):
+        """ Estimated seconds left in the run
+        """
+
+        scale = self.actual_done / self.predicted_done if self.predicted_done > 0 else 1.0
+        return max(0.0, self.remaining) * scale / self.parallel_count
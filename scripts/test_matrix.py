@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : test_matrix.py
+#
+# Notes:
+#
+# Runs the tests under several configurations in a single run of runtest.py,
+# instead of one run per configuration. A configuration is a comma separated
+# list of name=value pairs, e.g.
+#
+#   JitStress=2
+#   GCStress=0xC,timeout=7200,parallel=2
+#   TieredCompilation=0
+#   RunCrossGen=true
+#   default
+#
+# The names are COMPlus_ variables; the COMPlus_ prefix is added unless the
+# name already starts with COMPlus_ or DOTNET_, or is one of the variables
+# runtest.py sets to select a test mode (see test_mode_variables). Two names
+# are options of the configuration rather than variables (and "default" is
+# the configuration without any variables):
+#
+#   timeout     per test timeout in seconds (by default the timeout of the
+#               run, or runtest.py's GCStress timeout when GCStress is set)
+#   parallel    most tests of this configuration that run at once
+#
+# The (test, configuration) pairs of all of the configurations are run by one
+# pool of workers, see MatrixTestExecutor, and their results are tagged with
+# the name of their configuration.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import os
+import re
+import sys
+import threading
+
+from collections import OrderedDict, deque, defaultdict
+
+if sys.version_info.major < 3:
+    import Queue as queue
+else:
+    import queue
+
+from test_executor import TestExecutor
+from test_history import get_test_config, test_mode_variables
+
+################################################################################
+# Globals
+################################################################################
+
+# A helper module for runtest.py, not a test module; keep pytest from
+# collecting it.
+__test__ = False
+
+# Per test timeout under GCStress, as runtest.py's run_tests uses.
+gc_stress_timeout = 120 * 60
+
+# The name of the configuration that does not set any variables.
+default_configuration_name = "default"
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def get_variable_name(name):
+    """ Return the environment variable a configuration name sets
+    """
+
+    if name.lower().startswith("complus_") or name.lower().startswith("dotnet_") or name in test_mode_variables:
+        return name
+
+    return "COMPlus_" + name
+
+def parse_test_configuration(text, default_timeout):
+    """ Parse a -matrix configuration
+
+    Args:
+        text (str)              : comma separated name=value pairs
+        default_timeout (float) : per test timeout of the run, in seconds
+
+    Returns:
+        configuration (TestConfiguration)
+
+    Notes:
+        Raises ValueError for a malformed configuration.
+    """
+
+    variables = OrderedDict()
+    timeout = None
+    parallel_count = None
+
+    if text.strip() == default_configuration_name:
+        text = ""
+
+    for item in text.split(","):
+        item = item.strip()
+        if len(item) == 0:
+            continue
+
+        if "=" not in item:
+            raise ValueError("Expected name=value, got '%s'" % item)
+
+        name, value = [part.strip() for part in item.split("=", 1)]
+        if len(name) == 0:
+            raise ValueError("Expected name=value, got '%s'" % item)
+
+        if name == "timeout":
+            timeout = float(value)
+            if timeout <= 0:
+                raise ValueError("timeout must be greater than 0")
+        elif name == "parallel":
+            parallel_count = int(value)
+            if parallel_count <= 0:
+                raise ValueError("parallel must be greater than 0")
+        else:
+            variables[get_variable_name(name)] = value
+
+    if timeout is None:
+        timeout = default_timeout
+        if any(name.lower() in ("complus_gcstress", "dotnet_gcstress") and value not in ("", "0") for name, value in variables.items()):
+            timeout = max(timeout, gc_stress_timeout)
+
+    name = ",".join("%s=%s" % (key, value) for key, value in variables.items())
+
+    return TestConfiguration(name if len(name) > 0 else default_configuration_name, variables, timeout, parallel_count)
+
+def is_valid_test_configuration(text):
+    """ Return whether text is a well formed -matrix configuration
+    """
+
+    try:
+        parse_test_configuration(text, 0)
+    except ValueError:
+        return False
+
+    return True
+
+################################################################################
+# Classes
+################################################################################
+
+class TestConfiguration(object):
+    """ A set of variables to run the tests under, see parse_test_configuration
+    """
+
+    __slots__ = ["name", "variables", "timeout", "parallel_count"]
+
+    def __init__(self, name, variables, timeout, parallel_count=None):
+        self.name = name
+        self.variables = variables
+        self.timeout = timeout
+        self.parallel_count = parallel_count
+
+    def environment(self, env):
+        """ Return a copy of env with the variables of the configuration set
+        """
+
+        environment = dict(env)
+        environment.update(self.variables)
+
+        return environment
+
+    def report_name(self):
+        """ Return a name for the files and directories of the configuration
+        """
+
+        return re.sub(r"[^A-Za-z0-9_.=-]", "_", self.name)
+
+    def history_config(self, complus_vars, environ):
+        """ Name the configuration in the test history, see get_test_config
+
+        Args:
+            complus_vars (dict) : COMPlus_ variables of the run, as returned
+                                : by runtest.py's get_environment
+            environ (dict)      : environment of the run
+        """
+
+        complus_vars = dict(complus_vars)
+        for key, value in self.variables.items():
+            if key not in test_mode_variables:
+                # get_environment also stores every variable under its lower case name.
+                complus_vars[key] = value
+                complus_vars[key.lower()] = value
+
+        return get_test_config(complus_vars, self.environment(environ))
+
+class MatrixTestExecutor(TestExecutor):
+    """ Run (test, configuration) pairs on a pool of worker threads
+
+    Notes:
+        The pairs are started in the order they are given, except that a
+        pair is skipped over while its configuration already runs as many
+        tests as its parallel option allows. The output of a test goes to
+        <report location>/<configuration>/, and each TestExecutionResult is
+        tagged with the name of its configuration.
+    """
+
+    def __init__(self, items, test_location, report_location, host_os, parallel_count, env=None, timeouts=None, cpu_allocator=None):
+        """ Constructor
+
+        Args:
+            items ([(str, TestConfiguration)])  : tests to run, and under what
+            timeouts (dict)                     : timeouts in seconds of some of
+                                                : the pairs, by (test path,
+                                                : configuration name); the
+                                                : others use the timeout of
+                                                : their configuration
+
+            See TestExecutor for the others.
+        """
+
+        TestExecutor.__init__(self, [test_path for test_path, _ in items], test_location, report_location, host_os, parallel_count, None, env=env, cpu_allocator=cpu_allocator)
+
+        self.items = items
+        self.pair_timeouts = timeouts if timeouts is not None else {}
+
+    def run(self):
+        """ Run all of the pairs
+
+        Returns:
+            A generator of TestExecutionResult, yielded as the tests finish.
+        """
+
+        # One queue per configuration; the next pair to start is the earliest
+        # head of the queues of the configurations that have room.
+        pending = OrderedDict()
+        for index, (test_path, configuration) in enumerate(self.items):
+            pending.setdefault(configuration.name, deque()).append((index, test_path, configuration))
+
+        running = defaultdict(int)
+        condition = threading.Condition()
+
+        def take():
+            with condition:
+                while True:
+                    candidates = [items for items in pending.values() if len(items) > 0]
+                    if len(candidates) == 0:
+                        return None
+
+                    candidates = [items for items in candidates if items[0][2].parallel_count is None or running[items[0][2].name] < items[0][2].parallel_count]
+                    if len(candidates) > 0:
+                        _, test_path, configuration = min(candidates, key=lambda items: items[0][0]).popleft()
+                        running[configuration.name] += 1
+
+                        return test_path, configuration
+
+                    condition.wait()
+
+        completed = queue.Queue()
+
+        def worker():
+            while True:
+                item = take()
+                if item is None:
+                    return
+
+                test_path, configuration = item
+
+                try:
+                    result = self.__run_test__(test_path,
+                                               env=configuration.environment(self.env),
+                                               timeout=self.pair_timeouts.get((test_path, configuration.name), configuration.timeout),
+                                               report_location=os.path.join(self.report_location, configuration.report_name()))
+                    result.config = configuration.name
+                    completed.put(result)
+                except Exception as error:
+                    # Hand the error to the caller instead of silently losing
+                    # the worker (and waiting forever for its result).
+                    completed.put(error)
+                finally:
+                    with condition:
+                        running[configuration.name] -= 1
+                        condition.notify_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.parallel_count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for _ in range(len(self.items)):
+            result = completed.get()
+            if isinstance(result, Exception):
+                raise result
+
+            yield result
+
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : test_progress.py
+#
+# Notes:
+#
+# Progress of a test run while it runs. testRun.xml is only complete (and only
+# parsed) once the run is over, so a run that is killed part way through used
+# to lose all of its results. Two pieces fix that:
+#
+#   PartialResultsWriter    keeps the results seen so far in a json file, in
+#                           the form of the testRun.json that -merge_results
+#                           writes (so it can be merged, or given to
+#                           -shard_durations), rewritten at most every few
+#                           seconds
+#   TestProgressWatcher     follows a run through msbuild and the xunit
+#                           wrappers, which runtest.py cannot see into, by
+#                           watching the output file of every test. The
+#                           wrappers (CoreclrTestWrapperLib) create the file
+#                           when the test starts and end it with
+#                           "Test Harness Exitcode is : <exit code>" when it
+#                           is done.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from test_history import EtaEstimator, format_duration
+from test_wrappers import mangle_test_name
+
+################################################################################
+# Globals
+################################################################################
+
+# A helper module for runtest.py, not a test module; keep pytest from
+# collecting it.
+__test__ = False
+
+# Seconds between two progress reports (and partial results files).
+default_progress_interval = 30
+
+# How much of the end of a failed test's output goes into the partial results.
+partial_output_size = 8 * 1024
+
+harness_exit_code_regex = re.compile(r"Test Harness Exitcode is : (-?[0-9]+)\s*$")
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def get_xunit_output_file(test_location, test_path, report_location=None):
+    """ Return where the xunit wrappers write the output of a test
+
+    Args:
+        test_location (str)     : root of the built tests
+        test_path (str)         : path of the test wrapper script
+        report_location (str)   : XunitTestReportDirBase, if it is set
+
+    Returns:
+        output_file (str): None if no xunit wrapper runs the test
+
+    Notes:
+        Matches the facts runtest.proj generates: the output goes to
+        <report base>/<Category>/<path under the wrapper directory>, and the
+        report base defaults to Reports next to the wrapper assembly.
+    """
+
+    parts = os.path.relpath(test_path, test_location).replace("\\", "/").split("/")
+    if len(parts) < 3:
+        return None
+
+    if report_location is None:
+        report_location = os.path.join(test_location, parts[0], parts[1], "Reports")
+
+    file_name = os.path.splitext(parts[-1])[0] + ".output.txt"
+
+    return os.path.join(*([report_location, "%s.%s" % (parts[0], parts[1])] + parts[2:-1] + [file_name]))
+
+def read_tail(path, size):
+    """ Return up to the last size bytes of a file, decoded
+    """
+
+    with open(path, "rb") as file_handle:
+        file_handle.seek(0, os.SEEK_END)
+        file_handle.seek(max(0, file_handle.tell() - size))
+        return file_handle.read().decode("utf-8", "replace")
+
+def read_harness_exit_code(output_file):
+    """ Read the exit code the test wrapper library wrote at the end of an output file
+
+    Returns:
+        (exit_code, timed_out): None if the test has not finished
+    """
+
+    try:
+        tail = read_tail(output_file, 512)
+    except (IOError, OSError):
+        return None
+
+    match = harness_exit_code_regex.search(tail)
+    if match is None:
+        return None
+
+    return int(match.group(1)), " Timed Out\n" in tail
+
+################################################################################
+# Classes
+################################################################################
+
+class PartialResultsWriter(object):
+    """ The results of a run so far, in a json file
+    """
+
+    def __init__(self, path, total, interval=default_progress_interval):
+        """ Constructor
+
+        Args:
+            path (str)          : json file to write
+            total (int)         : number of tests in the run
+            interval (float)    : least seconds between two writes, see flush
+        """
+
+        self.path = path
+        self.total = total
+        self.interval = interval
+        self.tests = {}
+        self.failed_count = 0
+        self.last_write = None
+        self.dirty = False
+
+    def add(self, name, outcome, duration, output=None, config=None):
+        """ Record the result of a test
+
+        Args:
+            name (str)      : mangled test name, as in testRun.json
+            outcome (str)   : "pass", "fail" or "timeout"
+            duration (float): seconds
+            output (str)    : output of a failed test, or None
+            config (str)    : -matrix configuration of the test, or None
+        """
+
+        item = { "outcome": "pass" if outcome == "pass" else "fail", "time": duration }
+
+        if config is not None:
+            # Tagged as get_collection_result_key does.
+            name = "%s [%s]" % (name, config)
+            item["config"] = config
+
+        if outcome == "timeout":
+            item["timed_out"] = True
+
+        if output is not None and outcome != "pass":
+            item["output"] = output
+
+        if outcome != "pass":
+            self.failed_count += 1
+
+        self.tests[name] = item
+        self.dirty = True
+
+    def flush(self, force=False):
+        """ Write the file, if anything changed and it was not written recently
+        """
+
+        if not self.dirty:
+            return
+
+        if not force and self.last_write is not None and time.time() - self.last_write < self.interval:
+            return
+
+        contents = {
+            "partial": len(self.tests) < self.total,
+            "updated": datetime.datetime.now().isoformat(),
+            "completed": len(self.tests),
+            "total": self.total,
+            "failed": self.failed_count,
+            "tests": self.tests
+        }
+
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as file_handle:
+            json.dump(contents, file_handle, indent=2, sort_keys=True)
+
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+        os.rename(temp_file, self.path)
+
+        self.last_write = time.time()
+        self.dirty = False
+
+class TestProgressWatcher(object):
+    """ Report the progress of a run of the xunit wrappers from their output files
+
+    Notes:
+        Every interval seconds, the output files of the tests that have not
+        finished are checked, and a line with the number of tests done, the
+        failures so far and the ETA is printed. Only output files written
+        after the watcher started count, so the files of an earlier run are
+        not mistaken for results.
+    """
+
+    def __init__(self, tests, test_location, report_location, estimates, parallel_count, partial_results_location, interval=default_progress_interval):
+        """ Constructor
+
+        Args:
+            tests ([str])                   : paths of the test wrappers the
+                                            : run is expected to run
+            test_location (str)             : root of the built tests
+            report_location (str)           : XunitTestReportDirBase, or None
+            estimates (dict)                : expected seconds of each test, by
+                                            : path relative to test_location
+            parallel_count (int)            : tests run at once
+            partial_results_location (str)  : json file for the partial results
+            interval (float)                : seconds between two reports
+        """
+
+        self.test_location = test_location
+        self.interval = interval
+
+        self.pending = {}
+        for test in tests:
+            output_file = get_xunit_output_file(test_location, test, report_location)
+            if output_file is not None:
+                self.pending[test] = output_file
+
+        self.total = len(self.pending)
+        self.eta_estimator = EtaEstimator(estimates, min(max(1, parallel_count), max(1, self.total)))
+        self.results = PartialResultsWriter(partial_results_location, self.total, interval)
+
+        self.start_time = None
+        self.first_seen = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __poll__(self):
+        """ Account for the tests that finished since the last poll
+
+        Returns:
+            failures ([str]): relative paths of the tests that newly failed
+        """
+
+        failures = []
+
+        for test, output_file in list(self.pending.items()):
+            try:
+                modified_time = os.path.getmtime(output_file)
+            except OSError:
+                continue
+
+            # Allow for file systems that store times with a coarse resolution.
+            if modified_time < self.start_time - 2:
+                continue
+
+            result = read_harness_exit_code(output_file)
+            if result is None:
+                self.first_seen.setdefault(test, time.time())
+                continue
+
+            exit_code, timed_out = result
+            relative_path = os.path.relpath(test, self.test_location)
+
+            # A test that started and finished between two polls is only seen
+            # once; count it as taking as long as expected.
+            estimate = self.eta_estimator.estimates.get(relative_path, 0.0)
+            duration = modified_time - self.first_seen[test] if test in self.first_seen else estimate
+
+            if exit_code == 0:
+                outcome = "pass"
+                output = None
+            else:
+                outcome = "timeout" if timed_out else "fail"
+                output = read_tail(output_file, partial_output_size)
+                failures.append("%s%s" % (relative_path, " (timed out)" if timed_out else ""))
+
+            self.results.add(mangle_test_name(relative_path), outcome, max(0.0, duration), output)
+            self.eta_estimator.completed(relative_path, max(0.0, duration))
+
+            del self.pending[test]
+            self.first_seen.pop(test, None)
+
+        return failures
+
+    def __report__(self):
+        failures = self.__poll__()
+
+        for failure in failures:
+            print("[progress] FAILED %s" % failure)
+
+        completed = self.total - len(self.pending)
+        eta = self.eta_estimator.remaining_time()
+
+        print("[progress] %d/%d tests done, %d failed, %d running, elapsed %s, ETA %s" % (completed,
+                                                                                            self.total,
+                                                                                            self.results.failed_count,
+                                                                                            len(self.first_seen),
+                                                                                            format_duration(time.time() - self.start_time),
+                                                                                            format_duration(eta)))
+        sys.stdout.flush()
+
+        self.results.flush(force=True)
+
+    def __run__(self):
+        while not self.stop_event.wait(self.interval):
+            if len(self.pending) == 0:
+                return
+
+            self.__report__()
+
+    def start(self):
+        """ Start watching, before the tests start running
+        """
+
+        self.start_time = time.time()
+
+        self.thread = threading.Thread(target=self.__run__)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop watching, and write the final partial results
+        """
+
+        self.stop_event.set()
+        self.thread.join()
+
+        self.__poll__()
+        self.results.flush(force=True)
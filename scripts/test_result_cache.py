@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : test_result_cache.py
+#
+# Notes:
+#
+# Remembers which tests passed, and with what inputs, so a later run can skip
+# a test whose inputs did not change. The inputs of a test are:
+#
+#   - the contents of its directory (the wrapper, the test assemblies and
+#     anything else built next to them)
+#   - the contents of Core_Root
+#   - the test environment: the test_env script written by runtest.py's
+#     create_and_use_test_env, the COMPlus_/DOTNET_ variables and the
+#     variables runtest.py sets to select a test mode
+#   - the per test timeout
+#
+# Content hashes come from a FileHashCache, so checking the key of a test
+# whose files did not change costs a stat per file.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import hashlib
+import json
+import os
+
+from managed_assemblies import walk_files
+from test_history import test_mode_variables
+
+################################################################################
+# Globals
+################################################################################
+
+# A helper module for runtest.py, not a test module; keep pytest from
+# collecting it.
+__test__ = False
+
+test_result_cache_file_name = "test_result_cache.json"
+
+test_result_cache_version = 1
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def hash_strings(strings):
+    """ Return the sha256 hex digest of a list of strings
+    """
+
+    sha = hashlib.sha256()
+    for item in strings:
+        sha.update(item.encode("utf-8"))
+        sha.update(b"\0")
+
+    return sha.hexdigest()
+
+def get_test_environment_hash(environ=None):
+    """ Hash the parts of the environment that can change a test's result
+
+    Args:
+        environ (dict): environment to hash, defaults to os.environ
+    """
+
+    if environ is None:
+        environ = os.environ
+
+    parts = []
+
+    for key in sorted(environ):
+        if key.lower().startswith("complus_") or key.lower().startswith("dotnet_") or key in test_mode_variables:
+            if len(environ[key]) > 0:
+                parts.append("%s=%s" % (key, environ[key]))
+
+    # The test_env script has a new temporary name every run; only its
+    # contents matter.
+    test_env = environ.get("__TestEnv")
+    if test_env:
+        with open(test_env) as file_handle:
+            parts.append(file_handle.read())
+
+    return hash_strings(parts)
+
+################################################################################
+# Classes
+################################################################################
+
+class TestResultCache(object):
+    """ Keys of the tests that passed, in <test_location>/test_result_cache.json
+    """
+
+    def __init__(self, test_location, hash_cache, core_root, timeout):
+        """ Constructor
+
+        Args:
+            test_location (str)         : root of the built tests
+            hash_cache (FileHashCache)  : content hashes of the files
+            core_root (str)             : Core_Root path
+            timeout (int)               : per test timeout
+        """
+
+        self.test_location = test_location
+        self.path = os.path.join(test_location, test_result_cache_file_name)
+        self.hash_cache = hash_cache
+        self.directory_hashes = {}
+        self.passes = {}
+
+        try:
+            with open(self.path) as file_handle:
+                contents = json.load(file_handle)
+
+            if contents.get("version") == test_result_cache_version:
+                self.passes = contents["passes"]
+        except (IOError, OSError, ValueError):
+            pass
+
+        # Shared by every test of this run.
+        self.run_key = hash_strings([self.__directory_hash__(core_root),
+                                     get_test_environment_hash(),
+                                     str(timeout)])
+
+    def __directory_hash__(self, directory):
+        """ Hash the names and contents of all of the files under directory
+        """
+
+        directory_hash = self.directory_hashes.get(directory)
+        if directory_hash is not None:
+            return directory_hash
+
+        parts = []
+        for path in walk_files(directory):
+            parts.append(os.path.relpath(path, directory).replace("\\", "/"))
+            parts.append(self.hash_cache.hash(path))
+
+        directory_hash = hash_strings(parts)
+        self.directory_hashes[directory] = directory_hash
+
+        return directory_hash
+
+    def key(self, test_path):
+        """ Return the cache key of a test
+
+        Args:
+            test_path (str): path of the test wrapper
+        """
+
+        return hash_strings([self.__directory_hash__(os.path.dirname(test_path)), self.run_key])
+
+    def __relative_path__(self, test_path):
+        return os.path.relpath(test_path, self.test_location).replace("\\", "/")
+
+    def is_cached_pass(self, test_path):
+        """ Return whether a test passed before, with the same key
+        """
+
+        return self.passes.get(self.__relative_path__(test_path)) == self.key(test_path)
+
+    def record(self, test_path, passed):
+        """ Remember (or forget) a test's result
+
+        Args:
+            test_path (str) : path of the test wrapper
+            passed (bool)   : whether it passed
+        """
+
+        if passed:
+            # The directory may have changed while the test ran (e.g. files it
+            # wrote next to itself), so hash it again.
+            self.directory_hashes.pop(os.path.dirname(test_path), None)
+            self.passes[self.__relative_path__(test_path)] = self.key(test_path)
+        else:
+            self.passes.pop(self.__relative_path__(test_path), None)
+
+    def save(self):
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as file_handle:
+            json.dump({ "version": test_result_cache_version, "passes": self.passes }, file_handle)
+
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+        os.rename(temp_file, self.path)
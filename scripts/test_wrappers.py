@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : test_wrappers.py
+#
+# Notes:
+#
+# Discovery of the generated coreclr test wrappers (the per-test .sh/.cmd
+# scripts written next to each test assembly by the test build). Shared by the
+# scripts that want to run tests without going through runtest.proj.
+#
+################################################################################
+################################################################################
+
+import json
+import os
+import re
+import string
+
+from managed_assemblies import walk_files
+
+################################################################################
+# Globals
+################################################################################
+
+# A helper module for runtest.py, not a test module; keep pytest from
+# collecting it.
+__test__ = False
+
+test_name_index_file_name = "test_name_index.json"
+test_name_index_version = 1
+
+punctuation_regex = re.compile("[%s]" % re.escape(string.punctuation))
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def get_test_wrapper_extension(host_os):
+    """ Return the extension of the test wrappers for an os
+
+    Args:
+        host_os (str): os
+    """
+
+    return ".cmd" if host_os == "Windows_NT" else ".sh"
+
+def find_test_wrappers(test_location, host_os, exclude_locations=None):
+    """ Find all of the generated test wrappers under test_location
+
+    Args:
+        test_location (str)         : root of the built tests
+        host_os (str)               : os, decides between .sh and .cmd
+        exclude_locations ([str])   : directories to ignore (e.g. Core_Root)
+
+    Returns:
+        test_wrappers ([str]): sorted paths of the test wrappers
+
+    Notes:
+        A script is only considered a test wrapper if it has a sibling test
+        assembly with the same base name. This filters out helper scripts that
+        live in the test tree.
+    """
+
+    extension = get_test_wrapper_extension(host_os)
+
+    excluded = []
+    if exclude_locations is not None:
+        excluded = [os.path.normcase(os.path.abspath(item)) + os.path.sep for item in exclude_locations]
+
+    test_wrappers = []
+    for path in walk_files(test_location, [extension]):
+        normalized_path = os.path.normcase(os.path.abspath(path))
+        if any(normalized_path.startswith(item) for item in excluded):
+            continue
+
+        base_name = path[:-len(extension)]
+        if os.path.isfile(base_name + ".dll") or os.path.isfile(base_name + ".exe"):
+            test_wrappers.append(path)
+
+    test_wrappers.sort()
+    return test_wrappers
+
+def shard_items(items, shard_index, shard_count):
+    """ Return the shard_index'th of shard_count round-robin partitions
+
+    Args:
+        items ([object])    : items to partition, in a deterministic order
+        shard_index (int)   : zero based index of the partition to return
+        shard_count (int)   : total number of partitions
+    """
+
+    assert shard_count > 0
+    assert 0 <= shard_index < shard_count
+
+    return [item for index, item in enumerate(items) if index % shard_count == shard_index]
+
+def partition_by_weight(items, weights, shard_count):
+    """ Split items into shard_count partitions of about the same total weight
+
+    Args:
+        items ([object])            : items to partition, in a deterministic order
+        weights ({object: float})   : weight of each item
+        shard_count (int)           : number of partitions
+
+    Returns:
+        partitions ([[object]]): the items of each partition, in their
+                               : original order
+
+    Notes:
+        Greedy longest-processing-time partitioning: the heaviest remaining
+        item goes to the currently lightest partition (the one with fewer
+        items, if the weights are equal). Ties are broken by the position in
+        items and by partition index, so the result only depends on the inputs.
+    """
+
+    assert shard_count > 0
+
+    positions = dict((item, index) for index, item in enumerate(items))
+    loads = [0] * shard_count
+    assignments = [[] for _ in range(shard_count)]
+
+    for item in sorted(items, key=lambda item: (-weights[item], positions[item])):
+        lightest = min(range(shard_count), key=lambda index: (loads[index], len(assignments[index]), index))
+        loads[lightest] += weights[item]
+        assignments[lightest].append(item)
+
+    return [sorted(partition, key=lambda item: positions[item]) for partition in assignments]
+
+def mangle_test_name(relative_path):
+    """ Return the name xunit reports for a test wrapper
+
+    Args:
+        relative_path (str): path of the wrapper relative to the test location
+
+    Notes:
+        The xunit wrappers name each test after its relative path, with all
+        punctuation (including the path separators and the extension's dot)
+        replaced by underscores.
+    """
+
+    return punctuation_regex.sub("_", relative_path)
+
+################################################################################
+# Classes
+################################################################################
+
+class TestNameIndex(object):
+    """ Map from the mangled test names reported by xunit to test wrappers
+
+    Notes:
+        The index is built with a single walk over the test tree and saved
+        as test_name_index.json in the test location, so later runs (e.g.
+        --analyze_results_only) only need to load it. Entries are checked on
+        lookup; the first miss in a run rebuilds the index, to pick up tests
+        added or moved since it was written. Names that more than one wrapper
+        mangle to are stored as null and never resolved by the index.
+    """
+
+    def __init__(self, test_location, host_os):
+        self.test_location = test_location
+        self.host_os = host_os
+        self.index_path = os.path.join(test_location, test_name_index_file_name)
+        self.entries = None
+        self.rebuilt = False
+
+    def __load__(self):
+        """ Load the saved index. Returns False if it is missing or unusable.
+        """
+
+        try:
+            with open(self.index_path) as file_handle:
+                contents = json.load(file_handle)
+        except (IOError, OSError, ValueError):
+            return False
+
+        if not isinstance(contents, dict) or contents.get("version") != test_name_index_version or contents.get("host_os") != self.host_os:
+            return False
+
+        self.entries = contents["entries"]
+        return True
+
+    def rebuild(self):
+        """ Walk the test location and save a fresh index
+        """
+
+        entries = {}
+        for path in walk_files(self.test_location, [get_test_wrapper_extension(self.host_os)]):
+            relative_path = os.path.relpath(path, self.test_location)
+            name = mangle_test_name(relative_path)
+
+            # Ambiguous names are kept as None so they are not mistaken for misses.
+            entries[name] = None if name in entries else relative_path
+
+        self.entries = entries
+        self.rebuilt = True
+
+        contents = {
+            "version": test_name_index_version,
+            "host_os": self.host_os,
+            "entries": entries
+        }
+
+        # The test location may be read only, the index is still usable for this run.
+        try:
+            with open(self.index_path, "w") as file_handle:
+                json.dump(contents, file_handle)
+        except (IOError, OSError):
+            pass
+
+    def lookup(self, test_name):
+        """ Return the path of the test wrapper for test_name
+
+        Args:
+            test_name (str): mangled test name, as reported by xunit
+
+        Returns:
+            test_path (str): path of the wrapper, or None if it is not found
+                           : or ambiguous
+        """
+
+        if self.entries is None and not self.__load__():
+            self.rebuild()
+
+        while True:
+            if test_name in self.entries:
+                relative_path = self.entries[test_name]
+                if relative_path is None:
+                    return None
+
+                test_path = os.path.join(self.test_location, relative_path)
+                if os.path.isfile(test_path):
+                    return test_path
+
+            if self.rebuilt:
+                return None
+
+            self.rebuild()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+#
+## Licensed to the .NET Foundation under one or more agreements.
+## The .NET Foundation licenses this file to you under the MIT license.
+## See the LICENSE file in the project root for more information.
+#
+##
+# Title               : xunit_wrappers.py
+#
+# Notes:
+#
+# Decides which of the xunit wrappers need to be regenerated. runtest.proj
+# generates (and builds) one <Category>.XUnitWrapper.dll per second level
+# directory of the built tests, e.g. JIT/Methodical, with one fact per test
+# script under the directory that is not excluded. The inputs of the wrapper
+# of a directory are:
+#
+#   - the relative paths of the test scripts under the directory
+#   - the ExcludeList items of issues.targets and the TestGrouping items of
+#     testgrouping.proj that can match a path under the directory, with the
+#     condition of their ItemGroup
+#   - what every wrapper depends on: runtest.proj, the sources of
+#     Coreclr.TestWrapper, the os/arch/build type and the altjit arch (which
+#     the conditions of issues.targets use)
+#
+# The hash of the inputs of every directory is kept in
+# <test_location>/xunit_wrapper_state.json, so only the wrappers of the
+# directories whose hash changed (or whose wrapper is missing) are rebuilt.
+#
+# This needs to keep working with python2, as runtest.py still supports it.
+#
+################################################################################
+################################################################################
+
+import json
+import os
+import re
+
+import xml.etree.ElementTree
+
+from managed_assemblies import walk_files, hash_file
+from test_result_cache import hash_strings
+from test_wrappers import get_test_wrapper_extension
+
+################################################################################
+# Globals
+################################################################################
+
+xunit_wrapper_state_file_name = "xunit_wrapper_state.json"
+
+xunit_wrapper_state_version = 1
+
+# Top level directories runtest.proj does not create wrappers for (see
+# DisabledTestDir), and the generated wrapper sources.
+skipped_test_directories = ["Common", "TestWrappers"]
+
+# Properties an item path is rooted at when it points into the built tests.
+test_bin_base_properties = ["$(XunitTestBinBase)", "$(BinDir)"]
+
+# Characters that end the part of an item path that names a fixed directory.
+wildcard_regex = re.compile(r"[*?$%@]")
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def get_wrapper_category(test_location, directory):
+    """ Return the category of a wrapper directory, e.g. JIT.Methodical
+
+    Notes:
+        Matches Category in runtest.proj's CreateXunitFacts.
+    """
+
+    return os.path.relpath(directory, test_location).replace("\\", "/").replace("/", ".")
+
+def get_wrapper_path(test_location, directory):
+    """ Return the path of the xunit wrapper assembly of a directory
+    """
+
+    return os.path.join(directory, "%s.XUnitWrapper.dll" % get_wrapper_category(test_location, directory))
+
+def find_wrapper_directories(test_location, host_os):
+    """ Find the directories runtest.proj creates an xunit wrapper for
+
+    Args:
+        test_location (str) : root of the built tests
+        host_os (str)       : os, decides between .sh and .cmd
+
+    Returns:
+        directories ([str]): sorted second level directories that have a test
+                           : script somewhere under them
+    """
+
+    extension = get_test_wrapper_extension(host_os)
+
+    directories = []
+    for top_level in sorted(os.listdir(test_location)):
+        top_level_path = os.path.join(test_location, top_level)
+        if top_level in skipped_test_directories or not os.path.isdir(top_level_path):
+            continue
+
+        for second_level in sorted(os.listdir(top_level_path)):
+            path = os.path.join(top_level_path, second_level)
+            if not os.path.isdir(path):
+                continue
+
+            if any(True for _ in walk_files(path, [extension])):
+                directories.append(path)
+
+    return directories
+
+def get_item_path_prefixes(include):
+    """ Return the fixed directory prefixes of an item's Include
+
+    Args:
+        include (str): Include attribute of an item, ';' separated
+
+    Returns:
+        prefixes ([str]): lower case paths relative to the built tests, up to
+                        : the first wildcard or property; None if one of the
+                        : paths is not rooted at the built tests (so it can
+                        : match anything)
+    """
+
+    prefixes = []
+    for path in include.split(";"):
+        path = path.strip().replace("\\", "/")
+        if len(path) == 0:
+            continue
+
+        root = next((item for item in test_bin_base_properties if path.startswith(item)), None)
+        if root is None:
+            return None
+
+        path = path[len(root):].lstrip("/")
+        prefixes.append(wildcard_regex.split(path, 1)[0].lower())
+
+    return prefixes
+
+def read_msbuild_items(project_path, item_name):
+    """ Read the items of one type from an msbuild project
+
+    Args:
+        project_path (str)  : msbuild project to read
+        item_name (str)     : item type, e.g. ExcludeList
+
+    Returns:
+        items ([(str, [str])]): a description of every item (its ItemGroup's
+                              : condition, attributes and metadata) and its
+                              : path prefixes, see get_item_path_prefixes
+    """
+
+    if not os.path.isfile(project_path):
+        return []
+
+    def local_name(tag):
+        return tag.split("}", 1)[-1]
+
+    items = []
+    for group in xml.etree.ElementTree.parse(project_path).getroot().iter():
+        if local_name(group.tag) != "ItemGroup":
+            continue
+
+        for item in group:
+            if local_name(item.tag) != item_name:
+                continue
+
+            parts = [group.get("Condition", "")]
+            parts += ["%s=%s" % (key, item.attrib[key]) for key in sorted(item.attrib)]
+            parts += ["%s=%s" % (local_name(child.tag), (child.text or "").strip()) for child in item]
+
+            items.append(("\n".join(parts), get_item_path_prefixes(item.get("Include", ""))))
+
+    return items
+
+def is_item_relevant(prefixes, relative_directory):
+    """ Return whether an item with these path prefixes can match under a directory
+
+    Args:
+        prefixes ([str])            : see get_item_path_prefixes
+        relative_directory (str)    : lower case directory, relative to the
+                                    : built tests, with '/' separators
+    """
+
+    if prefixes is None:
+        return True
+
+    directory = relative_directory + "/"
+    return any(prefix.startswith(directory) or directory.startswith(prefix) for prefix in prefixes)
+
+################################################################################
+# Classes
+################################################################################
+
+class XunitWrapperState(object):
+    """ Hashes of the inputs the xunit wrappers were last built from
+    """
+
+    def __init__(self, test_location, coreclr_repo_location, host_os, arch, build_type, altjit_arch=None):
+        """ Constructor
+
+        Args:
+            test_location (str)         : root of the built tests
+            coreclr_repo_location (str) : path to coreclr repo
+            host_os (str)               : os
+            arch (str)                  : architecture
+            build_type (str)            : configuration
+            altjit_arch (str)           : altjit architecture, if any
+        """
+
+        self.test_location = test_location
+        self.host_os = host_os
+        self.path = os.path.join(test_location, xunit_wrapper_state_file_name)
+        self.exists = False
+        self.hashes = {}
+        self.directory_hashes = {}
+
+        try:
+            with open(self.path) as file_handle:
+                contents = json.load(file_handle)
+
+            if contents.get("version") == xunit_wrapper_state_version:
+                self.hashes = contents["directories"]
+                self.exists = True
+        except (IOError, OSError, ValueError):
+            pass
+
+        tests_dir = os.path.join(coreclr_repo_location, "tests")
+
+        parts = [str(xunit_wrapper_state_version), host_os, arch, build_type, altjit_arch or ""]
+
+        for path in [os.path.join(tests_dir, "runtest.proj")] + list(walk_files(os.path.join(tests_dir, "src", "Common", "Coreclr.TestWrapper"))):
+            if os.path.isfile(path):
+                parts.append(os.path.relpath(path, tests_dir).replace("\\", "/"))
+                parts.append(hash_file(path))
+
+        self.items = read_msbuild_items(os.path.join(tests_dir, "issues.targets"), "ExcludeList")
+        self.items += read_msbuild_items(os.path.join(tests_dir, "testgrouping.proj"), "TestGrouping")
+
+        self.global_hash = hash_strings(parts)
+
+    def __relative_directory__(self, directory):
+        return os.path.relpath(directory, self.test_location).replace("\\", "/")
+
+    def directory_hash(self, directory):
+        """ Hash the inputs of the xunit wrapper of a directory
+        """
+
+        directory_hash = self.directory_hashes.get(directory)
+        if directory_hash is not None:
+            return directory_hash
+
+        relative_directory = self.__relative_directory__(directory)
+
+        parts = [self.global_hash]
+        parts += [os.path.relpath(path, directory).replace("\\", "/") for path in walk_files(directory, [get_test_wrapper_extension(self.host_os)])]
+        parts += [description for description, prefixes in self.items if is_item_relevant(prefixes, relative_directory.lower())]
+
+        directory_hash = hash_strings(parts)
+        self.directory_hashes[directory] = directory_hash
+
+        return directory_hash
+
+    def changed_directories(self, directories):
+        """ Return the directories whose xunit wrapper must be rebuilt
+
+        Args:
+            directories ([str]): see find_wrapper_directories
+        """
+
+        return [directory for directory in directories
+                if not os.path.isfile(get_wrapper_path(self.test_location, directory)) or
+                   self.hashes.get(self.__relative_directory__(directory)) != self.directory_hash(directory)]
+
+    def record(self, directories):
+        """ Remember the inputs of the wrappers of directories as built
+        """
+
+        for directory in directories:
+            self.hashes[self.__relative_directory__(directory)] = self.directory_hash(directory)
+
+    def save(self):
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as file_handle:
+            json.dump({ "version": xunit_wrapper_state_version, "directories": self.hashes }, file_handle)
+
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+        os.rename(temp_file, self.path)
+
+        self.exists = True
@@ -99,7 +99,6 @@ private:
 
     MethodContextBuffer ReadMethodContextNoLock(bool justSkip = false);
     MethodContextBuffer ReadMethodContext(bool acquireLock, bool justSkip = false);
-    MethodContextBuffer GetSpecificMethodContext(unsigned int methodNumber);
 
     MethodContextBuffer GetNextMethodContextFromIndexes();
     MethodContextBuffer GetNextMethodContextFromHash();
@@ -136,6 +135,9 @@ public:
     // Read a method context buffer from the ContextCollection
     // (either a hive [single] or an index)
     MethodContextBuffer GetNextMethodContext();
+    // Read a specific method context buffer. Requires a TOC; returns an error buffer if there is
+    // no TOC or the method is not in it.
+    MethodContextBuffer GetSpecificMethodContext(unsigned int methodNumber);
     // No C++ exceptions, so the constructor has to always succeed...
     bool   isValid();
     double PercentComplete();
@@ -102,6 +102,14 @@ void CommandLine::DumpHelp(const char* program)
     printf("     If 'workerCount' is not specified, the number of workers used is\n");
     printf("     the number of processors on the machine.\n");
     printf("\n");
+    printf(" -streaming filename\n");
+    printf("     Streaming mode. Read method context indices to process, one per line, from\n");
+    printf("     filename, or from standard input if filename is 'stdin'. The JIT stays loaded\n");
+    printf("     between methods. After each method a status line is written to stdout:\n");
+    printf("         [streaming] <index> <success|error|missing|diff|excluded|notfound>\n");
+    printf("     An empty line, 'quit' or end-of-file ends processing. The input .MCH file\n");
+    printf("     must have a .MCT table of contents. Cannot be used with -parallel or -compile.\n");
+    printf("\n");
     printf(" -skipCleanup\n");
     printf("     Skip deletion of temporary files created by child SuperPMI processes with -parallel.\n");
     printf("\n");
@@ -522,6 +530,16 @@ bool CommandLine::Parse(int argc, char* argv[], /* OUT */ Options* o)
                     return false;
                 }
             }
+            else if ((_strnicmp(&argv[i][1], "streaming", argLen) == 0))
+            {
+                if (++i >= argc)
+                {
+                    DumpHelp(argv[0]);
+                    return false;
+                }
+
+                o->streamFile = argv[i];
+            }
             else if (_strnicmp(&argv[i][1], "jitoption", argLen) == 0)
             {
                 i++;
@@ -622,6 +640,12 @@ bool CommandLine::Parse(int argc, char* argv[], /* OUT */ Options* o)
         DumpHelp(argv[0]);
         return false;
     }
+    if (o->streamFile != nullptr && (o->parallel || o->indexCount > 0 || o->hash != nullptr))
+    {
+        LogError("-streaming cannot be used with -parallel, -compile or -matchHash.");
+        DumpHelp(argv[0]);
+        return false;
+    }
     return true;
 }
 
@@ -46,6 +46,7 @@ public:
             , forceJit2Options(nullptr)
             , jitOptions(nullptr)
             , jit2Options(nullptr)
+            , streamFile(nullptr)
         {
         }
 
@@ -75,6 +76,7 @@ public:
         LightWeightMap<DWORD, DWORD>* forceJit2Options;
         LightWeightMap<DWORD, DWORD>* jitOptions;
         LightWeightMap<DWORD, DWORD>* jit2Options;
+        char* streamFile; // If not nullptr, read the method context indices to process from this file ("stdin" for stdin).
     };
 
     static bool Parse(int argc, char* argv[], /* OUT */ Options* o);
@@ -29,6 +29,10 @@ const char* const g_AllFormatStringFixedPrefix  = "Loaded ";
 const char* const g_SummaryFormatString         = "Loaded %d  Jitted %d  FailedCompile %d Excluded %d";
 const char* const g_AsmDiffsSummaryFormatString = "Loaded %d  Jitted %d  FailedCompile %d Excluded %d Diffs %d";
 
+// NOTE: this status string is parsed by scripts/superpmi.py. In -streaming mode it is written to
+// stdout after all of the output for a method has been written.
+const char* const g_StreamingFormatString = "[streaming] %d %s\n";
+
 //#define SuperPMI_ChewMemory 0x7FFFFFFF //Amount of address space to consume on startup
 
 SPMI_TARGET_ARCHITECTURE SpmiTargetArchitecture;
@@ -127,6 +131,39 @@ void InvokeNearDiffer(NearDiffer*           nearDiffer,
     PAL_ENDTRY
 }
 
+// Read the next method context index to process from the -streaming input. Returns false if
+// there are no more methods to process: end-of-file, an empty line, or "quit".
+static bool ReadStreamedMethodIndex(FILE* streamFile, int* index)
+{
+    char line[256];
+    if (fgets(line, sizeof(line), streamFile) == nullptr)
+    {
+        return false;
+    }
+
+    size_t len = strlen(line);
+    while ((len > 0) && isspace((unsigned char)line[len - 1]))
+    {
+        line[--len] = '\0';
+    }
+
+    if ((len == 0) || (_stricmp(line, "quit") == 0))
+    {
+        return false;
+    }
+
+    *index = atoi(line);
+    return true;
+}
+
+// Write the status line for a method processed in -streaming mode, and flush stdout so the
+// client sees it (and all of the JIT output that preceded it) right away.
+static void ReportStreamedMethod(int index, const char* status)
+{
+    printf(g_StreamingFormatString, index, status);
+    fflush(stdout);
+}
+
 // Run superpmi. The return value is as follows:
 // 0    : success
 // -1   : general fatal error (e.g., failed to initialize, failed to read files)
@@ -251,6 +288,37 @@ int __cdecl main(int argc, char* argv[])
     int index             = 0;
     int excludedCount     = 0;
 
+    // In -streaming mode the methods to process are read one at a time from the stream, and
+    // looked up through the TOC, instead of walking the input file. The JIT, once loaded, stays
+    // loaded between methods.
+    FILE* streamFile  = nullptr;
+    int   streamIndex = -1;
+
+    // Counts before the streamed method was processed, used to determine its status.
+    int streamFailToReplayCount = 0;
+    int streamErrorCount        = 0;
+    int streamMissingCount      = 0;
+    int streamExcludedCount     = 0;
+    int streamJittedCount       = 0;
+    int streamMatchCount        = 0;
+
+    if (o.streamFile != nullptr)
+    {
+        if (_stricmp(o.streamFile, "stdin") == 0)
+        {
+            streamFile = stdin;
+        }
+        else
+        {
+            streamFile = fopen(o.streamFile, "r");
+            if (streamFile == nullptr)
+            {
+                LogError("Failed to open streaming input '%s'.", o.streamFile);
+                return (int)SpmiResult::GeneralFailure;
+            }
+        }
+    }
+
     st1.Start();
     NearDiffer nearDiffer(o.targetArchitecture, o.useCoreDisTools);
 
@@ -264,7 +332,66 @@ int __cdecl main(int argc, char* argv[])
 
     while (true)
     {
-        MethodContextBuffer mcb = reader->GetNextMethodContext();
+        MethodContextBuffer mcb;
+
+        if (streamFile != nullptr)
+        {
+            if (streamIndex != -1)
+            {
+                const char* status = "success";
+
+                if (excludedCount != streamExcludedCount)
+                {
+                    status = "excluded";
+                }
+                else if (errorCount != streamErrorCount)
+                {
+                    status = "error";
+                }
+                else if (missingCount != streamMissingCount)
+                {
+                    status = "missing";
+                }
+                else if (failToReplayCount != streamFailToReplayCount)
+                {
+                    status = "error";
+                }
+                else if (o.applyDiff && (jittedCount != streamJittedCount) && (matchCount == streamMatchCount))
+                {
+                    status = "diff";
+                }
+
+                ReportStreamedMethod(streamIndex, status);
+                streamIndex = -1;
+            }
+
+            if (!ReadStreamedMethodIndex(streamFile, &streamIndex))
+            {
+                LogDebug("Done processing streamed method contexts");
+                break;
+            }
+
+            streamFailToReplayCount = failToReplayCount;
+            streamErrorCount        = errorCount;
+            streamMissingCount      = missingCount;
+            streamExcludedCount     = excludedCount;
+            streamJittedCount       = jittedCount;
+            streamMatchCount        = matchCount;
+
+            mcb = reader->GetSpecificMethodContext(streamIndex);
+            if (mcb.Error() || mcb.allDone())
+            {
+                LogError("Method context %d could not be read. Is there a TOC for the input file?", streamIndex);
+                ReportStreamedMethod(streamIndex, "notfound");
+                streamIndex = -1;
+                continue;
+            }
+        }
+        else
+        {
+            mcb = reader->GetNextMethodContext();
+        }
+
         if (mcb.Error())
         {
             return (int)SpmiResult::GeneralFailure;
@@ -295,7 +422,12 @@ int __cdecl main(int argc, char* argv[])
         // Now read the data into a MethodContext. This could throw if the method context data is corrupt.
 
         loadedCount++;
-        if (!MethodContext::Initialize(loadedCount, mcb.buff, mcb.size, &mc))
+
+        // A streamed method is reported (failures, diffs, the MCL files) by its number in the
+        // input file, which is already 1-based like the numbers given to -c, not by the
+        // order it was streamed in.
+        int mcIndex = (streamIndex != -1) ? streamIndex : loadedCount;
+        if (!MethodContext::Initialize(mcIndex, mcb.buff, mcb.size, &mc))
         {
             return (int)SpmiResult::GeneralFailure;
         }
@@ -571,6 +703,11 @@ int __cdecl main(int argc, char* argv[])
     }
     delete reader;
 
+    if ((streamFile != nullptr) && (streamFile != stdin))
+    {
+        fclose(streamFile);
+    }
+
     // NOTE: these output status strings are parsed by parallelsuperpmi.cpp::ProcessChildStdOut().
     if (o.applyDiff)
     {
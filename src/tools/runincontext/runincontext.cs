@@ -30,6 +30,7 @@ public class ArgInput
     public bool BreakAfterRun;
     public bool DelegateLoad;
     public bool BreakOnUnloadFailure;
+    public string BatchFile = null;
 
     public static void DisplayUsage()
     {
@@ -44,11 +45,11 @@ public class ArgInput
         Console.WriteLine("    /breakafterrun            Break into debugger after executing the assembly");
         Console.WriteLine("    /breakonunloadfailure     Break into debugger on unload failure");
         Console.WriteLine("    /delegateload             Delegate the AssemblyLoadContext.Load to a secondary AssemblyLoadContext");
+        Console.WriteLine("    /batch:<file>             Run each test listed in the file in its own AssemblyLoadContext, see BatchRunner");
     }
 
     public ArgInput(String[] args)
     {
-        EntryArgStr = new StringBuilder();
         var assemblyArgs = new List<string>();
 
         for (int i = 0; i < args.Length; i++)
@@ -100,6 +101,10 @@ public class ArgInput
             {
                 ReferencesPath = Path.GetFullPath(args[i].Substring(16));
             }
+            else if (option.StartsWith("/batch:"))
+            {
+                BatchFile = Path.GetFullPath(args[i].Substring(7));
+            }
             else
             {
                 // The remaining arguments are the assembly name and its parameters
@@ -109,19 +114,10 @@ public class ArgInput
                 for (i++; i < args.Length; i++)
                 {
                     assemblyArgs.Add(args[i]);
-                    if (args[i].Contains(" ") || args[i].Contains("\t"))
-                    {
-                        EntryArgStr.Append($"\"{args[i]}\"");
-                    }
-                    else
-                    {
-                        EntryArgStr.Append(args[i]);
-                    }
-                    EntryArgStr.Append(" ");
                 }
             }
         }
-        EntryArgs = assemblyArgs.ToArray();
+        SetEntryArgs(assemblyArgs);
 
         if (StressModeCount < 50)
         {
@@ -134,6 +130,39 @@ public class ArgInput
             MaxRestarts = 5;
         }
     }
+
+    void SetEntryArgs(List<string> assemblyArgs)
+    {
+        EntryArgStr = new StringBuilder();
+
+        foreach (string arg in assemblyArgs)
+        {
+            if (arg.Contains(" ") || arg.Contains("\t"))
+            {
+                EntryArgStr.Append($"\"{arg}\"");
+            }
+            else
+            {
+                EntryArgStr.Append(arg);
+            }
+            EntryArgStr.Append(" ");
+        }
+
+        EntryArgs = assemblyArgs.ToArray();
+    }
+
+    // The same options, for running another assembly
+    public ArgInput ForAssembly(string asmName, List<string> assemblyArgs)
+    {
+        ArgInput input = (ArgInput)MemberwiseClone();
+
+        input.AsmName = asmName;
+        input.AssemblyPath = Path.GetDirectoryName(Path.GetFullPath(asmName));
+        input.BatchFile = null;
+        input.SetEntryArgs(assemblyArgs);
+
+        return input;
+    }
 }
 
 abstract class TestAssemblyLoadContextBase : AssemblyLoadContext
@@ -507,6 +536,95 @@ public class TestRunner
     }
 }
 
+// Runs a batch of tests in one process, each one in its own unloadable
+// AssemblyLoadContext, to save the runtime startup of every test.
+//
+// Each line of the batch file describes a test, as tab separated fields:
+//
+//     <test id> <output file> <assembly> [<assembly arguments> ...]
+//
+// The test's console output goes to the output file. Progress is appended to
+// <batch file>.results, and flushed, as
+//
+//     START <test id>
+//     END <test id> <exit code> <milliseconds>
+//
+// so that when a test takes the whole process down, the test that crashed is
+// the one that started without ending.
+public class BatchRunner
+{
+    ArgInput _input;
+
+    public BatchRunner(ArgInput input)
+    {
+        _input = input;
+    }
+
+    public int Run()
+    {
+        TextWriter stdout = Console.Out;
+        TextWriter stderr = Console.Error;
+        string workingDirectory = Environment.CurrentDirectory;
+
+        using (StreamWriter results = new StreamWriter(_input.BatchFile + ".results", append: true))
+        {
+            results.AutoFlush = true;
+
+            foreach (string line in File.ReadAllLines(_input.BatchFile))
+            {
+                if (line.Length == 0)
+                {
+                    continue;
+                }
+
+                string[] fields = line.Split('\t');
+                string testId = fields[0];
+                ArgInput testInput = _input.ForAssembly(fields[2], new List<string>(fields).GetRange(3, fields.Length - 3));
+
+                results.WriteLine($"START\t{testId}");
+
+                int retVal = RunInContext.FailureExitCode;
+                Stopwatch sw = Stopwatch.StartNew();
+
+                using (StreamWriter output = new StreamWriter(fields[1], append: true))
+                {
+                    output.AutoFlush = true;
+                    Console.SetOut(output);
+                    Console.SetError(output);
+
+                    // As when the test is run on its own
+                    Environment.CurrentDirectory = testInput.AssemblyPath;
+                    Environment.ExitCode = 0;
+
+                    try
+                    {
+                        retVal = new TestRunner(testInput).DoWorkNonStress();
+                    }
+                    catch (UnloadFailedException)
+                    {
+                        Console.WriteLine($"FAILURE: Unload failed");
+                    }
+                    catch (Exception ex)
+                    {
+                        Console.WriteLine($"FAILURE: Exception: {ex.ToString()}");
+                    }
+                    finally
+                    {
+                        Console.SetOut(stdout);
+                        Console.SetError(stderr);
+                        Environment.CurrentDirectory = workingDirectory;
+                    }
+                }
+
+                sw.Stop();
+                results.WriteLine($"END\t{testId}\t{retVal}\t{sw.ElapsedMilliseconds}");
+            }
+        }
+
+        return RunInContext.SuccessExitCode;
+    }
+}
+
 public class RunInContext
 {
     public static int FailureExitCode = 213;
@@ -525,6 +643,11 @@ public class RunInContext
 
         AppDomain.CurrentDomain.UnhandledException += OnUnhandledException;
 
+        if (input.BatchFile != null)
+        {
+            return new BatchRunner(input).Run();
+        }
+
         int retVal = FailureExitCode;
         try
         {
@@ -41,9 +41,13 @@
 
 import argparse
 import datetime
+import filecmp
 import fnmatch
+import gzip
 import json
 import math
+import multiprocessing
+import multiprocessing.pool
 import os
 import platform
 import shutil
@@ -56,18 +60,26 @@ import string
 import zipfile
 
 import xml.etree.ElementTree
+import xml.sax.saxutils
 
 from collections import defaultdict
 from sys import platform as _platform
 
-# Version specific imports
-if sys.version_info.major < 3:
-    import urllib
-else:
-    import urllib.request
-
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
 from coreclr_arguments import *
+from managed_assemblies import find_managed_assemblies, hash_file
+from file_hash_cache import FileHashCache
+from test_result_cache import TestResultCache
+from artifact_cache import ArtifactCache, get_default_artifact_cache_location
+from test_wrappers import TestNameIndex, find_test_wrappers, mangle_test_name, partition_by_weight
+from xunit_wrappers import XunitWrapperState, find_wrapper_directories, get_wrapper_path
+from test_executor import TestExecutor, TestExecutionResult, XunitResultsWriter, ResourceUsage, read_included_test_names
+from test_batch_host import BatchTestExecutor, default_batch_size
+from cpu_partitioning import CpuAllocator, find_heavy_tests, get_available_cpus, is_cpu_partitioning_supported, default_heavy_cpu_count
+from test_matrix import MatrixTestExecutor, parse_test_configuration, is_valid_test_configuration
+from test_history import TestHistory, EtaEstimator, format_duration, get_test_config, normalize_test_name, find_duration_changes
+from test_history import duration_change_threshold, duration_change_min_ratio, duration_change_min_seconds, duration_change_min_samples
+from test_progress import TestProgressWatcher, PartialResultsWriter, default_progress_interval, partial_output_size, read_tail
 
 ################################################################################
 # Argument Parser
@@ -124,13 +136,37 @@ parser.add_argument("--run_crossgen_tests", dest="run_crossgen_tests", action="s
 parser.add_argument("--large_version_bubble", dest="large_version_bubble", action="store_true", default=False)
 parser.add_argument("--precompile_core_root", dest="precompile_core_root", action="store_true", default=False)
 parser.add_argument("--sequential", dest="sequential", action="store_true", default=False)
+parser.add_argument("--build_xunit_test_wrappers", dest="build_xunit_test_wrappers", action="store_true", default=False, help="Rebuild all of the xunit wrappers, rather than only those whose inputs changed.")
 
 parser.add_argument("--generate_layout", dest="generate_layout", action="store_true", default=False)
 parser.add_argument("--generate_layout_only", dest="generate_layout_only", action="store_true", default=False)
 parser.add_argument("--analyze_results_only", dest="analyze_results_only", action="store_true", default=False)
 parser.add_argument("--verbose", dest="verbose", action="store_true", default=False)
 parser.add_argument("--limited_core_dumps", dest="limited_core_dumps", action="store_true", default=False)
+parser.add_argument("--lazy_repros", dest="lazy_repros", action="store_true", default=False, help="Do not create repros for the failed tests; create them later with --analyze_results_only -repro_filter.")
+parser.add_argument("-repro_filter", dest="repro_filter", nargs="+", default=None, help="Only create repros for the failed tests whose name or relative path matches one of these patterns (e.g. \"JIT/Regression/*\"). Existing repros are kept.")
+parser.add_argument("-coredump_budget", dest="coredump_budget", type=int, default=None, help="With --limited_core_dumps, the size in MB of the compressed coredumps to keep, one per distinct crash. Defaults to 2048.")
+parser.add_argument("-progress_interval", dest="progress_interval", type=int, default=None, help="Seconds between two progress reports while the tests run, and between two writes of the results so far to bin/Logs/testRun.partial.json (which -merge_results accepts, should the run not finish). 0 turns the progress reports off. Defaults to 30.")
 parser.add_argument("--run_in_context", dest="run_in_context", action="store_true", default=False)
+parser.add_argument("--batch_in_process", dest="batch_in_process", action="store_true", default=False, help="With --python_runner, run batches of tests in one corerun process each, every test in its own unloadable AssemblyLoadContext (implies --run_in_context). Tests that cannot be batched, or that crash their batch, run on their own.")
+parser.add_argument("-batch_size", dest="batch_size", type=int, default=default_batch_size, help="Maximum number of tests run by each --batch_in_process host.")
+parser.add_argument("--cpu_partitioning", dest="cpu_partitioning", action="store_true", default=False, help="With --python_runner on Linux, pin each test to its own set of cpus, so concurrent tests do not share cores. Heavy tests (GC and threading tests, and tests that run long or keep several cores busy) get -heavy_test_cpus cpus to themselves. The GC of each test is limited to its cpus with COMPlus_GCHeapAffinitizeMask and COMPlus_GCHeapCount.")
+parser.add_argument("--numa_local", dest="numa_local", action="store_true", default=False, help="With --cpu_partitioning, do not let the cpus of a test span NUMA nodes.")
+parser.add_argument("-heavy_test_cpus", dest="heavy_test_cpus", type=int, default=None, help="With --cpu_partitioning, the number of cpus a heavy test gets. Defaults to 4.")
+parser.add_argument("-matrix", dest="matrix", nargs="+", default=None, help="With --python_runner, run the tests under each of these configurations in one run, e.g. -matrix JitStress=2 GCStress=0xC,timeout=7200,parallel=2 TieredCompilation=0 RunCrossGen=true. A configuration is comma separated COMPlus_ settings (the prefix is optional); timeout (seconds) and parallel (most tests at once) set its limits. See scripts/test_matrix.py.")
+parser.add_argument("--python_runner", dest="python_runner", action="store_true", default=False, help="Run the test wrappers directly from python instead of through runtest.proj and the xunit console runner.")
+parser.add_argument("--cache_results", dest="cache_results", action="store_true", default=False, help="With --python_runner, report the tests that passed before with the same test files, Core_Root, environment and timeout as cached passes instead of running them again.")
+parser.add_argument("--adaptive_timeouts", dest="adaptive_timeouts", action="store_true", default=False, help="With --python_runner, give each test with a history of passes a timeout of 5 times its 99th percentile duration (at least 3 minutes, at most the usual timeout).")
+parser.add_argument("--failed_first", dest="failed_first", action="store_true", default=False, help="With --python_runner, start with the tests that failed the last time they were run.")
+parser.add_argument("--rerun_failed_only", dest="rerun_failed_only", action="store_true", default=False, help="With --python_runner, only run the tests that failed the last time they were run.")
+parser.add_argument("-retry_failures", dest="retry_failures", type=int, default=0, help="With --python_runner, rerun each failed test up to this many times, one at a time, to tell flaky tests from deterministic failures.")
+parser.add_argument("-parallel_count", dest="parallel_count", type=int, default=None, help="Number of tests to run at once with --python_runner. Defaults to the number of cpus (1 with --sequential).")
+parser.add_argument("-shard_index", dest="shard_index", type=int, default=0, help="With --python_runner, only run the shard_index'th (zero based) of shard_count shards of the tests.")
+parser.add_argument("-shard_count", dest="shard_count", type=int, default=1, help="Number of shards the tests are split into. Every machine must see the same tests and -shard_durations.")
+parser.add_argument("-shard_durations", dest="shard_durations", default=None, help="testRun.json (as written by -merge_results) used to balance the shards by duration. Without it, the shards are balanced by the size of the test assemblies.")
+parser.add_argument("-merge_results", dest="merge_results", nargs="+", default=None, help="Merge the testRun.xml or testRun.json files of several shards into bin/Logs/testRun.xml and testRun.json, then analyze them.")
+parser.add_argument("-artifact_cache", dest="artifact_cache", default=None, help="Where downloaded artifacts (xunit.console.dll) are cached. Defaults to $CORECLR_ARTIFACT_CACHE, or ~/.cache/coreclr/artifacts. Seed it to run offline.")
+parser.add_argument("-xunit_console_sha256", dest="xunit_console_sha256", default=None, help="Expected sha256 of the xunit.console.dll zip; a cached or downloaded zip that does not match it is rejected.")
 
 # Only used on Unix
 parser.add_argument("-test_native_bin_location", dest="test_native_bin_location", nargs='?', default=None)
@@ -144,6 +180,50 @@ gc_stress = False
 coredump_pattern = ""
 file_name_cache = defaultdict(lambda: None)
 
+# Files (relative to the repo) that decide which packages are restored into Core_Root,
+# in addition to the RestoreProjects listed in tests/build.proj.
+core_root_package_inputs = [
+    "dependencies.props",
+    os.path.join("tests", "build.proj"),
+    os.path.join("tests", "runtest.proj"),
+    os.path.join("tests", "dir.props"),
+    os.path.join("tests", "src", "dir.props"),
+    os.path.join("tests", "publishdependency.targets"),
+    os.path.join("tests", "src", "Common", "external", "external.depproj")
+]
+
+# Number of tests listed by print_summary as using the most memory and cpu.
+heaviest_test_count = 10
+
+# Preserved (compressed) coredumps are kept under this size, see triage_coredump_files.
+default_coredump_budget_mb = 2048
+
+# Coredumps with the same top coredump_signature_frame_count frames are the same crash.
+coredump_signature_frame_count = 5
+
+# Frames unwound by the debugger; a few more than the signature, as some are skipped.
+coredump_signature_debugger_frame_count = 16
+
+# "#3  0x00007f... in Foo::Bar (this=...) at foo.cpp:12" or "#4  0x00007f... in ?? () from /lib/libc.so.6"
+coredump_gdb_frame_regex = re.compile(r"^#\d+\s+(?:0x[0-9a-fA-F]+ in )?(?P<function>.+?) \(.*?\)(?: from (?P<module>\S+))?")
+
+# "frame #3: 0x00007fff... libcoreclr.dylib`Foo::Bar(int) + 12"
+coredump_lldb_frame_regex = re.compile(r"^\*?\s*frame #\d+: 0x[0-9a-fA-F]+ (?P<module>[^`\s]+)`(?P<function>[^(+]+?)(?:\(.*)?(?: \+ \d+)?$")
+
+# Frames of the signal handling and abort paths, which every crash shares.
+coredump_ignored_frame_regex = re.compile(r"^(__GI_)?(raise|abort|__pthread_kill.*|pthread_kill|__restore_rt|_sigtramp|__kill|"
+                                          r"PROCAbort|PROCEndProcess|PROCCreateCrashDump.*|"
+                                          r"invoke_previous_action|.*_signal_handler|sigsegv_handler|sigill_handler|sigfpe_handler|sigabrt_handler|sigtrap_handler)$")
+
+# Number of slower and faster tests listed by report_duration_changes.
+duration_change_report_count = 20
+
+# Our build of xunit.console.dll, see run_tests.
+xunit_console_url = r"https://clrjit.blob.core.windows.net/xunit-console/xunit.console.dll-v2.4.1.zip"
+
+# FICLONE from linux/fs.h, to reflink a file on filesystems that support it.
+ficlone_ioctl = 0x40049409
+
 ################################################################################
 # Classes
 ################################################################################
@@ -167,6 +247,57 @@ class TempFile:
         except:
             print("Error failed to delete: {}.".format(self.file_name))
 
+class TestResult(object):
+    """ Result of a single test, as reported in testRun.xml
+
+    Notes:
+        A run can have tens of thousands of tests, so the fields are slots.
+        The output of failing tests can be very large (e.g. under GCStress);
+        it is kept in a file on disk and only read back when test_output is
+        asked for. Items can also be read as test["name"], for the code that
+        treats results as dictionaries. usage is the ResourceUsage recorded
+        by the python runner, or None. config is the -matrix configuration
+        the test ran under, or None. cached is set for the tests --cache_results
+        reported as passing without running them.
+    """
+
+    __slots__ = ["name", "test_path", "failed", "skipped", "passed", "time", "output_file", "output_offset", "output_length", "usage", "config", "cached"]
+
+    def __init__(self, name, test_path, failed, skipped, passed, duration, output_file=None, output_offset=0, output_length=0, usage=None, config=None, cached=False):
+        self.name = name
+        self.test_path = test_path
+        self.failed = failed
+        self.skipped = skipped
+        self.passed = passed
+        self.time = duration
+        self.output_file = output_file
+        self.output_offset = output_offset
+        self.output_length = output_length
+        self.usage = usage
+        self.config = config
+        self.cached = cached
+
+    @property
+    def test_output(self):
+        if self.output_file is None:
+            return None
+
+        with open(self.output_file, "rb") as file_handle:
+            file_handle.seek(self.output_offset)
+            test_output = file_handle.read(self.output_length)
+
+        # python2 callers expect utf-8 encoded bytes.
+        if sys.version_info.major < 3:
+            return test_output
+
+        return test_output.decode("utf-8", "replace")
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            return None
+
 class DebugEnv:
     def __init__(self, 
                  host_os, 
@@ -193,6 +324,9 @@ class DebugEnv:
                                             arch,
                                             build_type)
 
+        if test["config"] is not None:
+            self.unique_name += "_" + parse_test_configuration(test["config"], 0).report_name()
+
         self.host_os = host_os
         self.arch = arch
         self.build_type = build_type
@@ -218,48 +352,23 @@ class DebugEnv:
 
         self.path = os.path.join(repro_location, self.path)
         
+        self.exe_location = None
+
         exe_location = os.path.splitext(self.test_location)[0] + ".exe"
         if os.path.isfile(exe_location):
             self.exe_location = exe_location
-            self.__add_configuration_to_launch_json__()
 
-    def __add_configuration_to_launch_json__(self):
-        """ Add to or create a launch.json with debug information for the test
+    def get_launch_configuration(self):
+        """ Return the launch.json configuration to debug the test, or None
 
         Notes:
-            This will allow debugging using the cpp extension in vscode.
+            This will allow debugging using the cpp extension in vscode. The
+            configurations of all the repros are written at once by
+            write_launch_json.
         """
 
-        repro_location = self.repro_location
-        assert os.path.isdir(repro_location)
-
-        vscode_dir = os.path.join(repro_location, ".vscode")
-        if not os.path.isdir(vscode_dir):
-            os.mkdir(vscode_dir)
-
-        assert os.path.isdir(vscode_dir)
-
-        launch_json_location = os.path.join(vscode_dir, "launch.json")
-        if not os.path.isfile(launch_json_location):
-            initial_json = {
-                "version": "0.2.0",
-                "configurations": []
-            }
-
-            json_str = json.dumps(initial_json, 
-                                  indent=4, 
-                                  separators=(',', ': '))
-
-            with open(launch_json_location, 'w') as file_handle:
-                file_handle.write(json_str)
-
-        launch_json = None
-        with open(launch_json_location) as file_handle:
-            launch_json = file_handle.read()
-        
-        launch_json = json.loads(launch_json)
-
-        configurations = launch_json["configurations"]
+        if self.exe_location is None:
+            return None
 
         dbg_type = "cppvsdbg" if self.host_os == "Windows_NT" else ""
         core_run = os.path.join(self.core_root, "corerun")
@@ -270,24 +379,19 @@ class DebugEnv:
         }
 
         if self.env is not None:
-            # Convert self.env to a defaultdict
-            self.env = defaultdict(lambda: None, self.env)
-            for key, value in env.items():
-                self.env[key] = value
-            
+            debug_env = dict(self.env)
+            debug_env.update(env)
         else:
-            self.env = env
+            debug_env = env
 
         environment = []
-        for key, value in self.env.items():
-            env = {
+        for key, value in debug_env.items():
+            environment.append({
                 "name": key,
                 "value": value
-            }
-
-            environment.append(env)
+            })
 
-        configuration = defaultdict(lambda: None, {
+        configuration = {
             "name": self.unique_name,
             "type": dbg_type,
             "request": "launch",
@@ -297,27 +401,13 @@ class DebugEnv:
             "cwd": os.path.join("${workspaceFolder}", "..", ".."),
             "environment": environment,
             "externalConsole": True
-        })
+        }
 
         if self.build_type.lower() != "release":
             symbol_path = os.path.join(self.core_root, "PDB")
             configuration["symbolSearchPath"] = symbol_path
 
-        # Update configuration if it already exists.
-        config_exists = False
-        for index, config in enumerate(configurations):
-            if config["name"] == self.unique_name:
-                configurations[index] = configuration
-                config_exists = True
-
-        if not config_exists:
-            configurations.append(configuration)
-        json_str = json.dumps(launch_json,
-                              indent=4, 
-                              separators=(',', ': '))
-
-        with open(launch_json_location, 'w') as file_handle:
-            file_handle.write(json_str)
+        return configuration
 
     def __create_repro_wrapper__(self):
         """ Create the repro wrapper
@@ -596,6 +686,52 @@ def get_environment(test_env=None):
 
     return complus_vars
 
+def create_test_progress_watcher(host_os, arch, build_type, coreclr_repo_location, test_location, parallel_count, progress_interval):
+    """ Create a TestProgressWatcher for a run of the xunit wrappers
+
+    Args:
+        host_os(str)                : os
+        arch(str)                   : architecture
+        build_type(str)             : configuration
+        coreclr_repo_location(str)  : path to coreclr repo
+        test_location(str)          : location of the tests
+        parallel_count(int)         : tests xunit runs at once
+        progress_interval(int)      : seconds between two progress reports
+
+    Returns:
+        watcher(TestProgressWatcher): None if the tests the wrappers will run
+                                    : cannot be known
+
+    Notes:
+        The tests to expect are those of the generated wrapper sources, as
+        for run_tests_in_python, and the ETA is based on the test history.
+    """
+
+    included_tests = read_included_test_names(test_location)
+    if included_tests is None:
+        print("Warning: no xunit wrapper sources under %s, not reporting the progress of the run." % os.path.join(test_location, "TestWrappers"))
+        return None
+
+    core_root = os.environ.get("CORE_ROOT")
+    tests = find_test_wrappers(test_location, host_os, exclude_locations=[core_root] if core_root else None)
+    tests = [test for test in tests if os.path.normcase(os.path.relpath(test, test_location)) in included_tests]
+
+    logs_dir = os.path.join(coreclr_repo_location, "bin", "Logs")
+
+    history = TestHistory(logs_dir, host_os, arch, build_type, get_test_config(get_environment(os.environ.get("__TestEnv"))))
+    try:
+        estimates, _ = history.expected_durations([os.path.relpath(test, test_location) for test in tests])
+    finally:
+        history.close()
+
+    report_location = os.environ.get("XunitTestReportDirBase")
+    if report_location is not None and len(report_location) == 0:
+        report_location = None
+
+    print("Reporting the progress of the %d tests every %d seconds, results so far in %s." % (len(tests), progress_interval, os.path.join(logs_dir, "testRun.partial.json")))
+
+    return TestProgressWatcher(tests, test_location, report_location, estimates, parallel_count, os.path.join(logs_dir, "testRun.partial.json"), progress_interval)
+
 def call_msbuild(coreclr_repo_location,
                  dotnetcli_location,
                  test_location,
@@ -604,13 +740,17 @@ def call_msbuild(coreclr_repo_location,
                  build_type, 
                  is_illink=False,
                  sequential=False,
-                 limited_core_dumps=False):
+                 limited_core_dumps=False,
+                 coredump_budget=default_coredump_budget_mb,
+                 progress_interval=default_progress_interval):
     """ Call msbuild to run the tests built.
 
     Args:
         coreclr_repo_location(str)  : path to coreclr repo
         dotnetcli_location(str)     : path to the dotnet cli in the tools dir
         sequential(bool)            : run sequentially if True
+        coredump_budget(int)        : MB of compressed coredumps to keep with limited_core_dumps
+        progress_interval(int)      : seconds between two progress reports, 0 for none
 
         host_os(str)                : os
         arch(str)                   : architecture
@@ -675,17 +815,27 @@ def call_msbuild(coreclr_repo_location,
 
     print(" ".join(command))
 
+    watcher = None
+    if progress_interval > 0:
+        watcher = create_test_progress_watcher(host_os, arch, build_type, coreclr_repo_location, test_location, 1 if sequential else multiprocessing.cpu_count(), progress_interval)
+
     sys.stdout.flush() # flush output before creating sub-process
     proc = subprocess.Popen(command)
 
+    if watcher is not None:
+        watcher.start()
+
     try:
         proc.communicate()
     except:
         proc.kill()
         sys.exit(1)
+    finally:
+        if watcher is not None:
+            watcher.stop()
 
     if limited_core_dumps:
-        inspect_and_delete_coredump_files(host_os, arch, test_location)
+        inspect_and_delete_coredump_files(host_os, arch, test_location, coredump_budget)
 
     return proc.returncode
 
@@ -808,17 +958,129 @@ def print_info_from_coredump_file(host_os, arch, coredump_name, executable_name)
     if proc_failed:
         print("Failed to print coredump: %s" % coredump_name)
 
-def preserve_coredump_file(coredump_name, root_storage_location="/tmp/coredumps_coreclr"):
-    """ Copies the specified coredump to a new randomly named temporary directory under
-        root_storage_location to ensure it is accessible after the workspace is cleaned.
+def find_executable(name):
+    """ Return the full path of an executable on the PATH, or None
+    """
+
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+    return None
+
+def get_coredump_stack_signature(host_os, coredump_name, executable_name):
+    """ Return a normalized signature of the top of the crashing stack
+
+    Args:
+        host_os (String)         : os
+        coredump_name (String)   : name of the coredump
+        executable_name (String) : name of the executable that generated the coredump
+
+    Returns:
+        signature (String): the top coredump_signature_frame_count function
+                          : names of the crashing thread, joined by " | ", or
+                          : None if the debugger could not read the dump
+
+    Notes:
+        Only the crashing thread is unwound and no locals are printed, so this
+        is much cheaper than print_info_from_coredump_file. Addresses, offsets
+        and arguments are dropped, as are the frames of the signal handling
+        and abort machinery, so that dumps of the same crash in different
+        tests and processes get the same signature.
+    """
+
+    if host_os == "OSX":
+        command = ["lldb", "-c", coredump_name, "-b", "-o", "bt %d" % coredump_signature_debugger_frame_count]
+        frame_regex = coredump_lldb_frame_regex
+    elif host_os == "Linux":
+        command = ["gdb", "--batch", "-ex", "bt %d" % coredump_signature_debugger_frame_count, executable_name, coredump_name]
+        frame_regex = coredump_gdb_frame_regex
+    else:
+        return None
+
+    try:
+        with open(os.devnull, "w") as devnull:
+            output = subprocess.check_output(command, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", "replace")
+
+    frames = []
+    for line in output.splitlines():
+        match = frame_regex.match(line.strip())
+        if match is None:
+            continue
+
+        function = match.group("function")
+        if function == "??" and match.group("module"):
+            function = "??@%s" % os.path.basename(match.group("module"))
+
+        if coredump_ignored_frame_regex.match(function):
+            continue
+
+        frames.append(function)
+        if len(frames) == coredump_signature_frame_count:
+            break
+
+    if len(frames) == 0:
+        return None
+
+    return " | ".join(frames)
+
+def compress_coredump_file(coredump_name, storage_location):
+    """ Write a compressed copy of a coredump into storage_location
+
+    Args:
+        coredump_name (String)    : coredump to compress
+        storage_location (String) : directory to write it to
+
+    Returns:
+        compressed_name (String): path of the compressed copy
+
+    Notes:
+        Uses zstd when it is installed, gzip otherwise.
+    """
+
+    zstd = find_executable("zstd")
+
+    if zstd is not None:
+        compressed_name = os.path.join(storage_location, os.path.basename(coredump_name) + ".zst")
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call([zstd, "-q", "-T0", "-3", "-o", compressed_name, coredump_name], stdout=devnull)
+    else:
+        compressed_name = os.path.join(storage_location, os.path.basename(coredump_name) + ".gz")
+        with open(coredump_name, "rb") as src_handle:
+            dest_handle = gzip.open(compressed_name, "wb", 6)
+            try:
+                shutil.copyfileobj(src_handle, dest_handle)
+            finally:
+                dest_handle.close()
+
+    return compressed_name
+
+def preserve_coredump_file(coredump_name, root_storage_location="/tmp/coredumps_coreclr", signature=None, duplicates=None, max_size=None):
+    """ Copies the specified coredump, compressed, to a new randomly named temporary
+        directory under root_storage_location to ensure it is accessible after the
+        workspace is cleaned.
 
     Args:
         coredump_name (String)         : name of the coredump to print
         root_storage_location (String) : the directory under which to copy coredump_name
+        signature (String)             : stack signature of the dump, if known
+        duplicates ([String])          : other coredumps with the same signature
+        max_size (int)                 : do not keep the dump if it is larger than
+                                       : this once compressed
+
+    Returns:
+        size (int): bytes written, 0 if nothing was preserved
 
     Notes:
         root_storage_location defaults to a folder under /tmp to ensure that it is cleaned
         up on next reboot (or after the OS configured time elapses for the folder).
+        The signature and the duplicates are written to signature.txt next to the dump.
     """
     if not os.path.exists(root_storage_location):
         os.mkdir(root_storage_location)
@@ -829,10 +1091,26 @@ def preserve_coredump_file(coredump_name, root_storage_location="/tmp/coredumps_
 
     # Only preserve the dump if the directory is empty. Otherwise, do nothing.
     # This is a way to prevent us from storing/uploading too many dumps.
-    if os.path.isfile(coredump_name) and not os.listdir(storage_location):
-        print("Copying coredump file %s to %s" % (coredump_name, storage_location))
-        shutil.copy2(coredump_name, storage_location)
-        # TODO: Support uploading to dumpling
+    if not os.path.isfile(coredump_name) or os.listdir(storage_location):
+        return 0
+
+    print("Compressing coredump file %s to %s" % (coredump_name, storage_location))
+    compressed_name = compress_coredump_file(coredump_name, storage_location)
+    size = os.path.getsize(compressed_name)
+
+    if max_size is not None and size > max_size:
+        print("Not preserving %s, it is %d MB compressed, over the remaining storage budget." % (coredump_name, size // (1024 * 1024)))
+        shutil.rmtree(storage_location)
+        return 0
+
+    if signature is not None:
+        signature_file = os.path.join(storage_location, "signature.txt")
+        with open(signature_file, "w") as file_handle:
+            file_handle.write("%s\n\n%s\n" % (signature, "\n".join([coredump_name] + (duplicates or []))))
+        size += os.path.getsize(signature_file)
+
+    # TODO: Support uploading to dumpling
+    return size
 
 def inspect_and_delete_coredump_file(host_os, arch, coredump_name):
     """ Prints information from the specified coredump and creates a backup of it
@@ -846,14 +1124,72 @@ def inspect_and_delete_coredump_file(host_os, arch, coredump_name):
     preserve_coredump_file(coredump_name)
     os.remove(coredump_name)
 
-def inspect_and_delete_coredump_files(host_os, arch, test_location):
+def triage_coredump_files(host_os, arch, coredump_names, storage_budget_mb=default_coredump_budget_mb):
+    """ Group coredumps by crash, then inspect and preserve one dump of each group
+
+    Args:
+        host_os (String)          : os
+        arch (String)             : architecture
+        coredump_names ([String]) : coredumps to triage; all of them are deleted
+        storage_budget_mb (int)   : maximum size of the preserved (compressed) dumps
+
+    Notes:
+        A crashing change can leave hundreds of dumps of the same crash. The
+        stack signature of every dump is read in parallel, and only the first
+        dump of each signature gets the full (slow) inspection and is kept.
+        Groups are preserved largest first until the budget is used up.
+    """
+    executable_name = "%s/corerun" % os.environ["CORE_ROOT"]
+
+    worker_count = max(1, min(multiprocessing.cpu_count(), len(coredump_names)))
+    print("Reading the stack signatures of %d coredumps, %d at a time." % (len(coredump_names), worker_count))
+
+    pool = multiprocessing.pool.ThreadPool(worker_count)
+    try:
+        signatures = pool.map(lambda coredump_name: get_coredump_stack_signature(host_os, coredump_name, executable_name), coredump_names)
+    finally:
+        pool.close()
+        pool.join()
+
+    groups = defaultdict(list)
+    for coredump_name, signature in zip(coredump_names, signatures):
+        # A dump the debugger could not read is its own group.
+        groups[signature if signature is not None else "<unreadable: %s>" % coredump_name].append(coredump_name)
+
+    ordered_groups = sorted(groups.items(), key=lambda item: (-len(item[1]), item[0]))
+
+    print("")
+    print("%d coredumps, %d distinct crashes:" % (len(coredump_names), len(ordered_groups)))
+    for signature, group in ordered_groups:
+        print("  %4d x %s" % (len(group), signature))
+    print("")
+
+    remaining_budget = storage_budget_mb * 1024 * 1024
+
+    for signature, group in ordered_groups:
+        representative = group[0]
+
+        print("Crash: %s" % signature)
+        print("Seen in %d coredumps, inspecting %s" % (len(group), representative))
+        print_info_from_coredump_file(host_os, arch, representative, executable_name)
+
+        if remaining_budget > 0:
+            remaining_budget -= preserve_coredump_file(representative, signature=signature, duplicates=group[1:], max_size=remaining_budget)
+        else:
+            print("Not preserving %s, the coredump storage budget of %d MB is used up." % (representative, storage_budget_mb))
+
+        for coredump_name in group:
+            os.remove(coredump_name)
+
+def inspect_and_delete_coredump_files(host_os, arch, test_location, storage_budget_mb=default_coredump_budget_mb):
     """ Finds all coredumps under test_location, prints some basic information about them
         to the console, and creates a backup of the dumps for further investigation
 
     Args:
-        host_os (String)         : os
-        arch (String)            : architecture
-        test_location (String)   : the folder under which to search for coredumps
+        host_os (String)          : os
+        arch (String)             : architecture
+        test_location (String)    : the folder under which to search for coredumps
+        storage_budget_mb (int)   : maximum size of the preserved (compressed) dumps
     """
     # This function prints some basic information from core files in the current
     # directory and deletes them immediately. Based on the state of the system, it may
@@ -878,7 +1214,7 @@ def inspect_and_delete_coredump_files(host_os, arch, test_location):
 
     filter_pattern = ""
     regex_pattern = ""
-    matched_file_count = 0
+    coredump_names = []
 
     if coredump_name_uses_pid:
         filter_pattern = "core.*"
@@ -891,10 +1227,12 @@ def inspect_and_delete_coredump_files(host_os, arch, test_location):
         for file_name in fnmatch.filter(file_names, filter_pattern):
             if re.match(regex_pattern, file_name):
                 print("Found coredump: %s in %s" % (file_name, dir_path))
-                matched_file_count += 1
-                inspect_and_delete_coredump_file(host_os, arch, os.path.join(dir_path, file_name))
+                coredump_names.append(os.path.join(dir_path, file_name))
+
+    print("Found %s coredumps." % len(coredump_names))
 
-    print("Found %s coredumps." % matched_file_count)
+    if len(coredump_names) > 0:
+        triage_coredump_files(host_os, arch, coredump_names, storage_budget_mb)
 
 def run_tests(host_os,
               arch,
@@ -913,7 +1251,27 @@ def run_tests(host_os,
               large_version_bubble=False,
               run_sequential=False,
               limited_core_dumps=False,
-              run_in_context=False):
+              run_in_context=False,
+              python_runner=False,
+              cache_results=False,
+              adaptive_timeouts=False,
+              failed_first=False,
+              rerun_failed_only=False,
+              retry_failures=0,
+              batch_in_process=False,
+              batch_size=default_batch_size,
+              matrix=None,
+              cpu_partitioning=False,
+              numa_local=False,
+              heavy_test_cpus=None,
+              parallel_count=None,
+              shard_index=0,
+              shard_count=1,
+              shard_durations=None,
+              artifact_cache=None,
+              xunit_console_sha256=None,
+              coredump_budget=None,
+              progress_interval=None):
     """ Run the coreclr tests
     
     Args:
@@ -934,6 +1292,26 @@ def run_tests(host_os,
         run_sequential(bool)        :
         limited_core_dumps(bool)    :
         run_in_context(bool)        : run the tests in an unloadable AssemblyLoadContext
+        python_runner(bool)         : run the test wrappers from python, not msbuild
+        cache_results(bool)         : skip tests that passed before with the same inputs
+        adaptive_timeouts(bool)     : time out each test based on its history
+        failed_first(bool)          : run the tests that failed last time first
+        rerun_failed_only(bool)     : only run the tests that failed last time
+        retry_failures(int)         : times to retry each failed test
+        batch_in_process(bool)      : run batches of tests in one process each
+        batch_size(int)             : maximum number of tests per batch
+        matrix([str])               : configurations to run the tests under
+        cpu_partitioning(bool)      : pin each test to its own cpus
+        numa_local(bool)            : keep the cpus of each test on one NUMA node
+        heavy_test_cpus(int)        : cpus a heavy test gets, or None
+        parallel_count(int)         : tests to run at once with python_runner
+        shard_index(int)            : shard of the tests to run with python_runner
+        shard_count(int)            : number of shards
+        shard_durations(str)        : testRun.json used to balance the shards
+        artifact_cache(str)         : where to cache xunit.console.dll, or None
+        xunit_console_sha256(str)   : expected sha256 of the xunit.console.dll zip
+        coredump_budget(int)        : MB of compressed coredumps to keep, or None
+        progress_interval(int)      : seconds between two progress reports, or None
     """
 
     # Setup the dotnetcli location
@@ -981,7 +1359,13 @@ def run_tests(host_os,
     if limited_core_dumps:
         setup_coredump_generation(host_os)
 
-    if run_in_context:
+    if coredump_budget is None:
+        coredump_budget = default_coredump_budget_mb
+
+    if progress_interval is None:
+        progress_interval = default_progress_interval
+
+    if run_in_context or batch_in_process:
         print("Running test in an unloadable AssemblyLoadContext")
         os.environ["CLRCustomTestLauncher"] = os.path.join(coreclr_repo_location, "tests", "scripts", "runincontext%s" % (".cmd" if host_os == "Windows_NT" else ".sh"))
         os.environ["RunInUnloadableContext"] = "1";
@@ -1001,6 +1385,36 @@ def run_tests(host_os,
         print("Setting __TestEnv=%s" % test_env)
         os.environ["__TestEnv"] = test_env
 
+    if python_runner:
+        if parallel_count is None:
+            parallel_count = 1 if run_sequential else multiprocessing.cpu_count()
+
+        return run_tests_in_python(host_os,
+                                   arch,
+                                   build_type,
+                                   coreclr_repo_location,
+                                   core_root,
+                                   test_location,
+                                   per_test_timeout,
+                                   parallel_count,
+                                   shard_index=shard_index,
+                                   shard_count=shard_count,
+                                   shard_durations=shard_durations,
+                                   limited_core_dumps=limited_core_dumps,
+                                   coredump_budget=coredump_budget,
+                                   cache_results=cache_results,
+                                   adaptive_timeouts=adaptive_timeouts,
+                                   failed_first=failed_first,
+                                   rerun_failed_only=rerun_failed_only,
+                                   retry_failures=retry_failures,
+                                   batch_in_process=batch_in_process,
+                                   batch_size=batch_size,
+                                   matrix=matrix,
+                                   cpu_partitioning=cpu_partitioning,
+                                   numa_local=numa_local,
+                                   heavy_test_cpus=heavy_test_cpus if heavy_test_cpus is not None else default_heavy_cpu_count,
+                                   progress_interval=progress_interval)
+
     #=====================================================================================================================================================
     #
     # This is a workaround needed to unblock our CI (in particular, Linux/arm and Linux/arm64 jobs) from the following failures appearing almost in every
@@ -1034,18 +1448,14 @@ def run_tests(host_os,
     #
     #=====================================================================================================================================================
 
-    print("Download and overwrite xunit.console.dll in Core_Root")
-
-    urlretrieve = urllib.urlretrieve if sys.version_info.major < 3 else urllib.request.urlretrieve
-    zipfilename = os.path.join(tempfile.gettempdir(), "xunit.console.dll.zip")
-    url = r"https://clrjit.blob.core.windows.net/xunit-console/xunit.console.dll-v2.4.1.zip"
-    urlretrieve(url, zipfilename)
+    cache = ArtifactCache(artifact_cache if artifact_cache is not None else get_default_artifact_cache_location())
+    zipfilename = cache.fetch(xunit_console_url, xunit_console_sha256)
 
-    with zipfile.ZipFile(zipfilename,"r") as ziparch:
-        ziparch.extractall(core_root)
-
-    os.remove(zipfilename)
-    assert not os.path.isfile(zipfilename)
+    updated_files = extract_changed_files(zipfilename, core_root)
+    if len(updated_files) > 0:
+        print("Overwrote %s in Core_Root" % ", ".join(updated_files))
+    else:
+        print("xunit.console.dll in Core_Root is up to date")
 
     # Call msbuild.
     return call_msbuild(coreclr_repo_location,
@@ -1056,153 +1466,756 @@ def run_tests(host_os,
                         build_type,
                         is_illink=is_illink,
                         limited_core_dumps=limited_core_dumps,
-                        sequential=run_sequential)
+                        coredump_budget=coredump_budget,
+                        sequential=run_sequential,
+                        progress_interval=progress_interval)
 
-def setup_args(args):
-    """ Setup the args based on the argparser obj
+def create_cpu_allocator(tests, test_location, histories, parallel_count, numa_local, heavy_test_cpus):
+    """ Split the cpus between the tests that run at once, see cpu_partitioning.py
 
     Args:
-        args(ArgParser): Parsed arguments
+        tests([str])                : the test wrappers to run
+        test_location(str)          : Test bin, location
+        histories([TestHistory])    : histories that decide which tests are heavy
+        parallel_count(int)         : number of tests to run at once
+        numa_local(bool)            : keep the cpus of each test on one NUMA node
+        heavy_test_cpus(int)        : cpus a heavy test gets
 
-    Notes:
-        If there is no core_root, or test location passed, create a default
-        location using the build type and the arch.
+    Returns:
+        cpu_allocator(CpuAllocator)
     """
 
-    require_built_test_dir = not args.generate_layout_only and True
-    require_built_core_root = not args.generate_layout_only and True
+    heavy_tests = set()
+    for history in histories:
+        heavy_tests.update(find_heavy_tests(tests, test_location, history))
 
-    coreclr_setup_args = CoreclrArguments(args, 
-                                          require_built_test_dir=require_built_test_dir, 
-                                          require_built_core_root=require_built_core_root, 
-                                          require_built_product_dir=args.generate_layout_only)
+    cpus = get_available_cpus()
+    cpu_allocator = CpuAllocator(cpus, parallel_count, numa_local=numa_local, heavy_tests=heavy_tests, heavy_cpu_count=heavy_test_cpus)
 
-    normal_location = os.path.join(coreclr_setup_args.bin_location, "tests", "%s.%s.%s" % (coreclr_setup_args.host_os, coreclr_setup_args.arch, coreclr_setup_args.build_type))
+    print("Pinning the tests to %d cpus: %s. %d of %d tests are heavy." % (len(cpus), cpu_allocator.describe(), len(heavy_tests), len(tests)))
+    if parallel_count > len(cpu_allocator.groups):
+        print("Warning: at most %d tests will run at once, one per cpu group." % len(cpu_allocator.groups))
 
-    # If we have supplied our own test location then we need to create a test location
-    # that the scripting will expect. As it is now, there is a dependency on the
-    # test location being under test/<os>.<build_type>.<arch>
+    return cpu_allocator
 
-    # Make sure that we are using the correct build_type. This is a test drop, it is possible
-    # that we are inferring the build type to be Debug incorrectly.
-    if coreclr_setup_args.build_type not in coreclr_setup_args.test_location:
-            # Remove punctuation
-            corrected_build_type = re.sub("[%s]" % string.punctuation, "", coreclr_setup_args.test_location.split(".")[-1])
-            coreclr_setup_args.verify(corrected_build_type,
-                                      "build_type",
-                                      coreclr_setup_args.check_build_type,
-                                      "Unsupported configuration: %s.\nSupported configurations: %s" % (corrected_build_type, ", ".join(coreclr_setup_args.valid_build_types)))
+def select_test_shard(tests, test_location, shard_index, shard_count, shard_durations=None):
+    """ Return the tests in one shard of a deterministic, balanced partition
 
-    if args.test_location is not None and coreclr_setup_args.test_location != normal_location:
-        test_location = args.test_location
+    Args:
+        tests ([str])           : paths of all of the test wrappers
+        test_location (str)     : Test bin, location
+        shard_index (int)       : shard to return
+        shard_count (int)       : number of shards
+        shard_durations (str)   : testRun.json of an earlier run, or None
 
-        # Remove optional end os.path.sep
-        if test_location[-1] == os.path.sep:
-            test_location = test_location[:-1]
+    Notes:
+        Every machine has to compute the same partition, so only inputs that
+        are the same everywhere are used as weights: the durations in
+        shard_durations if given, otherwise the size of each test's assembly.
+        The local test history is different on every machine and is not used.
+        If neither is available the shards are balanced by test count.
+    """
 
-        if normal_location.lower() != test_location.lower() and os.path.isdir(normal_location):
-            # Remove the existing directory if there is one.
-            shutil.rmtree(normal_location)
+    names = dict((test, mangle_test_name(os.path.relpath(test, test_location))) for test in tests)
+    weights = None
 
-            print("Non-standard test location being used.")
-            print("Overwrite the standard location with these tests.")
-            print("TODO: Change runtest.proj to allow running from non-standard test location.")
-            print("")
+    if shard_durations is not None:
+        with open(shard_durations) as file_handle:
+            durations = json.load(file_handle)["tests"]
 
-            print("cp -r %s %s" % (coreclr_setup_args.test_location, normal_location))
-            shutil.copytree(coreclr_setup_args.test_location, normal_location)
+        known = [durations[names[test]]["time"] for test in tests if names[test] in durations]
+        if len(known) > 0:
+            default_weight = sorted(known)[len(known) // 2]
+            weights = dict((test, durations[names[test]]["time"] if names[test] in durations else default_weight) for test in tests)
 
-            test_location = normal_location
+            print("Balancing shards by duration (%d of %d tests have a duration)." % (len(known), len(tests)))
 
-            # unset core_root so it can be put in the default location
-            core_root = None
+    if weights is None:
+        weights = {}
+        for test in tests:
+            base_name = os.path.splitext(test)[0]
+            for assembly in [base_name + ".dll", base_name + ".exe"]:
+                if os.path.isfile(assembly):
+                    weights[test] = os.path.getsize(assembly)
+                    break
 
-            # Force the core_root to be setup again.
-            args.generate_layout = True
+        if len(weights) == len(tests):
+            print("Balancing shards by test assembly size.")
+        else:
+            weights = dict((test, 1) for test in tests)
+            print("Balancing shards by test count.")
 
-            coreclr_setup_args.verify(test_location,
-                                      "test_location",
-                                      lambda arg: True,
-                                      "Error setting test location.")
+    shards = partition_by_weight(sorted(tests, key=lambda test: names[test]), weights, shard_count)
+    shard = shards[shard_index]
 
-    coreclr_setup_args.verify(args,
-                              "generate_layout_only",
-                              lambda arg: True,
-                              "Error setting generate_layout_only")
+    print("Running shard %d of %d: %d of %d tests." % (shard_index, shard_count, len(shard), len(tests)))
+    return shard
 
-    if coreclr_setup_args.generate_layout_only:
-        # Force generate_layout
-        coreclr_setup_args.verify(args,
-                                "generate_layout",
-                                lambda arg: True,
-                                "Error setting generate_layout",
-                                modify_arg=lambda arg: True)
-    
-    else:
-        coreclr_setup_args.verify(args,
-                                "generate_layout",
-                                lambda arg: True,
-                                "Error setting generate_layout")
+def retry_failed_tests(failed_tests, test_location, report_location, host_os, per_test_timeout, timeouts, retry_count, history):
+    """ Rerun failed tests in isolation, and classify them as flaky or deterministic
 
-    coreclr_setup_args.verify(args,
-                              "test_env",
-                              lambda arg: True,
-                              "Error setting test_env")
+    Args:
+        failed_tests ([str])        : paths of the test wrappers that failed
+        test_location (str)         : root of the built tests
+        report_location (str)       : where the output of the run was written
+        host_os (str)               : os
+        per_test_timeout (int)      : timeout in milliseconds
+        timeouts ({str: float})     : per test timeouts in seconds, by test path
+        retry_count (int)           : maximum number of reruns of each test
+        history (TestHistory)       : where the retries are recorded
 
-    coreclr_setup_args.verify(args,
-                              "analyze_results_only",
-                              lambda arg: True,
-                              "Error setting analyze_results_only")
+    Notes:
+        The tests are rerun one at a time, so a failure that only happens
+        under load or next to another test passes. A test that passes any
+        rerun is flaky and is not rerun again; one that fails all of them is
+        deterministic. The results in testRun.xml are those of the first run;
+        the output of the reruns goes to <report_location>/Retry<n>.
+    """
 
-    coreclr_setup_args.verify(args,
-                              "crossgen_altjit",
-                              lambda arg: True,
-                              "Error setting crossgen_altjit")
+    attempts = defaultdict(int)
+    passes = defaultdict(int)
+    pending = list(failed_tests)
 
-    coreclr_setup_args.verify(args,
-                              "altjit_arch",
-                              lambda arg: True,
-                              "Error setting altjit_arch")
+    for retry_index in range(1, retry_count + 1):
+        if len(pending) == 0:
+            break
 
-    coreclr_setup_args.verify(args,
-                              "rid",
-                              lambda arg: True,
-                              "Error setting rid")
+        print("")
+        print("Retry %d of %d: rerunning %d failed tests one at a time." % (retry_index, retry_count, len(pending)))
 
-    coreclr_setup_args.verify(args,
-                              "il_link",
-                              lambda arg: True,
-                              "Error setting il_link")
+        retry_report_location = os.path.join(report_location, "Retry%d" % retry_index)
+        executor = TestExecutor(pending, test_location, retry_report_location, host_os, 1, per_test_timeout / 1000.0, timeouts=timeouts)
 
-    coreclr_setup_args.verify(args,
-                              "long_gc",
-                              lambda arg: True,
-                              "Error setting long_gc")
-    
-    coreclr_setup_args.verify(args,
-                              "gcsimulator",
-                              lambda arg: True,
-                              "Error setting gcsimulator")
-    
-    coreclr_setup_args.verify(args,
-                              "jitdisasm",
-                              lambda arg: True,
-                              "Error setting jitdisasm")
+        for result in executor.run():
+            attempts[result.test_path] += 1
+            if result.passed:
+                passes[result.test_path] += 1
 
-    coreclr_setup_args.verify(args,
-                              "ilasmroundtrip",
-                              lambda arg: True,
-                              "Error setting ilasmroundtrip")
+            print("  %s %s (%.2f seconds)" % ("PASSED" if result.passed else "FAILED", result.relative_path, result.time))
+            sys.stdout.flush()
 
-    coreclr_setup_args.verify(args,
-                              "large_version_bubble",
-                              lambda arg: True,
-                              "Error setting large_version_bubble")
-    
-    coreclr_setup_args.verify(args,
-                              "run_crossgen_tests",
-                              lambda arg: True,
-                              "Error setting run_crossgen_tests")
+        pending = [test for test in pending if passes[test] == 0]
+
+    for test in failed_tests:
+        history.record_retry(os.path.relpath(test, test_location), attempts[test], passes[test])
+
+    history.flush()
+    flakiness = history.flakiness()
+
+    print("")
+    print("Failure classification:")
+    print("")
+
+    for test in failed_tests:
+        relative_path = os.path.relpath(test, test_location)
+        flaky_runs, retried_runs = flakiness.get(normalize_test_name(relative_path), (0, 0))
+
+        if passes[test] > 0:
+            classification = "FLAKY        "
+            detail = "passed on retry %d" % attempts[test]
+        else:
+            classification = "DETERMINISTIC"
+            detail = "failed all %d retries" % attempts[test]
+
+        print("%s %s (%s; flaky in %d of %d retried runs)" % (classification, relative_path, detail, flaky_runs, retried_runs))
+
+def run_test_matrix(host_os,
+                    arch,
+                    build_type,
+                    coreclr_repo_location,
+                    core_root,
+                    test_location,
+                    report_location,
+                    tests,
+                    per_test_timeout,
+                    parallel_count,
+                    matrix,
+                    adaptive_timeouts=False,
+                    failed_first=False,
+                    rerun_failed_only=False,
+                    cpu_partitioning=False,
+                    numa_local=False,
+                    heavy_test_cpus=default_heavy_cpu_count,
+                    progress_interval=default_progress_interval):
+    """ Run the tests under each configuration of a -matrix
+
+    Args:
+        host_os(str)                : os
+        arch(str)                   : arch
+        build_type(str)             : configuration
+        coreclr_repo_location(str)  : path to the root of the repo
+        core_root(str)              : Core_Root path
+        test_location(str)          : Test bin, location
+        report_location(str)        : where to write the output of the tests
+        tests([str])                : the test wrappers to run
+        per_test_timeout(int)       : timeout for each test, in milliseconds
+        parallel_count(int)         : number of tests to run at once
+        matrix([str])               : the configurations, see test_matrix.py
+        adaptive_timeouts(bool)     : see run_tests_in_python
+        failed_first(bool)          : see run_tests_in_python
+        rerun_failed_only(bool)     : see run_tests_in_python
+        cpu_partitioning(bool)      : see run_tests_in_python
+        numa_local(bool)            : see run_tests_in_python
+        heavy_test_cpus(int)        : see run_tests_in_python
+        progress_interval(int)      : see run_tests_in_python
+
+    Returns:
+        failed_count(int): number of failed (test, configuration) pairs
+
+    Notes:
+        Called by run_tests_in_python once the tests are found, so the
+        setup is shared by every configuration. The history of each
+        configuration is kept apart, as if it was run on its own. The results
+        are written to bin/Logs/testRun.xml, tagged with their configuration.
+    """
+
+    logs_dir = os.path.join(coreclr_repo_location, "bin", "Logs")
+    configurations = [parse_test_configuration(text, per_test_timeout / 1000.0) for text in matrix]
+
+    complus_vars = get_environment(os.environ.get("__TestEnv"))
+    relative_paths = dict((test, os.path.relpath(test, test_location)) for test in tests)
+
+    # The histories of the configurations share the connection of the first.
+    first_history = None
+    histories = {}
+    items = []
+    estimates = {}
+    timeouts = {}
+    known_count = 0
+
+    try:
+        for configuration in configurations:
+            history_config = configuration.history_config(complus_vars, os.environ)
+
+            if first_history is None:
+                first_history = TestHistory(logs_dir, host_os, arch, build_type, history_config)
+                history = first_history
+            else:
+                history = first_history.with_config(history_config)
+
+            histories[configuration.name] = history
+
+            configuration_tests = tests
+            last_failures = set()
+
+            if failed_first or rerun_failed_only:
+                last_failures = history.last_failures()
+
+                if rerun_failed_only:
+                    configuration_tests = [test for test in tests if normalize_test_name(relative_paths[test]) in last_failures]
+
+            configuration_estimates, configuration_known_count = history.expected_durations([relative_paths[test] for test in configuration_tests])
+            known_count += configuration_known_count
+
+            if adaptive_timeouts:
+                timeouts_by_path = history.adaptive_timeouts([relative_paths[test] for test in configuration_tests], configuration.timeout)
+                for test in configuration_tests:
+                    if relative_paths[test] in timeouts_by_path:
+                        timeouts[(test, configuration.name)] = timeouts_by_path[relative_paths[test]]
+
+            for test in configuration_tests:
+                key = "%s [%s]" % (relative_paths[test], configuration.name)
+                estimates[key] = configuration_estimates[relative_paths[test]]
+                items.append((not failed_first or normalize_test_name(relative_paths[test]) in last_failures, key, test, configuration))
+
+            print("%s: %d tests, %d second timeout%s." % (configuration.name,
+                                                        len(configuration_tests),
+                                                        configuration.timeout,
+                                                        ", %d at a time" % configuration.parallel_count if configuration.parallel_count is not None else ""))
+
+        # Failures first with failed_first, then longest first.
+        items.sort(key=lambda item: (not item[0], -estimates[item[1]]))
+
+        eta_estimator = EtaEstimator(estimates, min(parallel_count, max(1, len(items))))
+
+        print("Running %d tests under %d configurations, %d at a time." % (len(items), len(configurations), min(parallel_count, max(1, len(items)))))
+        print("Predicted run time: %s (%d of %d tests have a history)." % (format_duration(eta_estimator.predicted_total()), known_count, len(items)))
+        print("")
+
+        failed_counts = defaultdict(int)
+        partial_results = PartialResultsWriter(os.path.join(logs_dir, "testRun.partial.json"), len(items), max(1, progress_interval))
+
+        for history in histories.values():
+            history.start_run()
+
+        with XunitResultsWriter(os.path.join(logs_dir, "testRun.xml"), core_root) as results_writer:
+            if len(items) == 0:
+                return 0
+
+            cpu_allocator = None
+            if cpu_partitioning:
+                # A test is heavy if it is heavy under any of the configurations.
+                cpu_allocator = create_cpu_allocator(tests, test_location, list(histories.values()), parallel_count, numa_local, heavy_test_cpus)
+
+            executor = MatrixTestExecutor([(test, configuration) for _, _, test, configuration in items], test_location, report_location, host_os, parallel_count, timeouts=timeouts, cpu_allocator=cpu_allocator)
+
+            for index, result in enumerate(executor.run()):
+                results_writer.add(result)
+
+                if result.passed:
+                    status = "PASSED"
+                    outcome = "pass"
+                elif result.timed_out:
+                    status = "TIMED OUT"
+                    outcome = "timeout"
+                else:
+                    status = "FAILED"
+                    outcome = "fail"
+
+                if not result.passed:
+                    failed_counts[result.config] += 1
+
+                histories[result.config].record(result.relative_path, outcome, result.time, result.usage)
+                eta = eta_estimator.completed("%s [%s]" % (result.relative_path, result.config), result.time)
+
+                partial_results.add(result.name, outcome, result.time, None if result.passed else read_tail(result.output_file, partial_output_size), config=result.config)
+                partial_results.flush()
+
+                print("[%d/%d] %s %s [%s] (%.2f seconds), ETA %s" % (index + 1, len(items), status, result.relative_path, result.config, result.time, format_duration(eta)))
+                sys.stdout.flush()
+
+            partial_results.flush(force=True)
+    finally:
+        if first_history is not None:
+            first_history.close()
+
+    print("")
+    for configuration in configurations:
+        print("%s: %d failed." % (configuration.name, failed_counts[configuration.name]))
+
+    return sum(failed_counts.values())
+
+def run_tests_in_python(host_os,
+                        arch,
+                        build_type,
+                        coreclr_repo_location,
+                        core_root,
+                        test_location,
+                        per_test_timeout,
+                        parallel_count,
+                        shard_index=0,
+                        shard_count=1,
+                        shard_durations=None,
+                        limited_core_dumps=False,
+                        coredump_budget=default_coredump_budget_mb,
+                        cache_results=False,
+                        adaptive_timeouts=False,
+                        failed_first=False,
+                        rerun_failed_only=False,
+                        retry_failures=0,
+                        batch_in_process=False,
+                        batch_size=default_batch_size,
+                        matrix=None,
+                        cpu_partitioning=False,
+                        numa_local=False,
+                        heavy_test_cpus=default_heavy_cpu_count,
+                        progress_interval=default_progress_interval):
+    """ Run the test wrappers with TestExecutor instead of msbuild and xunit
+
+    Args:
+        host_os(str)                : os
+        arch(str)                   : arch
+        build_type(str)             : configuration
+        coreclr_repo_location(str)  : path to the root of the repo
+        core_root(str)              : Core_Root path
+        test_location(str)          : Test bin, location
+        per_test_timeout(int)       : timeout for each test, in milliseconds
+        parallel_count(int)         : number of tests to run at once
+        shard_index(int)            : shard of the tests to run
+        shard_count(int)            : number of shards
+        shard_durations(str)        : testRun.json used to balance the shards
+        limited_core_dumps(bool)    : triage the coredumps left by the tests
+        coredump_budget(int)        : MB of compressed coredumps to keep
+        cache_results(bool)         : report tests whose inputs did not change
+                                    : since they last passed as cached passes
+        adaptive_timeouts(bool)     : time out tests with a history of passes
+                                    : well before per_test_timeout
+        failed_first(bool)          : start with the tests whose last result
+                                    : in the history is a failure
+        rerun_failed_only(bool)     : only run those tests
+        retry_failures(int)         : rerun each failed test up to this many
+                                    : times, see retry_failed_tests
+        batch_in_process(bool)      : run the tests that allow it in batch
+                                    : hosts, see BatchTestExecutor
+        batch_size(int)             : maximum number of tests per batch host
+        matrix([str])               : run the tests under each of these
+                                    : configurations, see run_test_matrix
+        cpu_partitioning(bool)      : pin each test to its own cpus, see
+                                    : cpu_partitioning.py
+        numa_local(bool)            : keep the cpus of each test on one NUMA
+                                    : node
+        heavy_test_cpus(int)        : cpus a heavy test gets
+        progress_interval(int)      : least seconds between two writes of
+                                    : bin/Logs/testRun.partial.json
+
+    Returns:
+        return_code(int): 0 if all of the tests passed, 1 otherwise
+
+    Notes:
+        At this point the environment should be setup correctly, as for
+        call_msbuild. The results are written to bin/Logs/testRun.xml as they
+        come in, so parse_test_results and print_summary work as usual.
+        testRun.xml is only well formed once the run is over; the results so
+        far are also kept in testRun.partial.json, see PartialResultsWriter.
+
+        The tests are started longest first, according to the durations
+        recorded in bin/Logs/test_history.sqlite, so a few long tests do not
+        end up running alone at the end of the run.
+    """
+
+    logs_dir = os.path.join(coreclr_repo_location, "bin", "Logs")
+    if not os.path.isdir(logs_dir):
+        os.makedirs(logs_dir)
+
+    test_run_location = os.path.join(logs_dir, "testRun.xml")
+
+    report_location = os.environ.get("XunitTestReportDirBase")
+    if report_location is None or len(report_location) == 0:
+        report_location = os.path.join(test_location, "Reports")
+
+    tests = find_test_wrappers(test_location, host_os, exclude_locations=[core_root, report_location])
+
+    included_tests = read_included_test_names(test_location)
+    if included_tests is None:
+        print("Warning: no xunit wrapper sources under %s, test exclusions will not be applied." % os.path.join(test_location, "TestWrappers"))
+    else:
+        is_included = lambda test: os.path.normcase(os.path.relpath(test, test_location)) in included_tests
+        excluded_count = len(tests)
+        tests = [test for test in tests if is_included(test)]
+        excluded_count -= len(tests)
+
+        print("Excluding %d tests." % excluded_count)
+
+    if shard_count > 1:
+        tests = select_test_shard(tests, test_location, shard_index, shard_count, shard_durations)
+
+    if len(tests) == 0:
+        if shard_count > 1:
+            # Still write an (empty) testRun.xml, so the shard results can be merged.
+            print("Nothing to run in this shard.")
+            with XunitResultsWriter(test_run_location, core_root):
+                pass
+
+            return 0
+
+        print("Error: no tests found under %s." % test_location)
+        return 1
+
+    if matrix is not None:
+        failed_count = run_test_matrix(host_os,
+                                       arch,
+                                       build_type,
+                                       coreclr_repo_location,
+                                       core_root,
+                                       test_location,
+                                       report_location,
+                                       tests,
+                                       per_test_timeout,
+                                       parallel_count,
+                                       matrix,
+                                       adaptive_timeouts=adaptive_timeouts,
+                                       failed_first=failed_first,
+                                       rerun_failed_only=rerun_failed_only,
+                                       cpu_partitioning=cpu_partitioning,
+                                       numa_local=numa_local,
+                                       heavy_test_cpus=heavy_test_cpus,
+                                       progress_interval=progress_interval)
+
+        if limited_core_dumps:
+            inspect_and_delete_coredump_files(host_os, arch, test_location, coredump_budget)
+
+        return 0 if failed_count == 0 else 1
+
+    result_cache = None
+    cached_tests = []
+
+    if cache_results:
+        hash_cache = FileHashCache(os.path.join(test_location, "file_hashes.json"))
+        result_cache = TestResultCache(test_location, hash_cache, core_root, per_test_timeout)
+
+        cached_tests = [test for test in tests if result_cache.is_cached_pass(test)]
+        cached_test_set = set(cached_tests)
+        tests = [test for test in tests if test not in cached_test_set]
+
+        print("%d tests passed before with the same inputs and will not be run." % len(cached_tests))
+
+    # Durations under e.g. GCStress are not comparable to those of a default
+    # run, so the history is kept per test configuration.
+    config = get_test_config(get_environment(os.environ.get("__TestEnv")))
+    history = TestHistory(logs_dir, host_os, arch, build_type, config)
+
+    last_failures = set()
+    if failed_first or rerun_failed_only:
+        last_failures = history.last_failures()
+        is_last_failure = lambda test: normalize_test_name(os.path.relpath(test, test_location)) in last_failures
+
+        if rerun_failed_only:
+            tests = [test for test in tests if is_last_failure(test)]
+            print("Rerunning the %d tests that failed the last time they were run." % len(tests))
+
+            if len(tests) == 0 and len(cached_tests) == 0:
+                history.close()
+                with XunitResultsWriter(test_run_location, core_root):
+                    pass
+
+                return 0
+
+    relative_paths = dict((test, os.path.relpath(test, test_location)) for test in tests)
+    estimates, known_count = history.expected_durations(list(relative_paths.values()))
+
+    timeouts = {}
+    if adaptive_timeouts:
+        timeouts_by_path = history.adaptive_timeouts(list(relative_paths.values()), per_test_timeout / 1000.0)
+        timeouts = dict((test, timeouts_by_path[relative_paths[test]]) for test in tests if relative_paths[test] in timeouts_by_path)
+
+        print("Adaptive timeouts for %d of %d tests (configuration: %s)." % (len(timeouts), len(tests), config if config else "default"))
+
+    # Longest first; the sort is stable, so tests without a history stay in directory order.
+    tests.sort(key=lambda test: estimates[relative_paths[test]], reverse=True)
+
+    if failed_first:
+        # Still longest first within the failures and the rest.
+        tests.sort(key=lambda test: not is_last_failure(test))
+        print("Starting with the %d tests that failed the last time they were run." % len([test for test in tests if is_last_failure(test)]))
+
+    eta_estimator = EtaEstimator(estimates, min(parallel_count, len(tests)))
+
+    print("Running %d tests, %d at a time." % (len(tests), min(parallel_count, len(tests))))
+    print("Predicted run time: %s (%d of %d tests have a history)." % (format_duration(eta_estimator.predicted_total()), known_count, len(tests)))
+    print("")
+
+    executor = None
+    if batch_in_process:
+        if os.path.isfile(os.path.join(core_root, "runincontext.dll")):
+            probe_launcher = os.path.join(coreclr_repo_location, "tests", "scripts", "runincontext_probe.sh")
+            executor = BatchTestExecutor(tests, test_location, report_location, host_os, parallel_count, per_test_timeout / 1000.0, core_root, probe_launcher, batch_size=batch_size, timeouts=timeouts)
+
+            print("%d of %d tests will run in batch hosts of up to %d tests, the others on their own." % (executor.probe(), len(tests), batch_size))
+            if executor.environment_rejected_count > 0:
+                print("%d tests run on their own because no other test runs with the same COMPlus_/DOTNET_ variables." % executor.environment_rejected_count)
+
+            print("")
+        else:
+            print("Warning: %s not found, running every test on its own." % os.path.join(core_root, "runincontext.dll"))
+
+    if executor is None:
+        cpu_allocator = None
+        if cpu_partitioning:
+            cpu_allocator = create_cpu_allocator(tests, test_location, [history], parallel_count, numa_local, heavy_test_cpus)
+
+        executor = TestExecutor(tests, test_location, report_location, host_os, parallel_count, per_test_timeout / 1000.0, timeouts=timeouts, cpu_allocator=cpu_allocator)
+
+    partial_results = PartialResultsWriter(os.path.join(logs_dir, "testRun.partial.json"), len(cached_tests) + len(tests), max(1, progress_interval))
+
+    failed_count = 0
+    failed_tests = []
+    history.start_run()
+    try:
+        with XunitResultsWriter(test_run_location, core_root) as results_writer:
+            for test in cached_tests:
+                results_writer.add(TestExecutionResult(test, os.path.relpath(test, test_location), 0, False, 0.0, None, None, cached=True))
+                partial_results.add(mangle_test_name(os.path.relpath(test, test_location)), "pass", 0.0)
+
+            for index, result in enumerate(executor.run()):
+                results_writer.add(result)
+
+                if result_cache is not None:
+                    result_cache.record(result.test_path, result.passed)
+
+                if result.passed:
+                    status = "PASSED"
+                    outcome = "pass"
+                elif result.timed_out:
+                    status = "TIMED OUT"
+                    outcome = "timeout"
+                    failed_count += 1
+                else:
+                    status = "FAILED"
+                    outcome = "fail"
+                    failed_count += 1
+
+                if not result.passed:
+                    failed_tests.append(result.test_path)
+
+                history.record(result.relative_path, outcome, result.time, result.usage)
+                eta = eta_estimator.completed(result.relative_path, result.time)
+
+                partial_results.add(result.name, outcome, result.time, None if result.passed else read_tail(result.output_file, partial_output_size))
+                partial_results.flush()
+
+                print("[%d/%d] %s %s (%.2f seconds), ETA %s" % (index + 1, len(tests), status, result.relative_path, result.time, format_duration(eta)))
+                sys.stdout.flush()
+
+        if retry_failures > 0 and len(failed_tests) > 0:
+            retry_failed_tests(failed_tests, test_location, report_location, host_os, per_test_timeout, timeouts, retry_failures, history)
+    finally:
+        history.close()
+        partial_results.flush(force=True)
+
+        if result_cache is not None:
+            result_cache.save()
+            hash_cache.save()
+
+    if limited_core_dumps:
+        inspect_and_delete_coredump_files(host_os, arch, test_location, coredump_budget)
+
+    print("")
+    print("%d of %d tests failed." % (failed_count, len(tests)))
+    if len(cached_tests) > 0:
+        print("%d tests were not run, they passed before with the same inputs." % len(cached_tests))
+
+    return 0 if failed_count == 0 else 1
+
+def setup_args(args):
+    """ Setup the args based on the argparser obj
+
+    Args:
+        args(ArgParser): Parsed arguments
+
+    Notes:
+        If there is no core_root, or test location passed, create a default
+        location using the build type and the arch.
+    """
+
+    require_built_test_dir = not args.generate_layout_only and True
+    require_built_core_root = not args.generate_layout_only and True
+
+    coreclr_setup_args = CoreclrArguments(args, 
+                                          require_built_test_dir=require_built_test_dir, 
+                                          require_built_core_root=require_built_core_root, 
+                                          require_built_product_dir=args.generate_layout_only)
+
+    normal_location = os.path.join(coreclr_setup_args.bin_location, "tests", "%s.%s.%s" % (coreclr_setup_args.host_os, coreclr_setup_args.arch, coreclr_setup_args.build_type))
+
+    # If we have supplied our own test location then we need to create a test location
+    # that the scripting will expect. As it is now, there is a dependency on the
+    # test location being under test/<os>.<build_type>.<arch>
+
+    # Make sure that we are using the correct build_type. This is a test drop, it is possible
+    # that we are inferring the build type to be Debug incorrectly.
+    if coreclr_setup_args.build_type not in coreclr_setup_args.test_location:
+            # Remove punctuation
+            corrected_build_type = re.sub("[%s]" % string.punctuation, "", coreclr_setup_args.test_location.split(".")[-1])
+            coreclr_setup_args.verify(corrected_build_type,
+                                      "build_type",
+                                      coreclr_setup_args.check_build_type,
+                                      "Unsupported configuration: %s.\nSupported configurations: %s" % (corrected_build_type, ", ".join(coreclr_setup_args.valid_build_types)))
+
+    if args.test_location is not None and coreclr_setup_args.test_location != normal_location:
+        test_location = args.test_location
+
+        # Remove optional end os.path.sep
+        if test_location[-1] == os.path.sep:
+            test_location = test_location[:-1]
+
+        if normal_location.lower() != test_location.lower() and os.path.isdir(normal_location):
+            # Remove the existing directory if there is one.
+            shutil.rmtree(normal_location)
+
+            print("Non-standard test location being used.")
+            print("Overwrite the standard location with these tests.")
+            print("TODO: Change runtest.proj to allow running from non-standard test location.")
+            print("")
+
+            print("cp -r %s %s" % (coreclr_setup_args.test_location, normal_location))
+            shutil.copytree(coreclr_setup_args.test_location, normal_location)
+
+            test_location = normal_location
+
+            # unset core_root so it can be put in the default location
+            core_root = None
+
+            # Force the core_root to be setup again.
+            args.generate_layout = True
+
+            coreclr_setup_args.verify(test_location,
+                                      "test_location",
+                                      lambda arg: True,
+                                      "Error setting test location.")
+
+    coreclr_setup_args.verify(args,
+                              "generate_layout_only",
+                              lambda arg: True,
+                              "Error setting generate_layout_only")
+
+    coreclr_setup_args.verify(args,
+                              "build_xunit_test_wrappers",
+                              lambda arg: True,
+                              "Error setting build_xunit_test_wrappers")
+
+    if coreclr_setup_args.generate_layout_only:
+        # Force generate_layout
+        coreclr_setup_args.verify(args,
+                                "generate_layout",
+                                lambda arg: True,
+                                "Error setting generate_layout",
+                                modify_arg=lambda arg: True)
+    
+    else:
+        coreclr_setup_args.verify(args,
+                                "generate_layout",
+                                lambda arg: True,
+                                "Error setting generate_layout")
+
+    coreclr_setup_args.verify(args,
+                              "test_env",
+                              lambda arg: True,
+                              "Error setting test_env")
+
+    coreclr_setup_args.verify(args,
+                              "analyze_results_only",
+                              lambda arg: True,
+                              "Error setting analyze_results_only")
+
+    coreclr_setup_args.verify(args,
+                              "crossgen_altjit",
+                              lambda arg: True,
+                              "Error setting crossgen_altjit")
+
+    coreclr_setup_args.verify(args,
+                              "altjit_arch",
+                              lambda arg: True,
+                              "Error setting altjit_arch")
+
+    coreclr_setup_args.verify(args,
+                              "rid",
+                              lambda arg: True,
+                              "Error setting rid")
+
+    coreclr_setup_args.verify(args,
+                              "il_link",
+                              lambda arg: True,
+                              "Error setting il_link")
+
+    coreclr_setup_args.verify(args,
+                              "long_gc",
+                              lambda arg: True,
+                              "Error setting long_gc")
+    
+    coreclr_setup_args.verify(args,
+                              "gcsimulator",
+                              lambda arg: True,
+                              "Error setting gcsimulator")
+    
+    coreclr_setup_args.verify(args,
+                              "jitdisasm",
+                              lambda arg: True,
+                              "Error setting jitdisasm")
+
+    coreclr_setup_args.verify(args,
+                              "ilasmroundtrip",
+                              lambda arg: True,
+                              "Error setting ilasmroundtrip")
+
+    coreclr_setup_args.verify(args,
+                              "large_version_bubble",
+                              lambda arg: True,
+                              "Error setting large_version_bubble")
+    
+    coreclr_setup_args.verify(args,
+                              "run_crossgen_tests",
+                              lambda arg: True,
+                              "Error setting run_crossgen_tests")
 
     coreclr_setup_args.verify(args,
                               "precompile_core_root",
@@ -1234,6 +2247,123 @@ def setup_args(args):
                               lambda arg: True,
                               "Error setting run_in_context")
 
+    coreclr_setup_args.verify(args,
+                              "python_runner",
+                              lambda arg: True,
+                              "Error setting python_runner")
+
+    coreclr_setup_args.verify(args,
+                              "cache_results",
+                              lambda arg: not arg or args.python_runner,
+                              "Error setting cache_results, it requires --python_runner")
+
+    coreclr_setup_args.verify(args,
+                              "adaptive_timeouts",
+                              lambda arg: not arg or args.python_runner,
+                              "Error setting adaptive_timeouts, it requires --python_runner")
+
+    coreclr_setup_args.verify(args,
+                              "failed_first",
+                              lambda arg: not arg or args.python_runner,
+                              "Error setting failed_first, it requires --python_runner")
+
+    coreclr_setup_args.verify(args,
+                              "rerun_failed_only",
+                              lambda arg: not arg or args.python_runner,
+                              "Error setting rerun_failed_only, it requires --python_runner")
+
+    coreclr_setup_args.verify(args,
+                              "retry_failures",
+                              lambda arg: arg == 0 or (arg > 0 and args.python_runner),
+                              "Error setting retry_failures, it must not be negative and requires --python_runner")
+
+    coreclr_setup_args.verify(args,
+                              "batch_in_process",
+                              lambda arg: not arg or (args.python_runner and coreclr_setup_args.host_os != "Windows_NT"),
+                              "Error setting batch_in_process, it requires --python_runner and is not supported on Windows")
+
+    coreclr_setup_args.verify(args,
+                              "batch_size",
+                              lambda arg: arg > 0,
+                              "Error setting batch_size, it must be greater than 0")
+
+    coreclr_setup_args.verify(args,
+                              "cpu_partitioning",
+                              lambda arg: not arg or (args.python_runner and not args.batch_in_process and is_cpu_partitioning_supported()),
+                              "Error setting cpu_partitioning, it requires --python_runner and python3 on Linux, and cannot be combined with --batch_in_process")
+
+    coreclr_setup_args.verify(args,
+                              "numa_local",
+                              lambda arg: not arg or args.cpu_partitioning,
+                              "Error setting numa_local, it requires --cpu_partitioning")
+
+    coreclr_setup_args.verify(args,
+                              "heavy_test_cpus",
+                              lambda arg: arg is None or (arg > 0 and args.cpu_partitioning),
+                              "Error setting heavy_test_cpus, it must be greater than 0 and requires --cpu_partitioning")
+
+    coreclr_setup_args.verify(args,
+                              "matrix",
+                              lambda arg: arg is None or (args.python_runner and not args.cache_results and args.retry_failures == 0 and not args.batch_in_process and
+                                                          all(is_valid_test_configuration(item) for item in arg) and
+                                                          len(set(parse_test_configuration(item, 0).name for item in arg)) == len(arg)),
+                              "Error setting matrix, each configuration must be distinct comma separated name=value pairs. It requires --python_runner and cannot be combined with --cache_results, -retry_failures or --batch_in_process")
+
+    coreclr_setup_args.verify(args,
+                              "parallel_count",
+                              lambda arg: arg is None or arg > 0,
+                              "Error setting parallel_count, it must be greater than 0")
+
+    coreclr_setup_args.verify(args,
+                              "shard_count",
+                              lambda arg: arg > 0 and (arg == 1 or args.python_runner),
+                              "Error setting shard_count, it must be greater than 0 and sharding requires --python_runner")
+
+    coreclr_setup_args.verify(args,
+                              "shard_index",
+                              lambda arg: 0 <= arg < args.shard_count,
+                              "Error setting shard_index, it must be in [0, shard_count)")
+
+    coreclr_setup_args.verify(args,
+                              "shard_durations",
+                              lambda arg: arg is None or os.path.isfile(arg),
+                              "Error setting shard_durations, the file does not exist")
+
+    coreclr_setup_args.verify(args,
+                              "merge_results",
+                              lambda arg: arg is None or all(os.path.isfile(item) for item in arg),
+                              "Error setting merge_results, all of the files must exist")
+
+    coreclr_setup_args.verify(args,
+                              "lazy_repros",
+                              lambda arg: True,
+                              "Error setting lazy_repros")
+
+    coreclr_setup_args.verify(args,
+                              "repro_filter",
+                              lambda arg: True,
+                              "Error setting repro_filter")
+
+    coreclr_setup_args.verify(args,
+                              "coredump_budget",
+                              lambda arg: arg is None or arg >= 0,
+                              "Error setting coredump_budget, it must not be negative")
+
+    coreclr_setup_args.verify(args,
+                              "progress_interval",
+                              lambda arg: arg is None or arg >= 0,
+                              "Error setting progress_interval, it must not be negative")
+
+    coreclr_setup_args.verify(args,
+                              "artifact_cache",
+                              lambda arg: True,
+                              "Error setting artifact_cache")
+
+    coreclr_setup_args.verify(args,
+                              "xunit_console_sha256",
+                              lambda arg: arg is None or re.match(r"^[0-9a-fA-F]{64}$", arg) is not None,
+                              "Error setting xunit_console_sha256, it must be a sha256 hex digest")
+
     is_same_os = False
     is_same_arch = False
     is_same_build_type = False
@@ -1307,6 +2437,23 @@ def setup_tools(host_os, coreclr_repo_location):
 
     return setup
 
+def get_available_memory():
+    """ Return the physical memory available for new processes, in bytes
+
+    Returns:
+        available_memory (int): bytes, or None if it cannot be determined
+    """
+
+    try:
+        with open("/proc/meminfo") as file_handle:
+            for line in file_handle:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+
+    return None
+
 def precompile_core_root(test_location,
                          host_os,
                          arch,
@@ -1322,6 +2469,12 @@ def precompile_core_root(test_location,
         use_jit_disasm(Bool)    : use jit disasm
         altjit_name(str)        : name of the altjit
 
+    Notes:
+        Assemblies are precompiled in parallel, as many at once as the cpus
+        and the available memory allow. Assemblies precompiled by an earlier
+        run are skipped if their IL, crossgen, the JIT, CoreLib and the flags
+        are all unchanged; this is tracked in precompile_core_root.json in
+        Core_Root.
     """
 
     skip_list = [
@@ -1404,45 +2557,342 @@ def precompile_core_root(test_location,
         env["COMPlus_NoGuiOnAssert"]="1"
         env["COMPlus_ContinueOnAssert"]="0"
 
-    dlls = [os.path.join(core_root, item) for item in os.listdir(core_root) if item.endswith("dll") and "mscorlib" not in item]
+    # Native images from earlier runs (<name>.ni.dll) are not inputs.
+    dlls = [os.path.join(core_root, item) for item in os.listdir(core_root) if item.endswith("dll") and not item.lower().endswith(".ni.dll") and "mscorlib" not in item]
 
-    def in_skip_list(item):
-        found = False
-        for skip_re in skip_list: 
-            if re.match(skip_re, item.lower()) is not None: 
-                found = True
-        return found
+    # Filter out native binaries up front by reading their PE headers, rather
+    # than launching crossgen on them to find out.
+    dlls = find_managed_assemblies(dlls, dedup=False)
+
+    # The patterns are written with the assemblies' casing; match them case
+    # insensitively, in one pass.
+    skip_regex = re.compile("|".join("(?:%s)" % item for item in skip_list), re.IGNORECASE)
+
+    dlls = [dll for dll in dlls if skip_regex.match(dll) is None]
+
+    # An assembly is up to date if neither it, nor the tools that compile it,
+    # nor the way they are invoked changed since it was last precompiled.
+    hash_cache = FileHashCache(os.path.join(test_location, "file_hashes.json"))
+    stamp_file = os.path.join(core_root, "precompile_core_root.json")
+
+    jit_name = {"Windows_NT": "clrjit.dll", "OSX": "libclrjit.dylib"}.get(host_os, "libclrjit.so")
+    tool_files = [crossgen, os.path.join(core_root, jit_name), os.path.join(core_root, "System.Private.CoreLib.dll")]
+    if altjit_name:
+        tool_files.append(os.path.join(core_root, altjit_name))
+
+    tool_hashes = [hash_cache.hash(item) for item in tool_files if os.path.isfile(item)]
+    flags = [str(use_jit_disasm), str(altjit_name), os.path.join(test_location, "dasm") if use_jit_disasm else ""]
+
+    def get_precompile_key(dll):
+        return "|".join([hash_cache.hash(dll)] + tool_hashes + flags)
+
+    stamps = {}
+    if os.path.isfile(stamp_file):
+        try:
+            with open(stamp_file) as file_handle:
+                stamps = json.load(file_handle)
+        except ValueError:
+            stamps = {}
+
+    keys = dict((dll, get_precompile_key(dll)) for dll in dlls)
+
+    def is_up_to_date(dll):
+        if stamps.get(os.path.basename(dll)) != keys[dll]:
+            return False
+
+        # crossgen writes <name>.ni.dll next to the input.
+        return use_jit_disasm or os.path.isfile(os.path.splitext(dll)[0] + ".ni.dll")
+
+    up_to_date = [dll for dll in dlls if is_up_to_date(dll)]
+    dlls = [dll for dll in dlls if not is_up_to_date(dll)]
+
+    if len(up_to_date) > 0:
+        print("%d assemblies are already precompiled and up to date." % len(up_to_date))
+
+    # crossgen of the larger framework assemblies can take close to a GB, so
+    # do not run more of them at once than the memory allows.
+    worker_count = multiprocessing.cpu_count()
+    available_memory = get_available_memory()
+    if available_memory is not None:
+        worker_count = min(worker_count, max(1, available_memory // (1024 * 1024 * 1024)))
+
+    worker_count = max(1, min(worker_count, len(dlls)))
+
+    if len(dlls) > 0:
+        print("Precompiling %d assemblies, %d at a time." % (len(dlls), worker_count))
+
+        pool = multiprocessing.pool.ThreadPool(worker_count)
+        try:
+            for dll, succeeded in pool.imap_unordered(lambda dll: (dll, call_crossgen(dll, env)), dlls):
+                if succeeded:
+                    stamps[os.path.basename(dll)] = keys[dll]
+                else:
+                    stamps.pop(os.path.basename(dll), None)
+        finally:
+            pool.close()
+            pool.join()
+
+    with open(stamp_file, "w") as file_handle:
+        json.dump(stamps, file_handle, indent=2, sort_keys=True)
+
+    hash_cache.save()
+
+    print("")
+
+def get_core_root_package_fingerprint(host_os, arch, build_type, coreclr_repo_location):
+    """ Hash everything that decides which packages go into Core_Root
+
+    Returns:
+        fingerprint (str): changes whenever a package restore could restore
+                         : something different
+    """
+
+    build_proj = os.path.join(coreclr_repo_location, "tests", "build.proj")
+    inputs = [os.path.join(coreclr_repo_location, item) for item in core_root_package_inputs]
+
+    with open(build_proj) as file_handle:
+        for project in re.findall(r'<RestoreProjects Include="\$\(MSBuildThisFileDirectory\)([^"]*)"', file_handle.read()):
+            inputs.append(os.path.join(os.path.dirname(build_proj), *project.split("\\")))
+
+    parts = [host_os, arch, build_type]
+    for item in sorted(set(inputs)):
+        parts.append("%s=%s" % (os.path.relpath(item, coreclr_repo_location), hash_file(item) if os.path.isfile(item) else "missing"))
+
+    return "|".join(parts)
+
+def extract_changed_files(zip_path, destination):
+    """ Extract the files of a zip that differ from what is in destination
+
+    Args:
+        zip_path (str)      : zip to extract
+        destination (str)   : directory to extract it into
+
+    Returns:
+        updated_files ([str]): names of the files that were written
+    """
+
+    updated_files = []
+
+    with zipfile.ZipFile(zip_path, "r") as zip_file:
+        for info in zip_file.infolist():
+            if info.filename.endswith("/"):
+                continue
+
+            path = os.path.join(destination, *info.filename.split("/"))
 
-    dlls = [dll for dll in dlls if not in_skip_list(dll)]
+            if os.path.isfile(path) and os.path.getsize(path) == info.file_size:
+                with open(path, "rb") as file_handle:
+                    if file_handle.read() == zip_file.read(info):
+                        continue
 
-    for dll in dlls:
-        call_crossgen(dll, env)
+            zip_file.extract(info, destination)
+            updated_files.append(info.filename)
+
+    return updated_files
+
+def link_or_copy_file(src, dest):
+    """ Place a copy of src at dest as cheaply as possible
+
+    Args:
+        src (str)   : file to copy
+        dest (str)  : destination path, replaced if it exists
+
+    Returns:
+        method (str): "reflink", "link" or "copy"; a hard link shares its
+                    : inode (and so its mode) with src
+
+    Notes:
+        Tries, in order: a reflink (copy on write clone, where the filesystem
+        supports it), a hard link, and a real copy. The modification time of
+        src is kept, so an unchanged file is recognized on the next sync.
+    """
+
+    if os.path.lexists(dest):
+        os.remove(dest)
+
+    try:
+        import fcntl
+
+        with open(src, "rb") as src_handle, open(dest, "wb") as dest_handle:
+            fcntl.ioctl(dest_handle.fileno(), ficlone_ioctl, src_handle.fileno())
+
+        shutil.copystat(src, dest)
+        return "reflink"
+    except (ImportError, IOError, OSError):
+        if os.path.lexists(dest):
+            os.remove(dest)
+
+    try:
+        os.link(src, dest)
+        return "link"
+    except (AttributeError, OSError):
+        pass
+
+    shutil.copy2(src, dest)
+    return "copy"
+
+def sync_directory(src, dest, previous_files=None):
+    """ Bring the files from src into dest, only touching what changed
+
+    Args:
+        src (str)               : directory to copy from
+        dest (str)              : directory to copy into
+        previous_files ([str])  : files (relative to dest) an earlier sync
+                                : placed in dest
+
+    Returns:
+        files ([str]): the files (relative to dest) now placed from src
+
+    Notes:
+        This follows update_directory in src/scripts/utilities.py: files are
+        compared by size and mtime first, and by contents only when the size
+        matches but the mtime does not. Unlike update_directory it cannot
+        delete everything in dest that src lacks, as dest (Core_Root) also
+        holds files from the package overlay; only files that came from an
+        earlier sync (previous_files) and are gone from src are removed.
+    """
+
+    files = []
+    copied_count = 0
+    unchanged_count = 0
+
+    for src_dir, dir_names, file_names in os.walk(src):
+        dir_names.sort()
+        relative_dir = os.path.relpath(src_dir, src)
+        dest_dir = os.path.normpath(os.path.join(dest, relative_dir))
+
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+
+        for file_name in sorted(file_names):
+            src_file = os.path.join(src_dir, file_name)
+            dest_file = os.path.join(dest_dir, file_name)
+            files.append(os.path.normpath(os.path.join(relative_dir, file_name)))
+
+            if os.path.isfile(dest_file):
+                src_stat = os.stat(src_file)
+                dest_stat = os.stat(dest_file)
+
+                if src_stat.st_size == dest_stat.st_size:
+                    if int(src_stat.st_mtime) == int(dest_stat.st_mtime):
+                        unchanged_count += 1
+                        continue
+
+                    if filecmp.cmp(src_file, dest_file, shallow=False):
+                        # Same contents, sync the time so the next check is a stat.
+                        os.utime(dest_file, (src_stat.st_atime, src_stat.st_mtime))
+                        unchanged_count += 1
+                        continue
+
+            method = link_or_copy_file(src_file, dest_file)
+            copied_count += 1
+
+            # A hard link would change the mode of the product file as well.
+            if sys.platform != "win32" and method != "link":
+                # Set executable bit
+                os.chmod(dest_file, 0o774)
+
+    removed_count = 0
+    if previous_files is not None:
+        for item in sorted(set(previous_files).difference(files)):
+            dead_file = os.path.join(dest, item)
+            if os.path.isfile(dead_file):
+                os.remove(dead_file)
+                removed_count += 1
+
+    print("%d files updated, %d unchanged, %d removed." % (copied_count, unchanged_count, removed_count))
+    return files
+
+def setup_core_root(host_os, 
+                    arch, 
+                    build_type, 
+                    coreclr_repo_location, 
+                    test_native_bin_location,
+                    product_location,
+                    test_location,
+                    core_root):
+    """ Setup the core root
+
+    Args:
+        host_os(str)                : os
+        arch(str)                   : architecture
+        build_type(str)             : build configuration
+        coreclr_repo_location(str)  : coreclr repo location
+        product_location(str)       : Product location
+        core_root(str)              : Location for core_root
+
+    Notes:
+        Core_Root is only rebuilt from scratch (package restore and the
+        CreateTestOverlay target) when the set of packages could have changed
+        since it was last built; this is tracked in core_root_setup.json in
+        the test location. The product is then synced into Core_Root,
+        touching only the files that changed.
+    """
+    global g_verbose
+
+    assert os.path.isdir(product_location)
+
+    setup_stamp_file = os.path.join(test_location, "core_root_setup.json")
+    package_fingerprint = get_core_root_package_fingerprint(host_os, arch, build_type, coreclr_repo_location)
+
+    setup_stamp = {}
+    if os.path.isfile(setup_stamp_file):
+        try:
+            with open(setup_stamp_file) as file_handle:
+                setup_stamp = json.load(file_handle)
+        except ValueError:
+            setup_stamp = {}
+
+    def write_setup_stamp():
+        with open(setup_stamp_file, "w") as file_handle:
+            json.dump(setup_stamp, file_handle, indent=2)
+
+    is_overlay_current = os.path.isdir(core_root) and \
+                         setup_stamp.get("core_root") == os.path.abspath(core_root) and \
+                         setup_stamp.get("package_fingerprint") == package_fingerprint
+
+    if is_overlay_current:
+        print("The package set is unchanged, reusing the existing Core_Root overlay.")
+        set_core_root_environment(host_os, arch, core_root)
+    elif not create_core_root_overlay(host_os, arch, build_type, coreclr_repo_location, core_root):
+        return False
+    else:
+        setup_stamp = {
+            "core_root": os.path.abspath(core_root),
+            "package_fingerprint": package_fingerprint,
+            "product_files": []
+        }
+        write_setup_stamp()
 
+    # Copy the product dir to the core_root directory
+    print("")
+    print("Syncing Product Bin to Core_Root:")
+    print("%s -> %s" % (product_location, core_root))
+    setup_stamp["product_files"] = sync_directory(product_location, core_root, setup_stamp.get("product_files"))
+    write_setup_stamp()
+    print("---------------------------------------------------------------------")
+    print("")
+    print("Core_Root setup.")
     print("")
 
-def setup_core_root(host_os, 
-                    arch, 
-                    build_type, 
-                    coreclr_repo_location, 
-                    test_native_bin_location,
-                    product_location,
-                    test_location,
-                    core_root):
-    """ Setup the core root
+    return True
+
+def create_core_root_overlay(host_os, arch, build_type, coreclr_repo_location, core_root):
+    """ Create Core_Root from scratch, with the restored packages
 
     Args:
         host_os(str)                : os
         arch(str)                   : architecture
         build_type(str)             : build configuration
         coreclr_repo_location(str)  : coreclr repo location
-        product_location(str)       : Product location
         core_root(str)              : Location for core_root
+
+    Returns:
+        success(bool)
     """
     global g_verbose
 
-    assert os.path.isdir(product_location)
-
-    # Create core_root if it does not exist
+    # Start from an empty core_root
     if os.path.isdir(core_root):
         shutil.rmtree(core_root)
         
@@ -1575,45 +3025,30 @@ def setup_core_root(host_os,
         print("Error: creating Core_Root failed.")
         return False
 
-    os.environ["__BuildLogRootName"] = ""
-    os.environ["xUnitTestBinBase"] = ""
-    os.environ["__RuntimeId"] = ""
+    set_core_root_environment(host_os, arch, core_root)
 
-    def copy_tree(src, dest):
-        """ Simple copy from src to dest
-        """
-        assert os.path.isdir(src)
-        assert os.path.isdir(dest)
+    return True
 
-        for item in os.listdir(src):
-            if ".nuget" in item:
-                pass
-            item = os.path.join(src, item)
+def set_core_root_environment(host_os, arch, core_root):
+    """ Set the environment create_core_root_overlay leaves behind
 
-            if os.path.isfile(item):
-                shutil.copy2(item, dest)
+    Args:
+        host_os(str)    : os
+        arch(str)       : architecture
+        core_root(str)  : Location for core_root
 
-                if host_os != "Windows_NT":
-                    # Set executable bit
-                    os.chmod(os.path.join(dest, item), 0o774)
-            else:
-                new_dir = os.path.join(dest, os.path.basename(item))
-                if os.path.isdir(new_dir):
-                    shutil.rmtree(new_dir)
-                
-                shutil.copytree(item, new_dir)
+    Notes:
+        Also used when an existing overlay is reused, so the rest of the run
+        sees the same environment either way.
+    """
 
-    # Copy the product dir to the core_root directory
-    print("")
-    print("Copying Product Bin to Core_Root:")
-    print("cp -r %s%s* %s" % (product_location, os.path.sep, core_root))
-    copy_tree(product_location, core_root)
-    print("---------------------------------------------------------------------")
-    print("")
-    print("Core_Root setup.")
-    print("")
+    if host_os != "Windows_NT":
+        os.environ["__DistroRid"] = "%s-%s" % ("osx" if sys.platform == "darwin" else "linux", arch)
 
-    return True
+    os.environ["Core_Root"] = core_root
+    os.environ["__BuildLogRootName"] = ""
+    os.environ["xUnitTestBinBase"] = ""
+    os.environ["__RuntimeId"] = ""
 
 if sys.version_info.major < 3:
     def to_unicode(s):
@@ -1642,6 +3077,108 @@ def delete_existing_wrappers(test_location):
         print("rm %s" % test_location)
         os.remove(test_location)
 
+def build_test_wrappers(host_os,
+                        arch,
+                        build_type,
+                        coreclr_repo_location,
+                        test_location,
+                        altjit_arch=None,
+                        rebuild_all=False,
+                        adopt_existing=False):
+    """ Build the xunit wrappers whose inputs changed since they were last built
+
+    Args:
+        host_os(str)                : os
+        arch(str)                   : architecture
+        build_type(str)             : configuration
+        coreclr_repo_location(str)  : path to coreclr repo
+        test_location(str)          : location of the tests
+        altjit_arch(str)            : altjit architecture, if any
+        rebuild_all(bool)           : rebuild every wrapper
+        adopt_existing(bool)        : without a recorded state, take the
+                                    : existing wrappers as up to date
+
+    Returns:
+        success(bool)
+
+    Notes:
+        See xunit_wrappers.py for what the inputs of a wrapper are. The
+        wrappers of the other directories are neither deleted nor built.
+        build-test does not record the inputs of the wrappers it builds;
+        adopt_existing is for when its build_info.json matches this run.
+    """
+
+    state = XunitWrapperState(test_location, coreclr_repo_location, host_os, arch, build_type, altjit_arch=altjit_arch)
+    directories = find_wrapper_directories(test_location, host_os)
+
+    if rebuild_all:
+        changed_directories = directories
+    else:
+        if adopt_existing and not state.exists:
+            state.record([directory for directory in directories if os.path.isfile(get_wrapper_path(test_location, directory))])
+            state.save()
+
+        changed_directories = state.changed_directories(directories)
+
+    if len(changed_directories) == 0:
+        print("The xunit wrappers of all %d test directories are up to date." % len(directories))
+        return True
+
+    print("Building the xunit wrappers of %d of %d test directories." % (len(changed_directories), len(directories)))
+
+    for directory in changed_directories:
+        delete_existing_wrappers(directory)
+
+    logs_dir = os.path.join(coreclr_repo_location, "bin", "Logs")
+    if not os.path.isdir(logs_dir):
+        os.makedirs(logs_dir)
+
+    directories_file = os.path.join(logs_dir, "XunitWrapperDirectories_%s_%s_%s.txt" % (host_os, arch, build_type))
+    with open(directories_file, "w") as file_handle:
+        file_handle.write("".join(os.path.abspath(directory) + "\n" for directory in changed_directories))
+
+    dotnetcli_location = os.path.join(coreclr_repo_location, "dotnet%s" % (".cmd" if host_os == "Windows_NT" else ".sh"))
+
+    log_path = os.path.join(logs_dir, "XunitWrappers_%s_%s_%s" % (host_os, arch, build_type))
+
+    command = [dotnetcli_location,
+               "msbuild",
+               os.path.join(coreclr_repo_location, "tests", "runtest.proj"),
+               "/p:BuildWrappers=true",
+               "/p:TargetsWindows=%s" % ("true" if host_os == "Windows_NT" else "false"),
+               "/p:WrapperDirectoriesFile=%s" % directories_file,
+               "/p:XunitTestBinBase=%s" % os.path.join(os.path.abspath(test_location), ""),
+               "/p:__Exclude=%s" % os.path.join(coreclr_repo_location, "tests", "issues.targets"),
+               "/fileloggerparameters:\"Verbosity=normal;LogFile=%s.log\"" % log_path,
+               "/fileloggerparameters1:\"WarningsOnly;LogFile=%s.wrn\"" % log_path,
+               "/fileloggerparameters2:\"ErrorsOnly;LogFile=%s.err\"" % log_path,
+               "/consoleloggerparameters:Summary",
+               "/p:__BuildOS=%s" % host_os,
+               "/p:__BuildArch=%s" % arch,
+               "/p:__BuildType=%s" % build_type]
+
+    if altjit_arch is not None:
+        command += ["/p:AltJitArch=%s" % altjit_arch]
+
+    print(" ".join(command))
+
+    sys.stdout.flush() # flush output before creating sub-process
+    proc = subprocess.Popen(command)
+    proc.communicate()
+
+    if proc.returncode != 0:
+        print("Error: building the xunit wrappers failed. Refer to the build log files for details (%s.*)" % log_path)
+        return False
+
+    state.record(changed_directories)
+    state.save()
+
+    # As build-test does after building the wrappers.
+    with open(os.path.join(test_location, "build_info.json"), "w") as file_handle:
+        json.dump({ "build_os": host_os, "build_arch": arch, "build_type": build_type }, file_handle)
+
+    return True
+
 def find_test_from_name(host_os, test_location, test_name):
     """ Given a test's name return the location on disk
 
@@ -1750,6 +3287,62 @@ def find_test_from_name(host_os, test_location, test_name):
 
     return location
 
+def iterate_test_collections(test_run_location):
+    """ Yield the children of each <assembly> in a testRun.xml
+
+    Args:
+        test_run_location (str): path of the testRun.xml
+
+    Notes:
+        testRun.xml is <assemblies><assembly><collection><test>... It is
+        streamed, and each collection is dropped once it has been handled, so
+        memory use does not grow with the size of the test output.
+    """
+
+    open_elements = []
+    for event, element in xml.etree.ElementTree.iterparse(test_run_location, events=("start", "end")):
+        if event == "start":
+            open_elements.append(element)
+            continue
+
+        open_elements.pop()
+
+        # Only the children of <assembly> are interesting.
+        if len(open_elements) != 2:
+            continue
+
+        yield element
+
+        open_elements[-1].remove(element)
+
+def get_collection_test_name(collection):
+    """ Return the name of the test run by an xunit collection
+    """
+
+    test_name = None
+    for test in collection:
+        type = test.attrib["type"]
+        method = test.attrib["method"]
+
+        type = type.split("._")[0]
+        test_name = type + method
+
+    assert test_name != None
+    return test_name
+
+def get_collection_result_key(collection):
+    """ Return the name of the test run by an xunit collection, tagged with
+        the -matrix configuration it ran under, if any
+    """
+
+    test_name = get_collection_test_name(collection)
+
+    config = collection.attrib.get("config")
+    if config is None:
+        return test_name
+
+    return "%s [%s]" % (test_name, config)
+
 def parse_test_results(host_os, arch, build_type, coreclr_repo_location, test_location):
     """ Parse the test results for test execution information
 
@@ -1785,54 +3378,300 @@ def parse_test_results(host_os, arch, build_type, coreclr_repo_location, test_lo
 
             return
 
-    assemblies = xml.etree.ElementTree.parse(test_run_location).getroot()
+    test_name_index = TestNameIndex(test_location, host_os)
+
+    # The output of failing tests is written here instead of being kept in memory.
+    failure_output_location = log_path + ".failures.txt"
 
     tests = defaultdict(lambda: None)
-    for assembly in assemblies:
-        for collection in assembly:
+
+    with open(failure_output_location, "wb") as failure_output:
+        for collection in iterate_test_collections(test_run_location):
             if collection.tag == "errors" and collection.text != None:
                 # Something went wrong during running the tests.
                 print("Error running the tests, please run runtest.py again.")
                 sys.exit(1)
             elif collection.tag != "errors":
-                test_name = None
-                for test in collection:
-                    type = test.attrib["type"]
-                    method = test.attrib["method"]
-
-                    type = type.split("._")[0]
-                    test_name = type + method
-
-                assert test_name != None
+                test_name = get_collection_test_name(collection)
+                result_key = get_collection_result_key(collection)
+                config = collection.attrib.get("config")
 
                 failed = collection.attrib["failed"]
                 skipped = collection.attrib["skipped"]
                 passed = collection.attrib["passed"]
                 time = float(collection.attrib["time"])
+                usage = ResourceUsage.from_attributes(collection[0].attrib) if len(collection) > 0 else None
+                cached = len(collection) > 0 and collection[0].attrib.get("cached") == "true"
 
-                test_output = None
+                output_file = None
+                output_offset = 0
+                output_length = 0
 
                 if failed == "1":
                     failure_info = collection[0][0]
                     test_output = failure_info.text
 
-                test_location_on_filesystem = find_test_from_name(host_os, test_location, test_name)
+                    if test_output is not None:
+                        if not isinstance(test_output, bytes):
+                            test_output = test_output.encode("utf-8")
+
+                        output_file = failure_output_location
+                        output_offset = failure_output.tell()
+                        output_length = len(test_output)
+                        failure_output.write(test_output)
+
+                test_location_on_filesystem = test_name_index.lookup(test_name)
+
+                if test_location_on_filesystem is None:
+                    # Not in the index (e.g. an ambiguous name), fall back to searching the test tree.
+                    test_location_on_filesystem = find_test_from_name(host_os, test_location, test_name)
 
                 assert os.path.isfile(test_location_on_filesystem)
                 
-                assert tests[test_name] == None
-                tests[test_name] = defaultdict(lambda: None, {
-                    "name": test_name,
-                    "test_path": test_location_on_filesystem,
-                    "failed": failed,
-                    "skipped": skipped,
-                    "passed": passed,
-                    "time": time,
-                    "test_output": test_output
-                })
+                assert tests[result_key] == None
+                tests[result_key] = TestResult(test_name,
+                                               test_location_on_filesystem,
+                                               failed,
+                                               skipped,
+                                               passed,
+                                               time,
+                                               output_file=output_file,
+                                               output_offset=output_offset,
+                                               output_length=output_length,
+                                               usage=usage,
+                                               config=config,
+                                               cached=cached)
 
     return tests
 
+def merge_test_results(result_files, test_run_location):
+    """ Merge the results of several shards into one testRun.xml
+
+    Args:
+        result_files ([str])    : testRun.xml or testRun.json files of the shards
+        test_run_location (str) : testRun.xml to write
+
+    Notes:
+        The merged results are also written as json next to test_run_location
+        (testRun.json), in the form accepted by -shard_durations and by this
+        function. A test reported by more than one shard keeps its first result.
+    """
+
+    json_location = os.path.splitext(test_run_location)[0] + ".json"
+
+    for result_file in result_files:
+        if os.path.realpath(result_file) in [os.path.realpath(test_run_location), os.path.realpath(json_location)]:
+            print("Error: cannot merge %s into itself, copy the shard results elsewhere first." % result_file)
+            sys.exit(1)
+
+    merged_tests = {}
+    duplicate_count = 0
+
+    def add_test(test_name, collection, file_handle):
+        if test_name in merged_tests:
+            return False
+
+        failed = collection.attrib["failed"] == "1"
+        passed = collection.attrib["passed"] == "1"
+
+        merged_tests[test_name] = {
+            "outcome": "fail" if failed else ("pass" if passed else "skip"),
+            "time": float(collection.attrib["time"])
+        }
+
+        if "config" in collection.attrib:
+            merged_tests[test_name]["config"] = collection.attrib["config"]
+
+        if len(collection) > 0 and collection[0].attrib.get("cached") == "true":
+            merged_tests[test_name]["cached"] = True
+
+        if failed and len(collection) > 0 and len(collection[0]) > 0:
+            merged_tests[test_name]["output"] = collection[0][0].text
+
+        usage = ResourceUsage.from_attributes(collection[0].attrib) if len(collection) > 0 else None
+        if usage is not None:
+            merged_tests[test_name]["usage"] = usage.to_attributes()
+
+        file_handle.write(xml.etree.ElementTree.tostring(collection))
+        file_handle.write(b"\n")
+        return True
+
+    with open(test_run_location, "wb") as file_handle:
+        file_handle.write(b'<?xml version="1.0" encoding="utf-8"?>\n<assemblies>\n')
+
+        for result_file in result_files:
+            print("Merging %s" % result_file)
+
+            file_handle.write(('<assembly name=%s>\n' % xml.sax.saxutils.quoteattr(os.path.abspath(result_file))).encode("utf-8"))
+
+            if result_file.lower().endswith(".json"):
+                with open(result_file) as json_handle:
+                    shard_tests = json.load(json_handle)["tests"]
+
+                for test_name in sorted(shard_tests):
+                    item = shard_tests[test_name]
+                    collection = xml.etree.ElementTree.Element("collection", {
+                        "total": "1",
+                        "passed": "1" if item["outcome"] == "pass" else "0",
+                        "failed": "1" if item["outcome"] == "fail" else "0",
+                        "skipped": "1" if item["outcome"] == "skip" else "0",
+                        "time": str(item["time"])
+                    })
+
+                    test_type = test_name
+                    if "config" in item:
+                        # The key is tagged with the configuration, see get_collection_result_key.
+                        collection.attrib["config"] = item["config"]
+                        test_type = test_name[:-len(" [%s]" % item["config"])]
+
+                    test = xml.etree.ElementTree.SubElement(collection, "test", { "type": test_type, "method": "" })
+                    test.attrib.update(item.get("usage", {}))
+                    if item.get("cached"):
+                        test.attrib["cached"] = "true"
+                    if item["outcome"] == "fail":
+                        xml.etree.ElementTree.SubElement(test, "failure").text = item.get("output")
+
+                    if not add_test(test_name, collection, file_handle):
+                        duplicate_count += 1
+            else:
+                for collection in iterate_test_collections(result_file):
+                    if collection.tag == "errors":
+                        if collection.text != None:
+                            file_handle.write(xml.etree.ElementTree.tostring(collection))
+                            file_handle.write(b"\n")
+
+                        continue
+
+                    if not add_test(get_collection_result_key(collection), collection, file_handle):
+                        duplicate_count += 1
+
+            file_handle.write(b"</assembly>\n")
+
+        file_handle.write(b"</assemblies>\n")
+
+    with open(json_location, "w") as file_handle:
+        json.dump({ "tests": merged_tests }, file_handle, indent=2, sort_keys=True)
+
+    if duplicate_count > 0:
+        print("Warning: %d tests were reported by more than one shard, keeping the first result." % duplicate_count)
+
+    print("Merged %d tests into %s and %s" % (len(merged_tests), test_run_location, json_location))
+
+def record_test_history(host_os, arch, build_type, coreclr_repo_location, test_location, tests, config=""):
+    """ Record the results of a run through runtest.proj in the test history
+
+    Args:
+        host_os (String)                : os
+        arch (String)                   : architecture
+        build_type (String)             : build configuration (debug, checked, release)
+        coreclr_repo_location (String)  : Location of coreclr git repo
+        test_location (String)          : path to coreclr tests
+        tests (defaultdict[String]: { }): The tests that were reported by 
+                                        : xunit
+        config (String)                 : test configuration, see get_test_config
+
+    Notes:
+        The python runner records its results as they come in; this is only
+        needed for runs that went through msbuild.
+    """
+
+    history = TestHistory(os.path.join(coreclr_repo_location, "bin", "Logs"), host_os, arch, build_type, config)
+    history.start_run()
+
+    try:
+        for test in tests:
+            test = tests[test]
+
+            if test["failed"] == "1":
+                outcome = "fail"
+            elif test["passed"] == "1":
+                outcome = "pass"
+            else:
+                outcome = "skip"
+
+            history.record(os.path.relpath(test["test_path"], test_location), outcome, test["time"])
+    finally:
+        history.close()
+
+def report_duration_changes(host_os, arch, build_type, coreclr_repo_location, test_location, tests, config="", exclude_latest_run=True, report_name=None):
+    """ Report the tests that got significantly slower or faster than usual
+
+    Args:
+        host_os (String)                : os
+        arch (String)                   : architecture
+        build_type (String)             : build configuration (debug, checked, release)
+        coreclr_repo_location (String)  : Location of coreclr git repo
+        test_location (String)          : path to coreclr tests
+        tests (defaultdict[String]: { }): The tests that were reported by 
+                                        : xunit
+        config (String)                 : test configuration, see get_test_config
+        exclude_latest_run (bool)       : the results are those of the latest
+                                        : run in the history, do not compare
+                                        : them with themselves
+        report_name (String)            : -matrix configuration of the tests,
+                                        : see TestConfiguration.report_name
+
+    Notes:
+        The duration of each passing test is compared with the median and
+        median absolute deviation of its recent passes, see
+        find_duration_changes. Cached passes did not run, so they are left
+        out. The changes are also written to
+        bin/Logs/testDurationChanges.json, for CI to gate on.
+    """
+
+    logs_dir = os.path.join(coreclr_repo_location, "bin", "Logs")
+
+    history = TestHistory(logs_dir, host_os, arch, build_type, config)
+    try:
+        statistics = history.duration_statistics(exclude_latest_run=exclude_latest_run)
+    finally:
+        history.close()
+
+    durations = {}
+    for test in tests:
+        test = tests[test]
+        if test["passed"] == "1" and not test["cached"]:
+            durations[normalize_test_name(os.path.relpath(test["test_path"], test_location))] = test["time"]
+
+    slower, faster = find_duration_changes(durations, statistics)
+
+    report_location = os.path.join(logs_dir, "testDurationChanges%s.json" % ("" if report_name is None else "." + report_name))
+    with open(report_location, "w") as file_handle:
+        json.dump({
+            "config": config,
+            "compared": len([test for test in durations if test in statistics]),
+            "thresholds": {
+                "score": duration_change_threshold,
+                "ratio": duration_change_min_ratio,
+                "seconds": duration_change_min_seconds,
+                "samples": duration_change_min_samples
+            },
+            "slower": slower,
+            "faster": faster
+        }, file_handle, indent=2, sort_keys=True)
+
+    if len(slower) == 0 and len(faster) == 0:
+        return
+
+    def print_changes_helper(changes):
+        for change in changes[:duration_change_report_count]:
+            print("%s (%.2f seconds, usually %.2f; %.1fx)" % (change["test"], change["time"], change["median"], change["ratio"]))
+
+    print("")
+    print("Test duration changes (details in %s):" % report_location)
+
+    if len(slower) > 0:
+        print("")
+        print("%d tests got slower:" % len(slower))
+        print("")
+        print_changes_helper(slower)
+
+    if len(faster) > 0:
+        print("")
+        print("%d tests got faster:" % len(faster))
+        print("")
+        print_changes_helper(faster)
+
 def print_summary(tests):
     """ Print a summary of the test results
 
@@ -1862,6 +3701,12 @@ def print_summary(tests):
     passed_tests.sort(key=lambda item: item["time"], reverse=True)
     skipped_tests.sort(key=lambda item: item["time"], reverse=True)
 
+    def label(item):
+        if item["config"] is None:
+            return item["test_path"]
+
+        return "%s [%s]" % (item["test_path"], item["config"])
+
     def print_tests_helper(tests, stop_count):
         for index, item in enumerate(tests):
             time = item["time"]
@@ -1891,7 +3736,7 @@ def print_summary(tests):
 
                 remainder_str = " %s %s" % (int(time_remainder), second_unit)
 
-            print("%s (%d %s%s)" % (item["test_path"], time, unit, remainder_str))
+            print("%s (%d %s%s)" % (label(item), time, unit, remainder_str))
 
             if stop_count != None:
                 if index >= stop_count:
@@ -1901,7 +3746,45 @@ def print_summary(tests):
         print("%d failed tests:" % len(failed_tests))
         print("")
         print_tests_helper(failed_tests, None)
+
+    configs = sorted(set(item["config"] for item in failed_tests + passed_tests + skipped_tests if item["config"] is not None))
+    if len(configs) > 0:
+        print("")
+        print("Results by configuration:")
+        print("")
+
+        for config in configs:
+            print("%s: %d passed, %d failed, %d skipped" % (config,
+                                                            len([item for item in passed_tests if item["config"] == config]),
+                                                            len([item for item in failed_tests if item["config"] == config]),
+                                                            len([item for item in skipped_tests if item["config"] == config])))
         
+    # Resource usage is only known for runs through the python runner.
+    measured_tests = [item for item in failed_tests + passed_tests if item["usage"] is not None]
+
+    def print_usage_helper(tests):
+        for item in tests:
+            usage = item["usage"]
+            cpu_percent = 100.0 * usage.cpu_time / item["time"] if item["time"] > 0 else 0.0
+
+            print("%s (peak %d MB, cpu %.1f seconds = %d%% of wall time, %d/%d blocks read/written)" % (label(item),
+                                                                                                      usage.max_rss_kb // 1024,
+                                                                                                      usage.cpu_time,
+                                                                                                      cpu_percent,
+                                                                                                      usage.block_reads,
+                                                                                                      usage.block_writes))
+
+    if len(measured_tests) > 0:
+        print("")
+        print("%d tests with the highest peak memory:" % min(heaviest_test_count, len(measured_tests)))
+        print("")
+        print_usage_helper(sorted(measured_tests, key=lambda item: item["usage"].max_rss_kb, reverse=True)[:heaviest_test_count])
+
+        print("")
+        print("%d tests with the most cpu time:" % min(heaviest_test_count, len(measured_tests)))
+        print("")
+        print_usage_helper(sorted(measured_tests, key=lambda item: item["usage"].cpu_time, reverse=True)[:heaviest_test_count])
+
     # The following code is currently disabled, as it produces too much verbosity in a normal
     # test run. It could be put under a switch, or else just enabled as needed when investigating
     # test slowness.
@@ -1919,7 +3802,7 @@ def print_summary(tests):
         print("")
 
         for item in failed_tests:
-            print("[%s]: " % item["test_path"])
+            print("[%s]: " % label(item))
             print("")
             
             test_output = item["test_output"]
@@ -1961,7 +3844,73 @@ def print_summary(tests):
     print("Total skipped tests: %d" % len(skipped_tests))
     print("")
 
-def create_repro(host_os, arch, build_type, env, core_root, coreclr_repo_location, tests):
+def write_launch_json(repro_location, configurations):
+    """ Add configurations to, or create, <repro_location>/.vscode/launch.json
+
+    Args:
+        repro_location (String)     : where the repros are written
+        configurations ([{}])       : launch configurations to add; one with
+                                    : the name of an existing configuration
+                                    : replaces it
+
+    Notes:
+        The file is read and written once, however many configurations are
+        added.
+    """
+
+    vscode_dir = os.path.join(repro_location, ".vscode")
+    if not os.path.isdir(vscode_dir):
+        os.mkdir(vscode_dir)
+
+    launch_json_location = os.path.join(vscode_dir, "launch.json")
+
+    launch_json = {
+        "version": "0.2.0",
+        "configurations": []
+    }
+
+    if os.path.isfile(launch_json_location):
+        with open(launch_json_location) as file_handle:
+            launch_json = json.load(file_handle)
+
+    existing = launch_json["configurations"]
+    index_by_name = dict((config["name"], index) for index, config in enumerate(existing))
+
+    for configuration in configurations:
+        index = index_by_name.get(configuration["name"])
+
+        if index is not None:
+            existing[index] = configuration
+        else:
+            index_by_name[configuration["name"]] = len(existing)
+            existing.append(configuration)
+
+    json_str = json.dumps(launch_json,
+                          indent=4,
+                          separators=(',', ': '))
+
+    with open(launch_json_location, 'w') as file_handle:
+        file_handle.write(json_str)
+
+def test_matches_repro_filter(test, test_location, repro_filter):
+    """ Return whether a failed test matches one of the -repro_filter patterns
+
+    Args:
+        test (TestResult)       : the failed test
+        test_location (String)  : path to coreclr tests
+        repro_filter ([String]) : fnmatch patterns, matched against the test
+                                : name and its path relative to test_location
+    """
+
+    relative_path = os.path.relpath(test["test_path"], test_location).replace("\\", "/")
+
+    for pattern in repro_filter:
+        if fnmatch.fnmatch(test["name"], pattern) or fnmatch.fnmatch(relative_path, pattern):
+            return True
+
+    return False
+
+def create_repro(host_os, arch, build_type, env, core_root, coreclr_repo_location, tests, test_location=None, repro_filter=None, lazy_repros=False):
     """ Go through the failing tests and create repros for them
 
     Args:
@@ -1972,34 +3921,78 @@ def create_repro(host_os, arch, build_type, env, core_root, coreclr_repo_locatio
         coreclr_repo_location (String)  : Location of coreclr git repo
         tests (defaultdict[String]: { }): The tests that were reported by 
                                         : xunit
+        test_location (String)          : path to coreclr tests, for repro_filter
+        repro_filter ([String])         : only create repros for the failed tests
+                                        : matching one of these fnmatch patterns
+        lazy_repros (bool)              : do not create repros, only print how to
     
+    Notes:
+        Without repro_filter, bin/repro/<os>.<arch>.<build_type> is recreated
+        from scratch. With it, the repros are added to what is already there,
+        so repros can be created later, a few at a time, with
+        --analyze_results_only -repro_filter <pattern>.
     """
     assert tests is not None
 
     failed_tests = [tests[item] for item in tests if tests[item]["failed"] == "1"]
     if len(failed_tests) == 0:
         return
+
+    if lazy_repros and repro_filter is None:
+        print("")
+        print("Not creating repros for the %d failed tests. To create them, run runtest.py again with" % len(failed_tests))
+        print("--analyze_results_only and -repro_filter <pattern> (e.g. \"JIT/Regression/*\" or \"*\").")
+        return
+
+    if repro_filter is not None:
+        failed_tests = [test for test in failed_tests if test_matches_repro_filter(test, test_location, repro_filter)]
+        print("")
+        print("%d failed tests match -repro_filter." % len(failed_tests))
+
+        if len(failed_tests) == 0:
+            return
     
     bin_location = os.path.join(coreclr_repo_location, "bin")
     assert os.path.isdir(bin_location)
 
     repro_location = os.path.join(bin_location, "repro", "%s.%s.%s" % (host_os, arch, build_type))
-    if os.path.isdir(repro_location):
+    if os.path.isdir(repro_location) and repro_filter is None:
         shutil.rmtree(repro_location)
 
     print("")
     print("Creating repro files at: %s" % repro_location)
 
-    os.makedirs(repro_location)
+    if not os.path.isdir(repro_location):
+        os.makedirs(repro_location)
     assert os.path.isdir(repro_location)
 
     # Now that the repro_location exists under <coreclr_location>/bin/repro
     # create wrappers which will simply run the test with the correct environment
-    for test in failed_tests:
-        debug_env = DebugEnv(host_os, arch, build_type, env, core_root, coreclr_repo_location, test)
+    def write_repro(test):
+        test_env = env
+        if test["config"] is not None:
+            # Reproduce the -matrix configuration the test failed under.
+            test_env = parse_test_configuration(test["config"], 0).environment(env if env is not None else {})
+
+        debug_env = DebugEnv(host_os, arch, build_type, test_env, core_root, coreclr_repo_location, test)
         debug_env.write_repro()
 
-    print("Repro files written.")
+        return debug_env.get_launch_configuration()
+
+    worker_count = max(1, min(multiprocessing.cpu_count(), len(failed_tests)))
+
+    pool = multiprocessing.pool.ThreadPool(worker_count)
+    try:
+        configurations = pool.map(write_repro, failed_tests)
+    finally:
+        pool.close()
+        pool.join()
+
+    configurations = [configuration for configuration in configurations if configuration is not None]
+    if len(configurations) > 0:
+        write_launch_json(repro_location, configurations)
+
+    print("%d repro files written." % len(failed_tests))
 
 def do_setup(host_os, 
              arch, 
@@ -2049,9 +4042,26 @@ def do_setup(host_os,
         is_same_build_type = build_info["build_type"] == build_type
 
     # If we are inside altjit scenario, we ought to re-build Xunit test wrappers to consider
-    # ExcludeList items in issues.targets for both build arch and altjit arch
+    # ExcludeList items in issues.targets for both build arch and altjit arch. The altjit
+    # arch is one of the inputs build_test_wrappers tracks, so this only happens once.
     is_altjit_scenario = not args.altjit_arch is None
 
+    # The python runner runs the test scripts without the wrappers.
+    if unprocessed_args.build_xunit_test_wrappers or not unprocessed_args.python_runner:
+        is_same_build = build_info is not None and is_same_os and is_same_arch and is_same_build_type
+
+        success = build_test_wrappers(host_os,
+                                      arch,
+                                      build_type,
+                                      coreclr_repo_location,
+                                      test_location,
+                                      altjit_arch=args.altjit_arch,
+                                      rebuild_all=unprocessed_args.build_xunit_test_wrappers or not is_same_build,
+                                      adopt_existing=is_same_build and not is_altjit_scenario)
+
+        if not success:
+            sys.exit(1)
+
     return run_tests(host_os, 
                      arch,
                      build_type,
@@ -2069,7 +4079,27 @@ def do_setup(host_os,
                      large_version_bubble=unprocessed_args.large_version_bubble,
                      run_sequential=unprocessed_args.sequential,
                      limited_core_dumps=unprocessed_args.limited_core_dumps,
-                     run_in_context=unprocessed_args.run_in_context)
+                     run_in_context=unprocessed_args.run_in_context,
+                     python_runner=unprocessed_args.python_runner,
+                     cache_results=unprocessed_args.cache_results,
+                     adaptive_timeouts=unprocessed_args.adaptive_timeouts,
+                     failed_first=unprocessed_args.failed_first,
+                     rerun_failed_only=unprocessed_args.rerun_failed_only,
+                     retry_failures=unprocessed_args.retry_failures,
+                     batch_in_process=unprocessed_args.batch_in_process,
+                     batch_size=unprocessed_args.batch_size,
+                     matrix=unprocessed_args.matrix,
+                     cpu_partitioning=unprocessed_args.cpu_partitioning,
+                     numa_local=unprocessed_args.numa_local,
+                     heavy_test_cpus=unprocessed_args.heavy_test_cpus,
+                     parallel_count=unprocessed_args.parallel_count,
+                     shard_index=unprocessed_args.shard_index,
+                     shard_count=unprocessed_args.shard_count,
+                     shard_durations=unprocessed_args.shard_durations,
+                     artifact_cache=unprocessed_args.artifact_cache,
+                     xunit_console_sha256=unprocessed_args.xunit_console_sha256,
+                     coredump_budget=unprocessed_args.coredump_budget,
+                     progress_interval=unprocessed_args.progress_interval)
 
 ################################################################################
 # Main
@@ -2096,7 +4126,9 @@ def main(args):
     ret_code = 0
 
     env = get_environment(test_env=args.test_env)
-    if not args.analyze_results_only:
+    if args.merge_results is not None:
+        merge_test_results(args.merge_results, os.path.join(coreclr_repo_location, "bin", "Logs", "testRun.xml"))
+    elif not args.analyze_results_only:
         if args.test_env is not None:
             ret_code = do_setup(host_os,
                                 arch,
@@ -2126,8 +4158,44 @@ def main(args):
     tests = parse_test_results(host_os, arch, build_type, coreclr_repo_location, test_location)
 
     if tests is not None:
+        if not args.analyze_results_only and args.merge_results is None and not args.python_runner:
+            record_test_history(host_os, arch, build_type, coreclr_repo_location, test_location, tests, config=get_test_config(env))
+
         print_summary(tests)
-        create_repro(host_os, arch, build_type, env, core_root, coreclr_repo_location, tests)
+
+        # Each -matrix configuration is compared with its own history.
+        for config in sorted(set(tests[test]["config"] or "" for test in tests)):
+            config_tests = dict((test, tests[test]) for test in tests if (tests[test]["config"] or "") == config)
+
+            if config == "":
+                history_config = get_test_config(env)
+                report_name = None
+            else:
+                configuration = parse_test_configuration(config, 0)
+                history_config = configuration.history_config(env, os.environ)
+                report_name = configuration.report_name()
+
+            # Without a merge, the results being analyzed are the latest run in the history.
+            report_duration_changes(host_os,
+                                    arch,
+                                    build_type,
+                                    coreclr_repo_location,
+                                    test_location,
+                                    config_tests,
+                                    config=history_config,
+                                    exclude_latest_run=args.merge_results is None,
+                                    report_name=report_name)
+
+        create_repro(host_os,
+                     arch,
+                     build_type,
+                     env,
+                     core_root,
+                     coreclr_repo_location,
+                     tests,
+                     test_location=test_location,
+                     repro_filter=args.repro_filter,
+                     lazy_repros=args.lazy_repros)
 
     return ret_code
 
@@ -517,8 +517,8 @@ fi
 if [ ! -z "$buildXUnitWrappers" ]; then
     runtestPyArguments+=("--build_xunit_test_wrappers")
 else
-    echo "Skipping xunit wrapper build. If build-test was called on a different"
-    echo "host_os or arch the test run will most likely have failures."
+    echo "Only rebuilding the xunit wrappers whose inputs (test scripts, issues.targets,"
+    echo "host_os, arch or build type) changed since they were built."
 fi
 
 if (($verbose!=0)); then
@@ -0,0 +1,28 @@
+#!/bin/bash
+# This script records how the .sh file of a test launches the test executable, instead of launching it.
+# runtest.py uses it to find the tests it can run in a batch host, see scripts/test_batch_host.py.
+#
+# To use this script, set the CLRCustomTestLauncher environment variable to the full path of this script,
+# and the RunInContextProbeFile environment variable to the file to write.
+#
+# The script gets the same arguments as runincontext.sh:
+# 1. Full path to the directory of the test binaries (the test .sh file is in there)
+# 2. Filename of the test executable
+# 3. - n. Additional arguments that were passed to the test .sh
+#
+# It writes the expected exit code, the directory, the executable, the number of arguments, the arguments
+# and then the COMPlus_ and DOTNET_ variables of the test, one per line. It exits with the expected exit
+# code, so the test .sh reports success.
+
+{
+    echo "$CLRTestExpectedExitCode"
+    echo "$1"
+    echo "$2"
+    echo "$(($# - 2))"
+    if [ $# -gt 2 ]; then
+        printf '%s\n' "${@:3}"
+    fi
+    env | grep -E '^(COMPlus_|DOTNET_)' | sort
+} > "$RunInContextProbeFile"
+
+exit $CLRTestExpectedExitCode